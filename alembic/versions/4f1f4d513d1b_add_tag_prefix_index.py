@@ -0,0 +1,45 @@
+"""add tag prefix index for tag suggestions
+
+Revision ID: 4f1f4d513d1b
+Revises: 9ca0836bdedb
+Create Date: 2026-10-19 14:35:12.418250
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4f1f4d513d1b"
+down_revision: Union[str, None] = "9ca0836bdedb"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    text_pattern_ops lets postgres use the index for `LIKE 'prefix%'`
+    regardless of the database collation. The second index covers the
+    "tags near this timestamp" lookup and the per video tag listing.
+    """
+    op.execute(
+        """
+            CREATE INDEX tag_tag_list_id_lower_tag_idx
+            ON tag (tag_list_id, lower(tag) text_pattern_ops);
+
+            CREATE INDEX tag_tag_list_id_video_id_timestamp_idx
+            ON tag (tag_list_id, video_id, youtube_timestamp);
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+            DROP INDEX tag_tag_list_id_video_id_timestamp_idx;
+            DROP INDEX tag_tag_list_id_lower_tag_idx;
+        """
+    )
@@ -0,0 +1,64 @@
+"""add change versions to tag lists
+
+Revision ID: 5be2d07a93c6
+Revises: c52d7a9e1b34
+Create Date: 2026-10-19 16:20:31.284117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5be2d07a93c6"
+down_revision: Union[str, None] = "c52d7a9e1b34"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    tag_list.version is bumped by every change to the tag list, and each
+    tag records the version that added it, so that the changes since a
+    version can be read from the (tag_list_id, list_version) index.
+    The existing tags are numbered in the order they were added.
+    """
+    op.execute(
+        """
+            ALTER TABLE tag_list ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+            ALTER TABLE tag ADD COLUMN list_version BIGINT;
+
+            UPDATE tag t
+            SET list_version = numbered.list_version
+            FROM (
+                SELECT
+                    id,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY tag_list_id ORDER BY id
+                    ) as list_version
+                FROM tag
+            ) numbered
+            WHERE numbered.id = t.id;
+
+            UPDATE tag_list tl
+            SET version = tl.num_tags + CASE WHEN tl.deleted THEN 1 ELSE 0 END;
+
+            ALTER TABLE tag ALTER COLUMN list_version SET NOT NULL;
+
+            CREATE INDEX tag_tag_list_id_list_version_idx
+            ON tag (tag_list_id, list_version);
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+            DROP INDEX tag_tag_list_id_list_version_idx;
+            ALTER TABLE tag DROP COLUMN list_version;
+            ALTER TABLE tag_list DROP COLUMN version;
+        """
+    )
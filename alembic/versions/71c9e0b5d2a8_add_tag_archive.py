@@ -0,0 +1,73 @@
+"""add an archive for the tags of deleted tag lists
+
+Revision ID: 71c9e0b5d2a8
+Revises: d4a6f3c81e20
+Create Date: 2026-10-19 17:48:26.905317
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "71c9e0b5d2a8"
+down_revision: Union[str, None] = "d4a6f3c81e20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    PostgresDataModel.archive_deleted_tag_lists moves the tags of deleted
+    tag lists from tag into tag_archive, which has the same columns but
+    only the one index that restoring a tag list needs. archived_at is set
+    once all the tags of a deleted list have been moved, and the partial
+    index lets the job find the lists that still have to be archived
+    without reading the live ones.
+    """
+    op.execute(
+        """
+            CREATE TABLE tag_archive (
+                id INTEGER NOT NULL,
+                user_id INTEGER REFERENCES users ON DELETE CASCADE,
+                tag_list_id INTEGER NOT NULL REFERENCES tag_list ON DELETE CASCADE,
+                video_id INTEGER REFERENCES video ON DELETE CASCADE,
+                tag TEXT NOT NULL,
+                youtube_timestamp FLOAT NOT NULL,
+                created TIMESTAMP NOT NULL,
+                list_version BIGINT NOT NULL,
+                PRIMARY KEY (tag_list_id, id)
+            );
+
+            ALTER TABLE tag_list ADD COLUMN archived_at TIMESTAMP;
+
+            CREATE INDEX tag_list_to_archive_idx
+            ON tag_list (id)
+            WHERE deleted = true AND archived_at IS NULL;
+        """
+    )
+
+
+def downgrade() -> None:
+    """
+    Archived tags are moved back into tag first, so nothing is lost.
+    """
+    op.execute(
+        """
+            INSERT INTO tag (
+                id, user_id, tag_list_id, video_id, tag, youtube_timestamp,
+                created, list_version
+            )
+            SELECT
+                id, user_id, tag_list_id, video_id, tag, youtube_timestamp,
+                created, list_version
+            FROM tag_archive;
+
+            DROP INDEX tag_list_to_archive_idx;
+            ALTER TABLE tag_list DROP COLUMN archived_at;
+            DROP TABLE tag_archive;
+        """
+    )
@@ -0,0 +1,62 @@
+"""add full text search over tag lists and video titles
+
+Revision ID: a81c3e5f09d2
+Revises: 4f1f4d513d1b
+Create Date: 2026-10-19 15:02:47.103394
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a81c3e5f09d2"
+down_revision: Union[str, None] = "4f1f4d513d1b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    The search vectors are generated columns so that they are kept up to
+    date by postgres on every insert and update. Tag list names are weighted
+    above descriptions so that they rank higher. Deleted tag lists can never
+    be returned by a search, so they are left out of the index.
+    The (video_id, tag_list_id) index is used to find the tag lists a
+    matching video appears in.
+    """
+    op.execute(
+        """
+            ALTER TABLE tag_list ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(name, '')), 'A')
+                || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            ) STORED;
+
+            CREATE INDEX tag_list_search_vector_idx
+            ON tag_list USING GIN (search_vector)
+            WHERE deleted = false;
+
+            ALTER TABLE video ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', title)) STORED;
+
+            CREATE INDEX video_search_vector_idx
+            ON video USING GIN (search_vector);
+
+            CREATE INDEX tag_video_id_tag_list_id_idx
+            ON tag (video_id, tag_list_id);
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+            DROP INDEX tag_video_id_tag_list_id_idx;
+            ALTER TABLE video DROP COLUMN search_vector;
+            ALTER TABLE tag_list DROP COLUMN search_vector;
+        """
+    )
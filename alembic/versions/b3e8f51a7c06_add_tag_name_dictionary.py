@@ -0,0 +1,213 @@
+"""store tag names once in a tag_name dictionary
+
+Revision ID: b3e8f51a7c06
+Revises: 71c9e0b5d2a8
+Create Date: 2026-10-19 18:31:40.217593
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b3e8f51a7c06"
+down_revision: Union[str, None] = "71c9e0b5d2a8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+# rows updated per transaction while the app is still using the tables
+BATCH_SIZE = 50_000
+TABLES = ["tag", "tag_archive"]
+
+
+def upgrade() -> None:
+    """
+    Every tag row stored its name as text, so grouping the tags of a list by
+    name hashed and compared strings, and the most used names were stored
+    millions of times. tag_name holds each distinct name once (for all tag
+    lists, since most names are shared) and tag refers to it by id.
+
+    tag_name_id is filled in while the app keeps running: a trigger sets it
+    on the tags that are added in the meantime, and the existing rows are
+    updated in batches that commit on their own, walking each tag list along
+    the primary key. The index is built on each partition concurrently, and
+    the foreign key and NOT NULL are validated before the final step, which
+    only takes an exclusive lock for catalog changes. The text column is
+    dropped at the end, so the app has to be deployed with this migration.
+    Dropping a column doesn't give back its space until the rows are
+    rewritten, e.g. by VACUUM FULL, or as tags are archived and restored.
+    """
+    op.execute(
+        """
+            CREATE TABLE tag_name (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+
+            ALTER TABLE tag ADD COLUMN tag_name_id INTEGER;
+            ALTER TABLE tag_archive ADD COLUMN tag_name_id INTEGER;
+
+            CREATE FUNCTION tag_set_tag_name_id() RETURNS trigger AS $$
+            BEGIN
+                IF NEW.tag_name_id IS NULL THEN
+                    INSERT INTO tag_name (name) VALUES (NEW.tag)
+                    ON CONFLICT (name) DO NOTHING;
+                    SELECT id INTO NEW.tag_name_id
+                    FROM tag_name WHERE name = NEW.tag;
+                END IF;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER tag_set_tag_name_id BEFORE INSERT ON tag
+            FOR EACH ROW EXECUTE FUNCTION tag_set_tag_name_id();
+            CREATE TRIGGER tag_archive_set_tag_name_id BEFORE INSERT ON tag_archive
+            FOR EACH ROW EXECUTE FUNCTION tag_set_tag_name_id();
+        """
+    )
+    connection = op.get_bind()
+
+    with op.get_context().autocommit_block():
+        connection.execute(
+            sa.text(
+                "INSERT INTO tag_name (name)"
+                " SELECT tag FROM tag UNION SELECT tag FROM tag_archive"
+                " ON CONFLICT (name) DO NOTHING"
+            )
+        )
+        tag_list_ids = (
+            connection.execute(sa.text("SELECT id FROM tag_list ORDER BY id"))
+            .scalars()
+            .all()
+        )
+        for table in TABLES:
+            for tag_list_id in tag_list_ids:
+                last_id = 0
+                while True:
+                    ids = (
+                        connection.execute(
+                            sa.text(
+                                f"UPDATE {table} t SET tag_name_id = n.id"
+                                " FROM tag_name n"
+                                " WHERE n.name = t.tag"
+                                " AND t.tag_list_id = :tag_list_id"
+                                " AND t.id IN ("
+                                f"    SELECT id FROM {table}"
+                                "    WHERE tag_list_id = :tag_list_id AND id > :last_id"
+                                "    ORDER BY id LIMIT :batch_size"
+                                " )"
+                                " RETURNING t.id"
+                            ),
+                            {
+                                "tag_list_id": tag_list_id,
+                                "last_id": last_id,
+                                "batch_size": BATCH_SIZE,
+                            },
+                        )
+                        .scalars()
+                        .all()
+                    )
+                    if len(ids) < BATCH_SIZE:
+                        break
+                    last_id = max(ids)
+
+        # the index on the parent stays invalid until every partition's
+        # index is attached
+        connection.execute(
+            sa.text(
+                "CREATE INDEX tag_tag_list_id_tag_name_id_idx"
+                " ON ONLY tag (tag_list_id, tag_name_id)"
+            )
+        )
+        for i in range(PARTITIONS):
+            connection.execute(
+                sa.text(
+                    f"CREATE INDEX CONCURRENTLY tag_p{i}_tag_list_id_tag_name_id_idx"
+                    f" ON tag_p{i} (tag_list_id, tag_name_id)"
+                )
+            )
+            connection.execute(
+                sa.text(
+                    "ALTER INDEX tag_tag_list_id_tag_name_id_idx"
+                    f" ATTACH PARTITION tag_p{i}_tag_list_id_tag_name_id_idx"
+                )
+            )
+
+        # NOT VALID constraints only check new rows, validating them
+        # afterwards doesn't block writes. A partitioned table can't have a
+        # NOT VALID foreign key, so it is added to each partition and the
+        # final step attaches them to the one on tag.
+        for table in [f"tag_p{i}" for i in range(PARTITIONS)] + ["tag_archive"]:
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {table} ADD CONSTRAINT tag_tag_name_id_fkey"
+                    " FOREIGN KEY (tag_name_id) REFERENCES tag_name NOT VALID"
+                )
+            )
+            connection.execute(
+                sa.text(f"ALTER TABLE {table} VALIDATE CONSTRAINT tag_tag_name_id_fkey")
+            )
+        for table in TABLES:
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {table}_tag_name_id_not_null"
+                    " CHECK (tag_name_id IS NOT NULL) NOT VALID"
+                )
+            )
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {table}"
+                    f" VALIDATE CONSTRAINT {table}_tag_name_id_not_null"
+                )
+            )
+
+    # the validated CHECK constraints let SET NOT NULL skip the table scan
+    op.execute(
+        """
+            ALTER TABLE tag ADD CONSTRAINT tag_tag_name_id_fkey
+            FOREIGN KEY (tag_name_id) REFERENCES tag_name;
+            ALTER TABLE tag ALTER COLUMN tag_name_id SET NOT NULL;
+            ALTER TABLE tag DROP CONSTRAINT tag_tag_name_id_not_null;
+            ALTER TABLE tag_archive ALTER COLUMN tag_name_id SET NOT NULL;
+            ALTER TABLE tag_archive DROP CONSTRAINT tag_archive_tag_name_id_not_null;
+
+            DROP TRIGGER tag_set_tag_name_id ON tag;
+            DROP TRIGGER tag_archive_set_tag_name_id ON tag_archive;
+            DROP FUNCTION tag_set_tag_name_id();
+
+            DROP INDEX tag_tag_list_id_lower_tag_idx;
+            ALTER TABLE tag DROP COLUMN tag;
+            ALTER TABLE tag_archive DROP COLUMN tag;
+
+            ANALYZE tag_name;
+        """
+    )
+
+
+def downgrade() -> None:
+    """
+    Copies the names back into tag while holding an exclusive lock on it.
+    """
+    statements = []
+    for table in TABLES:
+        statements.append(
+            f"""
+                ALTER TABLE {table} ADD COLUMN tag TEXT;
+                UPDATE {table} t SET tag = n.name
+                FROM tag_name n WHERE n.id = t.tag_name_id;
+                ALTER TABLE {table} ALTER COLUMN tag SET NOT NULL;
+                ALTER TABLE {table} DROP COLUMN tag_name_id;
+            """
+        )
+    op.execute(
+        "\n".join(statements)
+        + """
+            CREATE INDEX tag_tag_list_id_lower_tag_idx
+            ON tag (tag_list_id, lower(tag) text_pattern_ops);
+            DROP TABLE tag_name;
+        """
+    )
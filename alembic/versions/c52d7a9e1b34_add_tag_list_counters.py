@@ -0,0 +1,77 @@
+"""add per tag list counters and index page sort indexes
+
+Revision ID: c52d7a9e1b34
+Revises: a81c3e5f09d2
+Create Date: 2026-10-19 15:41:09.552871
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c52d7a9e1b34"
+down_revision: Union[str, None] = "a81c3e5f09d2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    The counters are kept up to date by PostgresDataModel.add_tag, here we
+    only fill them in for the tags that already exist. Each index matches
+    one of the sort orders of the index page, and only covers the lists
+    that are shown there.
+    """
+    op.execute(
+        """
+            ALTER TABLE tag_list
+            ADD COLUMN num_tags INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN num_videos INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN last_tagged_at TIMESTAMP;
+
+            UPDATE tag_list tl
+            SET num_tags = counts.num_tags,
+                num_videos = counts.num_videos,
+                last_tagged_at = counts.last_tagged_at
+            FROM (
+                SELECT
+                    tag_list_id,
+                    COUNT(*) as num_tags,
+                    COUNT(DISTINCT video_id) as num_videos,
+                    MAX(created) as last_tagged_at
+                FROM tag
+                GROUP BY tag_list_id
+            ) counts
+            WHERE counts.tag_list_id = tl.id;
+
+            CREATE INDEX tag_list_created_idx
+            ON tag_list (created DESC, id DESC)
+            WHERE deleted = false;
+
+            CREATE INDEX tag_list_activity_idx
+            ON tag_list (COALESCE(last_tagged_at, created) DESC, id DESC)
+            WHERE deleted = false;
+
+            CREATE INDEX tag_list_num_tags_idx
+            ON tag_list (num_tags DESC, id DESC)
+            WHERE deleted = false;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+            DROP INDEX tag_list_num_tags_idx;
+            DROP INDEX tag_list_activity_idx;
+            DROP INDEX tag_list_created_idx;
+            ALTER TABLE tag_list
+            DROP COLUMN last_tagged_at,
+            DROP COLUMN num_videos,
+            DROP COLUMN num_tags;
+        """
+    )
@@ -0,0 +1,67 @@
+"""index the tags by name across tag lists
+
+Revision ID: c7e2a9d4b613
+Revises: f2b7c4d19e85
+Create Date: 2026-10-19 20:04:11.482719
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c7e2a9d4b613"
+down_revision: Union[str, None] = "f2b7c4d19e85"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+
+
+def upgrade() -> None:
+    """
+    Every other index on tag starts with tag_list_id, so finding a tag name
+    in every tag list (DataModel.find_tag_occurrences) read the whole
+    table. This one starts with the name, and its other columns are the
+    order the occurrences are paged in, so each partition's index is read
+    in order from the cursor and the partitions are merged.
+
+    It can't leave out the tags of deleted tag lists, since a partial index
+    can only test the columns of tag. Those tags are left out of the results
+    by the query, and out of the index once `flask archive-deleted-tags`
+    moves them to tag_archive.
+
+    The index is built on each partition concurrently, like in b3e8f51a7c06,
+    so tags can still be added while it is built.
+    """
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        # the index on the parent stays invalid until every partition's
+        # index is attached
+        connection.execute(
+            sa.text(
+                "CREATE INDEX tag_tag_name_id_occurrence_idx ON ONLY tag"
+                " (tag_name_id, tag_list_id, video_id, youtube_timestamp, id)"
+            )
+        )
+        for i in range(PARTITIONS):
+            connection.execute(
+                sa.text(
+                    f"CREATE INDEX CONCURRENTLY tag_p{i}_tag_name_id_occurrence_idx"
+                    f" ON tag_p{i}"
+                    " (tag_name_id, tag_list_id, video_id, youtube_timestamp, id)"
+                )
+            )
+            connection.execute(
+                sa.text(
+                    "ALTER INDEX tag_tag_name_id_occurrence_idx"
+                    f" ATTACH PARTITION tag_p{i}_tag_name_id_occurrence_idx"
+                )
+            )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX tag_tag_name_id_occurrence_idx;")
@@ -0,0 +1,208 @@
+"""partition the tag table by tag_list_id
+
+Revision ID: d4a6f3c81e20
+Revises: 5be2d07a93c6
+Create Date: 2026-10-19 17:05:12.618042
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d4a6f3c81e20"
+down_revision: Union[str, None] = "5be2d07a93c6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+# rows copied per transaction while the old table is still in use
+BATCH_SIZE = 50_000
+
+# (name, definition) of the indexes on tag, see the earlier migrations
+INDEXES = [
+    ("tag_tag_list_id_lower_tag_idx", "(tag_list_id, lower(tag) text_pattern_ops)"),
+    (
+        "tag_tag_list_id_video_id_timestamp_idx",
+        "(tag_list_id, video_id, youtube_timestamp)",
+    ),
+    ("tag_video_id_tag_list_id_idx", "(video_id, tag_list_id)"),
+    ("tag_tag_list_id_list_version_idx", "(tag_list_id, list_version)"),
+]
+
+FOREIGN_KEYS = ["tag_user_id_fkey", "tag_tag_list_id_fkey", "tag_video_id_fkey"]
+
+COLUMNS = (
+    "id, user_id, tag_list_id, video_id, tag, youtube_timestamp, created,"
+    " list_version"
+)
+
+
+def upgrade() -> None:
+    """
+    Every query on tag (except the video title search) is for a single tag
+    list, so with tag hash partitioned by tag_list_id postgres only touches
+    one partition per query, and vacuum and index maintenance work on
+    partitions a sixteenth of the size.
+
+    The rows are copied in batches that each commit on their own, while the
+    app keeps reading and writing the old table. Tags are never updated, so
+    only the tags added during the copy have to be copied in the final step,
+    which holds an exclusive lock on tag just long enough to copy them and
+    swap the tables. Tags deleted during the copy, directly or when their
+    tag list, video or user is deleted, may already have been copied, so a
+    trigger records them in tag_deleted and the final step deletes them from
+    the copy too. The primary key has to include the partition key,
+    so it becomes (tag_list_id, id), and tag_list_id becomes NOT NULL. Tags
+    without a tag list can't be reached by any query and are not copied.
+    """
+    partitions = "\n".join(
+        f"CREATE TABLE tag_p{i} PARTITION OF tag_partitioned"
+        f" FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {i});"
+        for i in range(PARTITIONS)
+    )
+    op.execute(
+        f"""
+            CREATE TABLE tag_partitioned (
+                id INTEGER NOT NULL DEFAULT nextval('tag_id_seq'),
+                user_id INTEGER REFERENCES users ON DELETE CASCADE,
+                tag_list_id INTEGER NOT NULL REFERENCES tag_list ON DELETE CASCADE,
+                video_id INTEGER REFERENCES video ON DELETE CASCADE,
+                tag TEXT NOT NULL,
+                youtube_timestamp FLOAT NOT NULL,
+                created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                list_version BIGINT NOT NULL
+            ) PARTITION BY HASH (tag_list_id);
+            {partitions}
+
+            CREATE UNLOGGED TABLE tag_deleted (
+                tag_list_id INTEGER,
+                id INTEGER NOT NULL
+            );
+            CREATE FUNCTION tag_record_delete() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO tag_deleted (tag_list_id, id)
+                VALUES (OLD.tag_list_id, OLD.id);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            CREATE TRIGGER tag_record_delete AFTER DELETE ON tag
+            FOR EACH ROW EXECUTE FUNCTION tag_record_delete();
+        """
+    )
+    connection = op.get_bind()
+    # waits for the transactions that are inserting tags, after that every
+    # tag up to high_water is committed and will never change
+    op.execute("LOCK TABLE tag IN SHARE MODE")
+    high_water = connection.execute(
+        sa.text("SELECT COALESCE(MAX(id), 0) FROM tag")
+    ).scalar_one()
+
+    with op.get_context().autocommit_block():
+        for start in range(0, high_water, BATCH_SIZE):
+            while True:
+                try:
+                    connection.execute(
+                        sa.text(
+                            f"INSERT INTO tag_partitioned ({COLUMNS})"
+                            f" SELECT {COLUMNS} FROM tag"
+                            " WHERE id > :start AND id <= :end"
+                            " AND tag_list_id IS NOT NULL"
+                        ),
+                        {"start": start, "end": min(start + BATCH_SIZE, high_water)},
+                    )
+                    break
+                except sa.exc.IntegrityError:
+                    # a tag list, video or user was deleted while the batch
+                    # read its tags, which are gone when the batch is retried
+                    pass
+        # built before the swap, so that they don't hold the lock
+        connection.execute(
+            sa.text(
+                "ALTER TABLE tag_partitioned"
+                " ADD CONSTRAINT tag_partitioned_pkey PRIMARY KEY (tag_list_id, id)"
+            )
+        )
+        for name, definition in INDEXES:
+            connection.execute(
+                sa.text(
+                    f"CREATE INDEX tag_partitioned_{name}"
+                    f" ON tag_partitioned {definition}"
+                )
+            )
+        connection.execute(sa.text("ANALYZE tag_partitioned"))
+
+    renames = "\n".join(
+        [f"ALTER INDEX tag_partitioned_{name} RENAME TO {name};" for name, _ in INDEXES]
+        + [
+            f"ALTER TABLE tag RENAME CONSTRAINT"
+            f" {name.replace('tag_', 'tag_partitioned_', 1)} TO {name};"
+            for name in FOREIGN_KEYS
+        ]
+    )
+    op.execute(
+        f"""
+            LOCK TABLE tag IN ACCESS EXCLUSIVE MODE;
+
+            DELETE FROM tag_partitioned t
+            USING tag_deleted d
+            WHERE t.tag_list_id = d.tag_list_id AND t.id = d.id;
+            INSERT INTO tag_partitioned ({COLUMNS})
+            SELECT {COLUMNS} FROM tag
+            WHERE id > {int(high_water)} AND tag_list_id IS NOT NULL;
+
+            ALTER SEQUENCE tag_id_seq OWNED BY tag_partitioned.id;
+            DROP TABLE tag;
+            DROP TABLE tag_deleted;
+            DROP FUNCTION tag_record_delete();
+            ALTER TABLE tag_partitioned RENAME TO tag;
+            ALTER INDEX tag_partitioned_pkey RENAME TO tag_pkey;
+            {renames}
+        """
+    )
+
+
+def downgrade() -> None:
+    """
+    Copies everything back into a plain table while holding an exclusive
+    lock on tag.
+    """
+    indexes = "\n".join(
+        [f"CREATE INDEX {name} ON tag {definition};" for name, definition in INDEXES]
+        + [
+            f"ALTER TABLE tag RENAME CONSTRAINT"
+            f" {name.replace('tag_', 'tag_unpartitioned_', 1)} TO {name};"
+            for name in FOREIGN_KEYS
+        ]
+    )
+    op.execute(
+        f"""
+            LOCK TABLE tag IN ACCESS EXCLUSIVE MODE;
+
+            CREATE TABLE tag_unpartitioned (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users ON DELETE CASCADE,
+                tag_list_id INTEGER REFERENCES tag_list ON DELETE CASCADE,
+                video_id INTEGER REFERENCES video ON DELETE CASCADE,
+                tag TEXT NOT NULL,
+                youtube_timestamp FLOAT NOT NULL,
+                created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                list_version BIGINT NOT NULL
+            );
+            INSERT INTO tag_unpartitioned ({COLUMNS})
+            SELECT {COLUMNS} FROM tag;
+            SELECT setval(
+                'tag_unpartitioned_id_seq',
+                (SELECT last_value FROM tag_id_seq)
+            );
+
+            DROP TABLE tag;
+            ALTER TABLE tag_unpartitioned RENAME TO tag;
+            ALTER SEQUENCE tag_unpartitioned_id_seq RENAME TO tag_id_seq;
+            ALTER INDEX tag_unpartitioned_pkey RENAME TO tag_pkey;
+            {indexes}
+        """
+    )
@@ -0,0 +1,47 @@
+"""add a flag for videos whose details are still being fetched
+
+Revision ID: f2b7c4d19e85
+Revises: b3e8f51a7c06
+Create Date: 2026-10-19 19:12:40.318204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f2b7c4d19e85"
+down_revision: Union[str, None] = "b3e8f51a7c06"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    New videos are inserted with a placeholder title and thumbnail, and
+    details_pending set until the resolver in videobookmarks.video_details
+    fills them in from youtube. The partial index lets a worker that starts
+    find the videos left pending by one that stopped, without reading the
+    others. Adding a column with a constant default doesn't rewrite the
+    table.
+    """
+    op.execute(
+        """
+            ALTER TABLE video
+                ADD COLUMN details_pending BOOLEAN NOT NULL DEFAULT false;
+            CREATE INDEX video_details_pending_idx ON video (id)
+                WHERE details_pending;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+            DROP INDEX video_details_pending_idx;
+            ALTER TABLE video DROP COLUMN details_pending;
+        """
+    )
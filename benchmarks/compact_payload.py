@@ -0,0 +1,122 @@
+"""
+Compare the size of the plain json and compact encodings of the
+/get_tags, /get_videos and /video_tags payloads for a synthetic tag list.
+
+    python benchmarks/compact_payload.py --videos 500 --tags 2000 --rows 100000
+
+This needs videobookmarks to be installed (`python3 -m pip install .`) and,
+like the app itself, the DB_URL environment variable to be set, although no
+database connection is made.
+
+Sizes are reported raw and gzipped, since most of the duplication that the
+compact encoding removes would otherwise be left for the compressor.
+"""
+
+import argparse
+import dataclasses
+import gzip
+import json
+import random
+import string
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Sequence
+
+from videobookmarks import compact
+from videobookmarks.datamodel.datamodel import GroupedTag, GroupedVideo, Tag
+
+
+def random_word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def synthetic_tag_list(
+    num_videos: int, num_tags: int, num_rows: int, seed: int
+) -> tuple[List[GroupedTag], List[GroupedVideo], List[Tag]]:
+    rng = random.Random(seed)
+    links = [random_word(rng, 11) for _ in range(num_videos)]
+    names = [random_word(rng, rng.randint(3, 15)) for _ in range(num_tags)]
+    # a few tags are used far more than the rest
+    weights = [1 / (rank + 1) for rank in range(num_tags)]
+    tag_links: Dict[str, set[str]] = defaultdict(set)
+    tag_counts: Dict[str, int] = defaultdict(int)
+    video_tags: Dict[str, set[str]] = defaultdict(set)
+    video_counts: Dict[str, int] = defaultdict(int)
+    first_video_tags = []
+    for name in rng.choices(names, weights, k=num_rows):
+        link = rng.choice(links)
+        tag_links[name].add(link)
+        tag_counts[name] += 1
+        video_tags[link].add(name)
+        video_counts[link] += 1
+        if link == links[0]:
+            first_video_tags.append(
+                Tag(
+                    user_id=1,
+                    tag_list_id=1,
+                    video_id=1,
+                    tag=name,
+                    youtube_timestamp=round(rng.uniform(0, 3600), 3),
+                )
+            )
+    grouped_tags = [
+        GroupedTag(tag=name, count=tag_counts[name], links=sorted(tag_links[name]))
+        for name in sorted(tag_counts)
+    ]
+    grouped_videos = [
+        GroupedVideo(
+            link=link,
+            thumbnail=f"https://i.ytimg.com/vi/{link}/default.jpg",
+            title=random_word(rng, 40),
+            num_tags=video_counts[link],
+            tags=sorted(video_tags[link]),
+        )
+        for link in sorted(video_counts, key=video_counts.__getitem__, reverse=True)
+    ]
+    return grouped_tags, grouped_videos, first_video_tags
+
+
+def timed(encode: Callable[[], bytes]) -> tuple[bytes, float]:
+    start = time.perf_counter()
+    body = encode()
+    return body, (time.perf_counter() - start) * 1000
+
+
+def report(name: str, row_type: Any, rows: Sequence[Any]) -> None:
+    encodings: Dict[str, Callable[[], bytes]] = {
+        "json": lambda: json.dumps(
+            [dataclasses.asdict(row) for row in rows], separators=(",", ":")
+        ).encode(),
+        "compact json": lambda: json.dumps(
+            compact.encode_compact(row_type, rows), separators=(",", ":")
+        ).encode(),
+    }
+    if compact.msgpack is not None:
+        encodings["compact msgpack"] = lambda: compact.msgpack.packb(
+            compact.encode_compact(row_type, rows)
+        )
+    print(f"{name} ({len(rows)} rows)")
+    print(f"  {'encoding':<16}{'bytes':>12}{'gzip bytes':>12}{'encode ms':>12}")
+    for encoding, encode in encodings.items():
+        body, elapsed = timed(encode)
+        gzipped = len(gzip.compress(body, 6))
+        print(f"  {encoding:<16}{len(body):>12}{gzipped:>12}{elapsed:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    grouped_tags, grouped_videos, video_tags = synthetic_tag_list(
+        args.videos, args.tags, args.rows, args.seed
+    )
+    report("/get_tags", GroupedTag, grouped_tags)
+    report("/get_videos", GroupedVideo, grouped_videos)
+    report("/video_tags", Tag, video_tags)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Bytes saved versus CPU time spent for each encoding and level, on a
+synthetic /get_tags and /get_videos payload and on the static files.
+
+    python benchmarks/compression.py --rows 100000
+
+This needs videobookmarks to be installed (`python3 -m pip install .`) and
+the DB_URL environment variable to be set, although no database connection
+is made.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import time
+from typing import Dict
+
+from compact_payload import synthetic_tag_list
+
+from videobookmarks import compression
+
+REPEATS = 5
+
+
+def report(name: str, data: bytes) -> None:
+    print(f"{name} ({len(data)} bytes)")
+    print(
+        f"  {'encoding':<10}{'level':>6}{'bytes':>12}{'saved':>8}{'ms':>10}{'MB/s':>10}"
+    )
+    for encoding in compression.available_encodings():
+        for level in (1, 4, 6, 9):
+            start = time.perf_counter()
+            for _ in range(REPEATS):
+                compressed = compression.compress(data, encoding, level)
+            elapsed = (time.perf_counter() - start) / REPEATS
+            saved = 1 - len(compressed) / len(data)
+            throughput = len(data) / elapsed / 1e6
+            print(
+                f"  {encoding:<10}{level:>6}{len(compressed):>12}"
+                f"{saved:>8.0%}{elapsed * 1000:>10.2f}{throughput:>10.1f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+    grouped_tags, grouped_videos, _ = synthetic_tag_list(
+        args.videos, args.tags, args.rows, seed=0
+    )
+    payloads: Dict[str, bytes] = {
+        "/get_tags": json.dumps(
+            [dataclasses.asdict(tag) for tag in grouped_tags]
+        ).encode(),
+        "/get_videos": json.dumps(
+            [dataclasses.asdict(video) for video in grouped_videos]
+        ).encode(),
+    }
+    static_folder = os.path.join(os.path.dirname(compression.__file__), "static")
+    for filename in sorted(os.listdir(static_folder)):
+        with open(os.path.join(static_folder, filename), "rb") as f:
+            payloads[f"static/{filename}"] = f.read()
+    for name, data in payloads.items():
+        report(name, data)
+
+
+if __name__ == "__main__":
+    main()
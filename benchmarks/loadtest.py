@@ -0,0 +1,308 @@
+"""
+Drive the app over http with concurrent scripted users and report the
+throughput and latency of each route.
+
+    python benchmarks/seed_dataset.py --tags 1000000
+    python benchmarks/loadtest.py --users 16 --duration 60
+
+Each virtual user logs in as one of the seeded users and loops through the
+scenarios, picking a random seeded tag list (popular ones more often) each
+time:
+
+    browse: index -> search -> next page -> view a tag list, which syncs it
+            with /changes and reads /get_tags and /get_videos
+    tag:    open a video for tagging -> /video_tags -> suggestions while
+            typing -> add_tag
+
+Without --url the app is created in this process and served by werkzeug's
+threaded server on a free port, which is enough to compare changes to the
+queries. Point --url at a deployment (e.g. gunicorn) to measure the whole
+stack. The seeded data is read from DB_URL, or --db-url.
+"""
+
+import argparse
+import collections
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests  # type: ignore
+from psycopg import connect
+from werkzeug.serving import make_server
+
+from seed_dataset import PASSWORD, PREFIX, zipf_weights
+
+# (tag_list_id, [(video_id, link), ...]), only tag lists that have tags
+TagListSample = Tuple[int, List[Tuple[int, str]]]
+
+
+class Results:
+    """
+    The latencies of every request, by route.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.errors: Dict[str, int] = collections.defaultdict(int)
+
+    def record(self, route: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    The nearest rank percentile of values, which must be sorted.
+    """
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class VirtualUser:
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        samples: List[TagListSample],
+        weights: List[float],
+        results: Results,
+        rng: random.Random,
+        think_time: float,
+    ):
+        self.url = url
+        self.username = username
+        self.samples = samples
+        self.weights = weights
+        self.results = results
+        self.rng = rng
+        self.think_time = think_time
+        self.session = requests.Session()
+
+    def request(
+        self, route: str, method: str, path: str, **kwargs: object
+    ) -> requests.Response:
+        start = time.perf_counter()
+        response = self.session.request(method, self.url + path, **kwargs)
+        # read the whole body, like a browser would
+        response.content
+        self.results.record(route, time.perf_counter() - start, response.ok)
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+        return response
+
+    def login(self) -> None:
+        self.request(
+            "/authenticate/login",
+            "POST",
+            "/authenticate/login",
+            data={"username": self.username, "password": PASSWORD},
+            allow_redirects=False,
+        )
+
+    def pick(self) -> TagListSample:
+        return self.rng.choices(self.samples, cum_weights=self.weights)[0]
+
+    def browse(self) -> None:
+        tag_list_id, _ = self.pick()
+        self.request("/", "GET", "/")
+        word = self.rng.choice(["goal", "music", "review", "boss", "dance"])
+        self.request("/?q=<word>", "GET", f"/?q={word}")
+        self.request("/?sort=activity", "GET", "/?sort=activity")
+        self.request("/<id>/view", "GET", f"/{tag_list_id}/view")
+        changes = self.request("/changes/<id>", "GET", f"/changes/{tag_list_id}")
+        self.request("/get_tags/<id>", "GET", f"/get_tags/{tag_list_id}")
+        self.request("/get_videos/<id>", "GET", f"/get_videos/{tag_list_id}")
+        if changes.ok:
+            version = changes.json()["version"]
+            self.request(
+                "/changes/<id>?since=<v>",
+                "GET",
+                f"/changes/{tag_list_id}?since={version}",
+            )
+
+    def tag(self) -> None:
+        tag_list_id, videos = self.pick()
+        if not videos:
+            return
+        video_id, link = self.rng.choice(videos)
+        self.request("/tagging/<id>/<link>", "GET", f"/tagging/{tag_list_id}/{link}")
+        self.request(
+            "/video_tags/<video>/<id>", "GET", f"/video_tags/{video_id}/{tag_list_id}"
+        )
+        timestamp = round(self.rng.uniform(0, 3600), 2)
+        word = self.rng.choice(["goal", "music", "review", "boss", "dance"])
+        for length in (1, 2, 3):
+            self.request(
+                "/suggest_tags/<id>",
+                "GET",
+                f"/suggest_tags/{tag_list_id}",
+                params={
+                    "prefix": word[:length],
+                    "video_id": video_id,
+                    "timestamp": timestamp,
+                },
+            )
+        self.request(
+            "/add_tag",
+            "POST",
+            "/add_tag",
+            json={
+                "tag": word,
+                "timestamp": timestamp,
+                "tag_list_id": tag_list_id,
+                "yt_video_id": link,
+            },
+        )
+
+    def run(self, deadline: float, tag_ratio: float) -> None:
+        self.login()
+        while time.monotonic() < deadline:
+            scenario: Callable[[], None] = (
+                self.tag if self.rng.random() < tag_ratio else self.browse
+            )
+            try:
+                scenario()
+            except requests.RequestException as e:
+                self.results.record(type(e).__name__, 0.0, False)
+
+
+def load_samples(
+    db_url: str, videos_per_list: int
+) -> Tuple[List[str], List[TagListSample]]:
+    """
+    :return: the seeded usernames, and the seeded tag lists with a few of
+            their videos, largest tag list first
+    """
+    with connect(db_url) as connection:
+        usernames = [
+            row[0]
+            for row in connection.execute(
+                "SELECT username FROM users WHERE username LIKE %s",
+                (f"{PREFIX}_%",),
+            )
+        ]
+        rows = connection.execute(
+            "SELECT tl.id, ARRAY_AGG(v.id) as video_ids, ARRAY_AGG(v.link) as links"
+            " FROM tag_list tl"
+            " JOIN LATERAL ("
+            "    SELECT DISTINCT video_id FROM ("
+            "        SELECT video_id FROM tag WHERE tag_list_id = tl.id LIMIT %s"
+            "    ) t"
+            " ) s ON true"
+            " JOIN video v ON v.id = s.video_id"
+            " WHERE tl.name LIKE %s AND tl.deleted = false"
+            " GROUP BY tl.id"
+            " ORDER BY tl.num_tags DESC",
+            (videos_per_list * 20, f"{PREFIX}%"),
+        ).fetchall()
+    samples = [
+        (tag_list_id, list(zip(video_ids, links))[:videos_per_list])
+        for tag_list_id, video_ids, links in rows
+    ]
+    return usernames, samples
+
+
+def serve_in_process(
+    config: Optional[Dict[str, object]] = None
+) -> Tuple[str, Callable[[], None]]:
+    """
+    :param config: overrides of the app config
+    :return: the url of the app, and a function that stops it
+    """
+    from videobookmarks import create_app
+
+    # a test config turns off the redirect to https
+    app = create_app({"SECRET_KEY": "loadtest", **(config or {})})
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    # don't print a line for every request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def report(results: Results, elapsed: float) -> None:
+    print(
+        f"{'route':<28}{'requests':>10}{'errors':>8}{'req/s':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    total = 0
+    for route in sorted(results.latencies):
+        latencies = sorted(results.latencies[route])
+        total += len(latencies)
+        print(
+            f"{route:<28}{len(latencies):>10}{results.errors[route]:>8}"
+            f"{len(latencies) / elapsed:>9.1f}"
+            f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.95) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+        )
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="the app to test, by default one in process")
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--users", type=int, default=8, help="concurrent users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument(
+        "--tag-ratio",
+        type=float,
+        default=0.3,
+        help="the fraction of scenarios that add a tag rather than browse",
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=0.0, help="mean seconds between requests"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+
+    usernames, samples = load_samples(args.db_url, videos_per_list=10)
+    if not usernames or not samples:
+        parser.error("no seeded data found, run benchmarks/seed_dataset.py first")
+    # popular tag lists are visited more often
+    weights = zipf_weights(len(samples), 1.0)
+
+    stop: Optional[Callable[[], None]] = None
+    url = args.url
+    if url is None:
+        url, stop = serve_in_process()
+    results = Results()
+    rng = random.Random(args.seed)
+    deadline = time.monotonic() + args.duration
+    threads = []
+    start = time.perf_counter()
+    for i in range(args.users):
+        user = VirtualUser(
+            url.rstrip("/"),
+            usernames[i % len(usernames)],
+            samples,
+            weights,
+            results,
+            random.Random(rng.random()),
+            args.think_time,
+        )
+        thread = threading.Thread(target=user.run, args=(deadline, args.tag_ratio))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if stop is not None:
+        stop()
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measure the latency of the other routes while many users log in at once,
+with the passwords hashed on the request threads and in worker processes.
+
+    python benchmarks/seed_dataset.py --tags 1000000
+    python benchmarks/login_storm.py --logins 16 --readers 4 --duration 20
+
+For each mode the app is created in this process and served by werkzeug's
+threaded server, then --logins threads log in over and over while --readers
+threads read /get_tags of the seeded tag lists. The p50/p95/p99 of both are
+reported, along with the 503s of logins that were refused because too many
+passwords were pending. The seeded data is read from DB_URL, or --db-url.
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import requests  # type: ignore
+
+from loadtest import Results, load_samples, percentile, serve_in_process
+from seed_dataset import PASSWORD
+
+# mode: the config overrides of the app
+MODES: Dict[str, Dict[str, object]] = {
+    "request thread": {"PASSWORD_HASH_WORKERS": 0, "PASSWORD_HASH_MAX_PENDING": 1000},
+    "worker processes": {},
+}
+
+
+def log_in(url: str, usernames: List[str], results: Results, deadline: float) -> None:
+    session = requests.Session()
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        response = session.post(
+            f"{url}/authenticate/login",
+            data={"username": rng.choice(usernames), "password": PASSWORD},
+            allow_redirects=False,
+        )
+        route = "login (503)" if response.status_code == 503 else "login"
+        results.record(route, time.perf_counter() - start, response.status_code < 500)
+
+
+def read_tags(
+    url: str, tag_list_ids: List[int], results: Results, deadline: float
+) -> None:
+    session = requests.Session()
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        response = session.get(f"{url}/get_tags/{rng.choice(tag_list_ids)}")
+        response.content
+        results.record("/get_tags/<id>", time.perf_counter() - start, response.ok)
+
+
+def run(
+    config: Dict[str, object],
+    usernames: List[str],
+    tag_list_ids: List[int],
+    args: argparse.Namespace,
+) -> Tuple[Results, float]:
+    url, stop = serve_in_process(config)
+    # start the worker processes before measuring
+    requests.post(
+        f"{url}/authenticate/login",
+        data={"username": usernames[0], "password": PASSWORD},
+        allow_redirects=False,
+    )
+    results = Results()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=log_in, args=(url, usernames, results, deadline))
+        for _ in range(args.logins)
+    ] + [
+        threading.Thread(target=read_tags, args=(url, tag_list_ids, results, deadline))
+        for _ in range(args.readers)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop()
+    return results, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--logins", type=int, default=16, help="login threads")
+    parser.add_argument("--readers", type=int, default=4, help="/get_tags threads")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+    os.environ.setdefault("DB_URL", args.db_url)
+
+    usernames, samples = load_samples(args.db_url, videos_per_list=1)
+    if not usernames or not samples:
+        parser.error("no seeded data found, run benchmarks/seed_dataset.py first")
+    tag_list_ids = [tag_list_id for tag_list_id, _ in samples[:100]]
+
+    print(
+        f"{'mode':<18}{'route':<16}{'requests':>10}{'req/s':>8}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    for mode, config in MODES.items():
+        results, elapsed = run(config, usernames, tag_list_ids, args)
+        for route in sorted(results.latencies):
+            latencies = sorted(results.latencies[route])
+            print(
+                f"{mode:<18}{route:<16}{len(latencies):>10}"
+                f"{len(latencies) / elapsed:>8.1f}"
+                f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+                f"{percentile(latencies, 0.95) * 1000:>9.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Measure how long the tagging page of a video that isn't in the database
+yet takes, with its details fetched on the request thread and in the
+background.
+
+    python benchmarks/seed_dataset.py --tags 1000000
+    python benchmarks/new_videos.py --visitors 8 --videos 200 --latency 0.3
+
+The details come from a fake provider that sleeps for --latency seconds per
+call, standing in for the youtube api. For each mode the app is created in
+this process and served by werkzeug's threaded server, then --visitors
+threads open the tagging pages of --videos new videos between them. The
+p50/p95/p99 of the pages and the time until every video has its details
+are reported. The seeded data is read from DB_URL, or --db-url, and the
+new videos are left in it.
+"""
+
+import argparse
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Sequence, Tuple
+
+import requests  # type: ignore
+from psycopg import connect
+
+from loadtest import Results, load_samples, percentile, serve_in_process
+from videobookmarks.datamodel.datamodel import VideoResolver
+
+# mode: the config overrides of the app
+MODES: Dict[str, Dict[str, object]] = {
+    "request thread": {"VIDEO_DETAILS_WORKERS": 0},
+    "background": {},
+}
+
+
+def slow_provider(latency: float) -> VideoResolver:
+    def provider(links: Sequence[str]) -> Dict[str, Dict[str, str]]:
+        time.sleep(latency)
+        return {
+            link: {"title": f"Video {link}", "thumbnail_url": "thumbnail.jpg"}
+            for link in links
+        }
+
+    return provider
+
+
+def visit(url: str, tag_list_id: int, links: List[str], results: Results) -> None:
+    session = requests.Session()
+    for link in links:
+        start = time.perf_counter()
+        response = session.get(f"{url}/tagging/{tag_list_id}/{link}")
+        results.record("/tagging/<id>/<new>", time.perf_counter() - start, response.ok)
+
+
+def pending(db_url: str, links: List[str]) -> int:
+    with connect(db_url) as connection:
+        row = connection.execute(
+            "SELECT count(*) FROM video WHERE link = ANY(%s) AND details_pending",
+            (links,),
+        ).fetchone()
+        assert row is not None
+        return int(row[0])
+
+
+def run(
+    config: Dict[str, object], tag_list_id: int, args: argparse.Namespace
+) -> Tuple[Results, float]:
+    """
+    :return: the results, and how many seconds until every video had its
+            details
+    """
+    url, stop = serve_in_process(config)
+    links = [f"new_{uuid.uuid4().hex[:11]}" for _ in range(args.videos)]
+    results = Results()
+    threads = [
+        threading.Thread(
+            target=visit,
+            args=(url, tag_list_id, links[i :: args.visitors], results),
+        )
+        for i in range(args.visitors)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while pending(args.db_url, links):
+        time.sleep(0.05)
+    resolved = time.perf_counter() - start
+    stop()
+    return results, resolved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--visitors", type=int, default=8, help="threads")
+    parser.add_argument("--videos", type=int, default=200, help="new videos")
+    parser.add_argument(
+        "--latency", type=float, default=0.3, help="seconds per provider call"
+    )
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+    os.environ.setdefault("DB_URL", args.db_url)
+
+    _, samples = load_samples(args.db_url, videos_per_list=1)
+    if not samples:
+        parser.error("no seeded data found, run benchmarks/seed_dataset.py first")
+    tag_list_id = samples[0][0]
+
+    print(
+        f"{'mode':<16}{'pages':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'all details s':>15}"
+    )
+    for mode, config in MODES.items():
+        config = {"VIDEO_DETAILS_PROVIDER": slow_provider(args.latency), **config}
+        results, resolved = run(config, tag_list_id, args)
+        latencies = sorted(results.latencies["/tagging/<id>/<new>"])
+        print(
+            f"{mode:<16}{len(latencies):>7}"
+            f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.95) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+            f"{resolved:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
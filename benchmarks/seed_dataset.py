@@ -0,0 +1,259 @@
+"""
+Fill a database with a synthetic dataset that is shaped like real usage, for
+load tests and for looking at query plans on realistic table sizes.
+
+    python benchmarks/seed_dataset.py --users 200 --tag-lists 2000 \\
+        --videos 50000 --tags 5000000
+
+Tag names are drawn from a vocabulary with Zipf distributed frequencies, so
+a few names are used everywhere and most are rare, and the sizes of the tag
+lists and how often each video is tagged follow the same kind of curve.
+Rows are loaded with COPY and the tag list counters and versions are filled
+in afterwards, the same way the migrations backfill them.
+
+Every seeded user is called `loadtest_<n>` and has the password
+`loadtest`, and every seeded tag list name starts with `loadtest`, which
+is how benchmarks/loadtest.py finds them. The database must already be
+migrated (`alembic upgrade head`). It connects to DB_URL unless --db-url is
+given. Use --reset to remove an earlier seeded dataset first.
+"""
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+import string
+import time
+from typing import Iterator, List, Sequence, Tuple
+
+from psycopg import Connection, connect
+from werkzeug.security import generate_password_hash
+
+PREFIX = "loadtest"
+PASSWORD = "loadtest"
+
+WORDS = (
+    "goal save foul replay crowd laugh intro outro sponsor recap "
+    "fight chase dialogue music dance tutorial mistake highlight "
+    "interview montage cooking review unboxing speedrun glitch "
+    "boss cutscene ending"
+).split()
+
+
+def zipf_weights(n: int, exponent: float) -> List[float]:
+    """
+    Cumulative weights for random.choices, rank r is picked proportionally
+    to 1 / r ** exponent.
+    """
+    return list(itertools.accumulate(1 / rank**exponent for rank in range(1, n + 1)))
+
+
+def vocabulary(rng: random.Random, size: int) -> List[str]:
+    names = []
+    for i in range(size):
+        if i < len(WORDS):
+            names.append(WORDS[i])
+        else:
+            suffix = "".join(rng.choice(string.ascii_lowercase) for _ in range(4))
+            names.append(f"{rng.choice(WORDS)} {suffix}")
+    return names
+
+
+def split_zipf(
+    rng: random.Random, total: int, parts: int, exponent: float
+) -> List[int]:
+    """
+    Split total into parts sizes with a Zipf shaped distribution.
+    """
+    sizes = [0] * parts
+    order = list(range(parts))
+    rng.shuffle(order)
+    for index in rng.choices(order, cum_weights=zipf_weights(parts, exponent), k=total):
+        sizes[index] += 1
+    return sizes
+
+
+def reset(connection: Connection) -> None:
+    # tags and tag lists go with their users
+    connection.execute("DELETE FROM users WHERE username LIKE %s", (f"{PREFIX}_%",))
+    connection.execute(
+        "DELETE FROM video WHERE link LIKE %s"
+        " AND NOT EXISTS (SELECT 1 FROM tag WHERE tag.video_id = video.id)",
+        (f"{PREFIX}%",),
+    )
+
+
+def copy_rows(
+    connection: Connection, statement: str, rows: Iterator[Sequence[object]]
+) -> int:
+    count = 0
+    with connection.cursor().copy(statement) as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def seeded_ids(connection: Connection, table: str, column: str) -> List[int]:
+    rows = connection.execute(
+        f"SELECT id FROM {table} WHERE {column} LIKE %s ORDER BY id",
+        (f"{PREFIX}%",),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def tag_rows(
+    rng: random.Random,
+    user_ids: List[int],
+    tag_list_ids: List[int],
+    video_ids: List[int],
+    tag_name_ids: List[int],
+    num_tags: int,
+    exponent: float,
+) -> Iterator[Tuple[object, ...]]:
+    name_weights = zipf_weights(len(tag_name_ids), exponent)
+    video_weights = zipf_weights(len(video_ids), exponent)
+    list_sizes = split_zipf(rng, num_tags, len(tag_list_ids), exponent)
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    for tag_list_id, size in zip(tag_list_ids, list_sizes):
+        if size == 0:
+            continue
+        owner = rng.choice(user_ids)
+        # each list covers a handful of videos, popular videos more often
+        num_videos = max(1, min(len(video_ids), size // 20))
+        videos = rng.choices(video_ids, cum_weights=video_weights, k=num_videos)
+        chosen = rng.choices(tag_name_ids, cum_weights=name_weights, k=size)
+        for version, tag_name_id in enumerate(chosen, start=1):
+            yield (
+                owner,
+                tag_list_id,
+                rng.choice(videos),
+                tag_name_id,
+                round(rng.uniform(0, 3600), 2),
+                version,
+                start + datetime.timedelta(seconds=version),
+            )
+
+
+def seed(connection: Connection, args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    # hashing is deliberately slow, every user gets the same hash
+    password_hash = generate_password_hash(PASSWORD)
+
+    started = time.perf_counter()
+    copy_rows(
+        connection,
+        "COPY users (username, password) FROM STDIN",
+        ((f"{PREFIX}_{i}", password_hash) for i in range(args.users)),
+    )
+    user_ids = seeded_ids(connection, "users", "username")
+
+    def videos() -> Iterator[Tuple[object, ...]]:
+        for i in range(args.videos):
+            link = f"{PREFIX}{i:07d}"
+            words = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)))
+            yield link, f"https://i.ytimg.com/vi/{link}/default.jpg", words.title()
+
+    copy_rows(connection, "COPY video (link, thumbnail, title) FROM STDIN", videos())
+    video_ids = seeded_ids(connection, "video", "link")
+
+    def tag_lists() -> Iterator[Tuple[object, ...]]:
+        for i in range(args.tag_lists):
+            words = " ".join(rng.choices(WORDS, k=3))
+            yield (
+                rng.choice(user_ids),
+                f"{PREFIX} {i} {words}",
+                f"synthetic tag list about {words}",
+            )
+
+    copy_rows(
+        connection,
+        "COPY tag_list (user_id, name, description) FROM STDIN",
+        tag_lists(),
+    )
+    tag_list_ids = seeded_ids(connection, "tag_list", "name")
+    print(
+        f"{len(user_ids)} users, {len(video_ids)} videos,"
+        f" {len(tag_list_ids)} tag lists in {time.perf_counter() - started:.1f}s"
+    )
+
+    started = time.perf_counter()
+    names = vocabulary(rng, args.vocabulary)
+    # the tag_name dictionary is shared with the rest of the database
+    connection.execute(
+        "INSERT INTO tag_name (name) SELECT unnest(%s::text[])"
+        " ON CONFLICT (name) DO NOTHING",
+        (names,),
+    )
+    name_ids = dict(
+        connection.execute(
+            "SELECT name, id FROM tag_name WHERE name = ANY(%s)", (names,)
+        ).fetchall()
+    )
+    num_tags = copy_rows(
+        connection,
+        "COPY tag (user_id, tag_list_id, video_id, tag_name_id, youtube_timestamp,"
+        " list_version, created) FROM STDIN",
+        tag_rows(
+            rng,
+            user_ids,
+            tag_list_ids,
+            video_ids,
+            [name_ids[name] for name in names],
+            args.tags,
+            args.exponent,
+        ),
+    )
+    print(f"{num_tags} tags in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    connection.execute(
+        "UPDATE tag_list tl"
+        " SET num_tags = counts.num_tags,"
+        "     num_videos = counts.num_videos,"
+        "     last_tagged_at = counts.last_tagged_at,"
+        "     version = counts.num_tags"
+        " FROM ("
+        "    SELECT tag_list_id, COUNT(*) as num_tags,"
+        "        COUNT(DISTINCT video_id) as num_videos,"
+        "        MAX(created) as last_tagged_at"
+        "    FROM tag WHERE tag_list_id = ANY(%s)"
+        "    GROUP BY tag_list_id"
+        " ) counts"
+        " WHERE counts.tag_list_id = tl.id",
+        (tag_list_ids,),
+    )
+    connection.commit()
+    # fresh statistics, so that the plans match a long running database
+    connection.execute("ANALYZE")
+    print(f"counters and statistics in {time.perf_counter() - started:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tag-lists", type=int, default=2000)
+    parser.add_argument("--videos", type=int, default=50_000)
+    parser.add_argument("--tags", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument(
+        "--exponent", type=float, default=1.1, help="the exponent of the Zipf curves"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true")
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+    with connect(args.db_url) as connection:
+        if args.reset:
+            reset(connection)
+            connection.commit()
+        seed(connection, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measure how long a new worker takes to start and to serve its first
+requests, with and without the warm up in create_app.
+
+    python benchmarks/seed_dataset.py --tags 1000000
+    python benchmarks/startup.py --runs 10
+
+Every run starts a new python process that imports videobookmarks, calls
+create_app and requests the index, a tag list and the login page twice
+each with the test client, so the times include everything a fresh worker
+pays for except the http server. The medians over the runs are reported.
+The seeded data is read from DB_URL, or --db-url.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# mode: the config overrides of the app
+MODES: Dict[str, Dict[str, object]] = {
+    "cold": {"WARM_UP": False, "TEMPLATE_BYTECODE_CACHE": False, "DB_POOL_MAX_SIZE": 0},
+    "warm up": {},
+}
+
+# runs in the new process, prints the times in seconds as json
+WORKER = """
+import json, sys, time
+start = time.perf_counter()
+import videobookmarks
+times = {"import": time.perf_counter() - start}
+start = time.perf_counter()
+app = videobookmarks.create_app(json.loads(sys.argv[1]))
+times["create_app"] = time.perf_counter() - start
+client = app.test_client()
+for attempt in ("first", "second"):
+    for path in json.loads(sys.argv[2]):
+        start = time.perf_counter()
+        assert client.get(path).status_code == 200, path
+        times[f"{attempt} {path}"] = time.perf_counter() - start
+print(json.dumps(times))
+"""
+
+
+def run(
+    config: Dict[str, object], paths: List[str], env: Dict[str, str]
+) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER, json.dumps(config), json.dumps(paths)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    times: Dict[str, float] = json.loads(output.splitlines()[-1])
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+
+    from psycopg import connect
+
+    with connect(args.db_url) as connection:
+        row = connection.execute(
+            "SELECT id FROM tag_list WHERE deleted = false"
+            " ORDER BY num_tags DESC LIMIT 1"
+        ).fetchone()
+    if row is None:
+        parser.error("no tag lists found, run benchmarks/seed_dataset.py first")
+    paths = ["/", f"/{row[0]}/view", "/authenticate/login"]
+    env = dict(os.environ, DB_URL=args.db_url)
+    env.setdefault("YT_API_KEY", "startup")
+    # the package is imported from the checkout rather than installed
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+    results: Dict[str, Dict[str, List[float]]] = {}
+    for mode, config in MODES.items():
+        # a test config turns off the redirect to https
+        config = {"SECRET_KEY": "startup", "FRAGMENT_CACHE_MAX_BYTES": 0, **config}
+        results[mode] = {}
+        for _ in range(args.runs):
+            for name, seconds in run(config, paths, env).items():
+                results[mode].setdefault(name, []).append(seconds)
+
+    names = list(results["cold"])
+    print(f"{'median ms':<32}" + "".join(f"{mode:>10}" for mode in MODES))
+    for name in names:
+        print(
+            f"{name:<32}"
+            + "".join(
+                f"{statistics.median(results[mode][name]) * 1000:>10.1f}"
+                for mode in MODES
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
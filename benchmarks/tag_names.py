@@ -0,0 +1,162 @@
+"""
+Compare storing tag names as text on every tag with storing them once in the
+tag_name dictionary: the size of the tag rows and indexes, and the time of
+the grouping queries of PostgresDataModel on the largest tag lists.
+
+    python benchmarks/seed_dataset.py --tags 1000000
+    python benchmarks/tag_names.py --lists 5 --repeat 20
+
+Both layouts are copied from the current tag table into temporary tables,
+with the same indexes as tag had before and after the tag_name migration,
+so that the comparison doesn't depend on dead rows or on which revision the
+database is at. It connects to DB_URL unless --db-url is given.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import Dict, List
+
+from psycopg import Connection, connect
+
+# (name, before, after) of each query, for one tag list id
+QUERIES = [
+    (
+        "get_tag_list_tags",
+        "SELECT tag, COUNT(*) as count, ARRAY_AGG(DISTINCT v.link) as links"
+        " FROM text_tag t JOIN video v on t.video_id = v.id"
+        " WHERE tag_list_id = %s GROUP BY tag ORDER BY tag ASC",
+        "SELECT n.name as tag, g.count, g.links"
+        " FROM ("
+        "    SELECT tag_name_id, COUNT(*) as count,"
+        "        ARRAY_AGG(DISTINCT v.link) as links"
+        "    FROM dict_tag t JOIN video v on t.video_id = v.id"
+        "    WHERE tag_list_id = %s GROUP BY tag_name_id"
+        " ) g JOIN tag_name n ON n.id = g.tag_name_id"
+        " ORDER BY n.name ASC",
+    ),
+    (
+        "get_tag_list_videos",
+        "SELECT link, thumbnail, title, COUNT(*) as num_tags,"
+        " ARRAY_AGG(DISTINCT tag) as tags"
+        " FROM video v JOIN text_tag t ON t.video_id = v.id"
+        " WHERE t.tag_list_id = %s"
+        " GROUP BY link, thumbnail, title ORDER BY count(*) DESC",
+        "SELECT link, thumbnail, title, g.num_tags,"
+        " ARRAY("
+        "    SELECT name FROM tag_name WHERE id = ANY(g.tag_name_ids) ORDER BY name"
+        " ) as tags"
+        " FROM ("
+        "    SELECT video_id, COUNT(*) as num_tags,"
+        "        ARRAY_AGG(DISTINCT tag_name_id) as tag_name_ids"
+        "    FROM dict_tag WHERE tag_list_id = %s GROUP BY video_id"
+        " ) g JOIN video v ON v.id = g.video_id"
+        " ORDER BY g.num_tags DESC",
+    ),
+    (
+        "get_tag_counts",
+        "SELECT tag, COUNT(*) as count FROM text_tag"
+        " WHERE tag_list_id = %s GROUP BY tag",
+        "SELECT n.name as tag, g.count"
+        " FROM ("
+        "    SELECT tag_name_id, COUNT(*) as count FROM dict_tag"
+        "    WHERE tag_list_id = %s GROUP BY tag_name_id"
+        " ) g JOIN tag_name n ON n.id = g.tag_name_id",
+    ),
+]
+
+
+def create_tables(connection: Connection) -> None:
+    columns = "t.id, user_id, tag_list_id, video_id, youtube_timestamp, created"
+    connection.execute(
+        "CREATE TEMPORARY TABLE text_tag AS"
+        f" SELECT {columns}, n.name as tag, list_version"
+        " FROM tag t JOIN tag_name n ON n.id = t.tag_name_id"
+    )
+    connection.execute(
+        "CREATE TEMPORARY TABLE dict_tag AS"
+        f" SELECT {columns}, list_version, tag_name_id FROM tag t"
+    )
+    for table in ["text_tag", "dict_tag"]:
+        connection.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (tag_list_id, id)")
+        connection.execute(
+            f"CREATE INDEX ON {table} (tag_list_id, video_id, youtube_timestamp)"
+        )
+        connection.execute(f"CREATE INDEX ON {table} (video_id, tag_list_id)")
+        connection.execute(f"CREATE INDEX ON {table} (tag_list_id, list_version)")
+    connection.execute(
+        "CREATE INDEX ON text_tag (tag_list_id, lower(tag) text_pattern_ops)"
+    )
+    connection.execute("CREATE INDEX ON dict_tag (tag_list_id, tag_name_id)")
+    connection.execute("ANALYZE text_tag")
+    connection.execute("ANALYZE dict_tag")
+
+
+def sizes(connection: Connection) -> Dict[str, int]:
+    row = connection.execute(
+        "SELECT pg_table_size('text_tag'), pg_indexes_size('text_tag'),"
+        " pg_table_size('dict_tag'), pg_indexes_size('dict_tag'),"
+        " pg_total_relation_size('tag_name')"
+    ).fetchone()
+    assert row is not None
+    keys = ["text table", "text indexes", "dict table", "dict indexes", "tag_name"]
+    return dict(zip(keys, row))
+
+
+def time_query(
+    connection: Connection, query: str, tag_list_ids: List[int], repeat: int
+) -> float:
+    """
+    :return: the median time in seconds of running query for every tag list
+    """
+    for tag_list_id in tag_list_ids:
+        connection.execute(query, (tag_list_id,)).fetchall()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for tag_list_id in tag_list_ids:
+            connection.execute(query, (tag_list_id,)).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument(
+        "--lists", type=int, default=5, help="how many of the largest tag lists"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("set DB_URL or pass --db-url")
+
+    with connect(args.db_url) as connection:
+        started = time.perf_counter()
+        create_tables(connection)
+        print(f"copied tag twice in {time.perf_counter() - started:.1f}s")
+        for name, size in sizes(connection).items():
+            print(f"{name:<14}{size / 1024 / 1024:>10.1f} MB")
+
+        rows = connection.execute(
+            "SELECT id, num_tags FROM tag_list ORDER BY num_tags DESC LIMIT %s",
+            (args.lists,),
+        ).fetchall()
+        tag_list_ids = [row[0] for row in rows]
+        print(f"tag lists of {', '.join(str(row[1]) for row in rows)} tags")
+        print(f"{'query':<22}{'text ms':>10}{'dict ms':>10}{'speedup':>9}")
+        for name, before, after in QUERIES:
+            text = time_query(connection, before, tag_list_ids, args.repeat)
+            dictionary = time_query(connection, after, tag_list_ids, args.repeat)
+            print(
+                f"{name:<22}{text * 1000:>10.1f}{dictionary * 1000:>10.1f}"
+                f"{text / dictionary:>8.2f}x"
+            )
+        connection.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
+import logging
 import boto3
 import pandas as pd
 import os
 import psycopg2
 
+from tag_pipeline import BulkTagSink, GeneratedTag, Job, Pipeline, Stage
+
+# the stage metrics are logged at the end of every run
+logging.getLogger().setLevel(logging.INFO)
+
 
 DB_URL = os.getenv('DB_URL')
 if DB_URL is None:
     raise ValueError(
         "Missing DB_URL environment variable, could not connect to Database"
     )
+# how many threads score scenes at once
+EMOTION_WORKERS = int(os.getenv('EMOTION_WORKERS', '2'))
 
 
 def transform_emotion_data(df):
@@ -81,31 +89,55 @@ def transform_emotion_data(df):
     return df
 
 
-# this function takes in the dataframe and uploads it to the database
-# it also takes in the user_id and the tag_list_id from the event
-def upload_to_db(df, user_id, tag_list_id, video_id):
-    # Connect to the database
-    connection = psycopg2.connect(DB_URL)
-    cursor = connection.cursor()
-    for index, row in df[(df["emotion_shift"] == True) & (df.emotion != "no_emotion")].iterrows():
-        # for each row, we are going to insert a tag into the tag table.
-        cursor.execute(
-            "INSERT INTO tag (user_id, tag_list_id, video_id, youtube_timestamp, tag) VALUES (%s, %s, %s, %s, %s)",
-            (user_id, tag_list_id, video_id, row["timestamp"], row["emotion"]),
-        )
-
-
-def lambda_handler(event, context):
-    filename = event['filename']
+def read_scenes(job):
+    """
+    Pipeline source: the model output of a job, one scene at a time, which
+    the emotion stage can score independently of each other
+    """
     s3 = boto3.resource('s3')
-    obj = s3.Object('ml-pipeline-bucket', filename)
+    obj = s3.Object('ml-pipeline-bucket', job.filename)
     response = obj.get()
     # Load the parquet file into a pandas dataframe
     df = pd.read_parquet(response['Body'])
-    df = transform_emotion_data(df)
-    # get the user_id and the tag_list_id from the event
-    user_id = event['user_id']
-    tag_list_id = event['tag_list_id']
-    video_id = event['video_id']
-    upload_to_db(df, user_id, tag_list_id, video_id)
+    for scene in df["scene"].unique():
+        yield job, df[df["scene"] == scene].copy()
 
+
+def emotion_tags(item):
+    """
+    Pipeline stage: a tag for every shift in emotion within a scene
+    """
+    job, scene_df = item
+    df = transform_emotion_data(scene_df)
+    for _, row in df[(df["emotion_shift"] == True) & (df.emotion != "no_emotion")].iterrows():
+        yield GeneratedTag(job, row["emotion"], float(row["timestamp"]))
+
+
+def lambda_handler(event, context):
+    # get the user_id and the tag_list_id from the event
+    job = Job(
+        filename=event['filename'],
+        video_id=event['video_id'],
+        tag_list_id=event['tag_list_id'],
+        user_id=event['user_id'],
+    )
+    sink = BulkTagSink(lambda: psycopg2.connect(DB_URL))
+    pipeline = Pipeline(
+        source=lambda: read_scenes(job),
+        stages=[Stage("emotion", emotion_tags, workers=EMOTION_WORKERS)],
+        sink=sink,
+    )
+    metrics = pipeline.run()
+    return {
+        "tags": sink.written,
+        "stages": {
+            name: {
+                "items_in": stage.items_in,
+                "items_out": stage.items_out,
+                "per_second": stage.throughput,
+                "busy_seconds": stage.busy_seconds,
+                "blocked_seconds": stage.blocked_seconds,
+            }
+            for name, stage in metrics.items()
+        },
+    }
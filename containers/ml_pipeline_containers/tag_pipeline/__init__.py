@@ -0,0 +1,28 @@
+"""
+The framework shared by the automatic taggers: each lambda reads the model
+output of a video, turns it into tags and adds them to a tag list with a
+Pipeline of stages, e.g.
+
+    pipeline = Pipeline(
+        source=lambda: read_scenes(job),
+        stages=[Stage("emotion", emotion_tags, workers=2)],
+        sink=BulkTagSink(lambda: psycopg2.connect(DB_URL)),
+    )
+    metrics = pipeline.run()
+
+A new tagger only needs its own source and transform functions.
+"""
+
+from tag_pipeline.pipeline import Pipeline, PipelineError, Sink, Stage, StageMetrics
+from tag_pipeline.tags import BulkTagSink, GeneratedTag, Job
+
+__all__ = [
+    "BulkTagSink",
+    "GeneratedTag",
+    "Job",
+    "Pipeline",
+    "PipelineError",
+    "Sink",
+    "Stage",
+    "StageMetrics",
+]
@@ -0,0 +1,330 @@
+"""
+A source -> transforms -> sink pipeline whose stages run concurrently,
+connected by bounded queues.
+
+Each stage runs in its own threads, so a tagger can read the next part of
+its input while the previous one is being scored and the one before that
+is written to the database. The queues between stages hold at most
+queue_size items: a stage that gets ahead blocks until the next one catches
+up, so a slow sink holds back the source instead of the whole input piling
+up in memory.
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the items in a queue
+_END = object()
+# how often a blocked stage checks whether another one failed
+_POLL_SECONDS = 0.1
+
+
+class Sink:
+    """
+    The last stage of a pipeline, see BulkTagSink.
+    """
+
+    def write(self, item: Any) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Called once every item was written, e.g. to flush a batch.
+        """
+
+    def abort(self) -> None:
+        """
+        Called instead of close if the pipeline failed, or close did, e.g. to
+        roll back what was written and release the connection.
+        """
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A transform of a pipeline.
+        name: for the metrics and logs
+        function: returns the items to pass on for each item it gets,
+                any number of them
+        workers: how many threads run function, items may be passed on in
+                a different order than they came in with more than one
+    """
+
+    name: str
+    function: Callable[[Any], Iterable[Any]]
+    workers: int = 1
+
+
+@dataclass
+class StageMetrics:
+    """
+    What a stage did during a run.
+        items_in: the items it got
+        items_out: the items it passed on, or wrote for the sink
+        busy_seconds: time spent in its function, summed over its workers
+        blocked_seconds: time spent waiting for room in the next queue
+        elapsed_seconds: from the start of the run until the stage finished
+    """
+
+    name: str
+    items_in: int = 0
+    items_out: int = 0
+    busy_seconds: float = 0.0
+    blocked_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Items passed on per second.
+        """
+        if self.elapsed_seconds == 0:
+            return 0.0
+        return self.items_out / self.elapsed_seconds
+
+    def add(self, items_in: int, items_out: int, busy: float, blocked: float) -> None:
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+
+
+class PipelineError(Exception):
+    """
+    A stage raised an exception, which is the __cause__ of this one.
+    """
+
+
+class Pipeline:
+    """
+    Runs source -> stages -> sink. If any stage raises, the others stop and
+    run raises a PipelineError.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], Iterable[Any]],
+        stages: Sequence[Stage],
+        sink: Sink,
+        queue_size: int = 8,
+    ):
+        """
+        :param source: returns the items to feed to the first stage
+        :param stages: the transforms, in order
+        :param sink: where the items of the last stage go
+        :param queue_size: how many items wait between two stages at most
+        """
+        self.source = source
+        self.stages = list(stages)
+        self.sink = sink
+        self.queue_size = queue_size
+        self._failed = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._error_stage = ""
+
+    def run(self) -> Dict[str, StageMetrics]:
+        """
+        :return: the metrics of each stage by name, starting with "source"
+                and ending with "sink"
+        """
+        names = ["source"] + [stage.name for stage in self.stages] + ["sink"]
+        if len(set(names)) != len(names):
+            raise ValueError(f"The stage names aren't unique: {names}")
+        metrics = {name: StageMetrics(name) for name in names}
+        queues: List["queue.Queue[Any]"] = [
+            queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(
+                target=self._guard,
+                args=("source", self._run_source, queues[0], metrics["source"], start),
+                name="pipeline-source",
+            )
+        ]
+        for index, stage in enumerate(self.stages):
+            downstream_workers = (
+                self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            )
+            finished = _Countdown(stage.workers)
+            for worker in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._guard,
+                        args=(
+                            stage.name,
+                            self._run_stage,
+                            stage,
+                            queues[index],
+                            queues[index + 1],
+                            downstream_workers,
+                            finished,
+                            metrics[stage.name],
+                            start,
+                        ),
+                        name=f"pipeline-{stage.name}-{worker}",
+                    )
+                )
+        threads.append(
+            threading.Thread(
+                target=self._guard,
+                args=("sink", self._run_sink, queues[-1], metrics["sink"], start),
+                name="pipeline-sink",
+            )
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for stage_metrics in metrics.values():
+            logger.info(
+                "%s: %d in, %d out, %.1f/s, busy %.2fs, blocked %.2fs",
+                stage_metrics.name,
+                stage_metrics.items_in,
+                stage_metrics.items_out,
+                stage_metrics.throughput,
+                stage_metrics.busy_seconds,
+                stage_metrics.blocked_seconds,
+            )
+        if self._error is not None:
+            raise PipelineError(
+                f"The {self._error_stage} stage failed"
+            ) from self._error
+        return metrics
+
+    def _guard(self, name: str, target: Callable[..., None], *args: Any) -> None:
+        try:
+            target(*args)
+        except BaseException as e:
+            if not self._failed.is_set():
+                self._error = e
+                self._error_stage = name
+                self._failed.set()
+            logger.exception("The %s stage failed", name)
+
+    def _put(self, output: "queue.Queue[Any]", item: Any) -> float:
+        """
+        :return: how long the put waited for room
+        """
+        start = time.perf_counter()
+        while not self._failed.is_set():
+            try:
+                output.put(item, timeout=_POLL_SECONDS)
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _get(self, input: "queue.Queue[Any]") -> Any:
+        while not self._failed.is_set():
+            try:
+                return input.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        raise _Stopped()
+
+    def _run_source(
+        self, output: "queue.Queue[Any]", metrics: StageMetrics, start: float
+    ) -> None:
+        workers = self.stages[0].workers if self.stages else 1
+        try:
+            items = iter(self.source())
+            while True:
+                busy = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                busy = time.perf_counter() - busy
+                blocked = self._put(output, item)
+                metrics.add(0, 1, busy, blocked)
+            for _ in range(workers):
+                self._put(output, _END)
+        except _Stopped:
+            pass
+        metrics.elapsed_seconds = time.perf_counter() - start
+
+    def _run_stage(
+        self,
+        stage: Stage,
+        input: "queue.Queue[Any]",
+        output: "queue.Queue[Any]",
+        downstream_workers: int,
+        finished: "_Countdown",
+        metrics: StageMetrics,
+        start: float,
+    ) -> None:
+        try:
+            while True:
+                item = self._get(input)
+                if item is _END:
+                    break
+                busy = 0.0
+                blocked = 0.0
+                produced = 0
+                began = time.perf_counter()
+                for result in stage.function(item):
+                    busy += time.perf_counter() - began
+                    blocked += self._put(output, result)
+                    produced += 1
+                    began = time.perf_counter()
+                busy += time.perf_counter() - began
+                metrics.add(1, produced, busy, blocked)
+            if finished.done():
+                # the last worker of the stage tells the next one to stop
+                for _ in range(downstream_workers):
+                    self._put(output, _END)
+                metrics.elapsed_seconds = time.perf_counter() - start
+        except _Stopped:
+            pass
+
+    def _run_sink(
+        self, input: "queue.Queue[Any]", metrics: StageMetrics, start: float
+    ) -> None:
+        closed = False
+        try:
+            while True:
+                item = self._get(input)
+                if item is _END:
+                    break
+                began = time.perf_counter()
+                self.sink.write(item)
+                metrics.add(1, 1, time.perf_counter() - began, 0.0)
+            began = time.perf_counter()
+            self.sink.close()
+            closed = True
+            metrics.add(0, 0, time.perf_counter() - began, 0.0)
+            metrics.elapsed_seconds = time.perf_counter() - start
+        except _Stopped:
+            pass
+        finally:
+            if not closed:
+                self.sink.abort()
+
+
+class _Stopped(Exception):
+    """
+    Another stage failed.
+    """
+
+
+class _Countdown:
+    def __init__(self, count: int):
+        self._count = count
+        self._lock = threading.Lock()
+
+    def done(self) -> bool:
+        """
+        :return: True for the call that brings the count to 0
+        """
+        with self._lock:
+            self._count -= 1
+            return self._count == 0
@@ -0,0 +1,200 @@
+"""
+The tags that automatic taggers produce, and the sink that adds them to a
+tag list.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+from tag_pipeline.pipeline import Sink
+
+logger = logging.getLogger(__name__)
+
+# the channel that videobookmarks.events listens on
+EVENTS_CHANNEL = "tag_list_events"
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    A request to tag a video automatically, from the lambda event.
+        filename: the model output to read
+        video_id: id of the video in the database
+        tag_list_id: the tag list to add the tags to
+        user_id: who the tags are added as
+    """
+
+    filename: str
+    video_id: int
+    tag_list_id: int
+    user_id: int
+
+
+@dataclass(frozen=True)
+class GeneratedTag:
+    """
+    A tag produced by a tagger for the video of a job.
+    """
+
+    job: Job
+    tag: str
+    youtube_timestamp: float
+
+
+class BulkTagSink(Sink):
+    """
+    Adds the tags to their tag lists in batches of batch_size, with what
+    PostgresDataModel.add_tag does for each tag (the lambda images don't ship
+    the app): the tag lists' counters and versions are updated, and the open
+    pages are notified of the new tags.
+    All the batches of a job are written in one transaction, committed by
+    close, so that a failed job adds none of its tags and can be run again
+    without adding them twice. The tag lists stay locked until then, like
+    during an import.
+    """
+
+    def __init__(self, connect: Callable[[], Any], batch_size: int = 500):
+        """
+        :param connect: opens a DB-API connection, e.g. psycopg2.connect
+        """
+        self.connect = connect
+        self.batch_size = batch_size
+        self._batch: List[GeneratedTag] = []
+        self._connection: Any = None
+        # the tags written by the open transaction
+        self._pending = 0
+        # the tags added, without the ones of tag lists that don't exist
+        self.written = 0
+
+    def write(self, item: GeneratedTag) -> None:
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+        self.written += self._pending
+        self._pending = 0
+
+    def abort(self) -> None:
+        self._batch = []
+        self._pending = 0
+        if self._connection is not None:
+            try:
+                self._connection.rollback()
+            finally:
+                self._connection.close()
+                self._connection = None
+
+    def flush(self) -> None:
+        """
+        Write the current batch, without committing it.
+        """
+        if not self._batch:
+            return
+        if self._connection is None:
+            self._connection = self.connect()
+        self._pending += self._write(self._batch)
+        self._batch = []
+
+    def _write(self, tags: List[GeneratedTag]) -> int:
+        """
+        :return: how many tags were added
+        """
+        written = 0
+        cursor = self._connection.cursor()
+        # in a fixed order, so that two batches adding the same new names
+        # can't deadlock
+        names = sorted({tag.tag for tag in tags})
+        cursor.execute(
+            "INSERT INTO tag_name (name) SELECT unnest(%s::text[])"
+            " ON CONFLICT (name) DO NOTHING",
+            (names,),
+        )
+        cursor.execute("SELECT name, id FROM tag_name WHERE name = ANY(%s)", (names,))
+        name_ids = dict(cursor.fetchall())
+        by_tag_list: Dict[int, List[GeneratedTag]] = {}
+        for tag in tags:
+            by_tag_list.setdefault(tag.job.tag_list_id, []).append(tag)
+        # tag lists are locked in the order of their ids for the same reason
+        for tag_list_id in sorted(by_tag_list):
+            new_tags = by_tag_list[tag_list_id]
+            cursor.execute(
+                "UPDATE tag_list"
+                " SET num_tags = num_tags + %s,"
+                "     last_tagged_at = CURRENT_TIMESTAMP,"
+                "     version = version + %s"
+                " WHERE id = %s AND deleted = false"
+                " RETURNING version",
+                (len(new_tags), len(new_tags), tag_list_id),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                logger.warning(
+                    "Left out %d tags of the tag list id %d,"
+                    " which doesn't exist or is deleted",
+                    len(new_tags),
+                    tag_list_id,
+                )
+                continue
+            first_version = row[0] - len(new_tags) + 1
+            cursor.execute(
+                "WITH new_tag AS ("
+                "    SELECT * FROM unnest("
+                "        %s::integer[], %s::integer[], %s::integer[],"
+                "        %s::float[], %s::integer[]"
+                "    ) AS t(video_id, user_id, tag_name_id, youtube_timestamp,"
+                "        list_version)"
+                " ), new_video AS ("
+                "    UPDATE tag_list SET num_videos = num_videos + ("
+                "        SELECT COUNT(DISTINCT video_id) FROM new_tag n"
+                "        WHERE NOT EXISTS ("
+                "            SELECT 1 FROM tag"
+                "            WHERE tag_list_id = %s AND video_id = n.video_id"
+                "        )"
+                "    )"
+                "    WHERE id = %s"
+                " ), inserted AS ("
+                "    INSERT INTO tag"
+                "    (tag_list_id, video_id, user_id, tag_name_id, youtube_timestamp,"
+                "        list_version)"
+                "    SELECT %s, video_id, user_id, tag_name_id, youtube_timestamp,"
+                "        list_version"
+                "    FROM new_tag"
+                "    RETURNING tag_list_id, video_id, user_id, tag_name_id,"
+                "        youtube_timestamp, list_version"
+                " )"
+                " SELECT pg_notify(%s, json_build_object("
+                "    'type', 'tag',"
+                "    'tag_list_id', i.tag_list_id,"
+                "    'version', i.list_version,"
+                "    'video_id', i.video_id,"
+                "    'user_id', i.user_id,"
+                "    'tag', n.name,"
+                "    'youtube_timestamp', i.youtube_timestamp,"
+                "    'link', v.link,"
+                "    'title', v.title,"
+                "    'thumbnail', v.thumbnail"
+                " )::text)"
+                " FROM inserted i"
+                " JOIN video v ON v.id = i.video_id"
+                " JOIN tag_name n ON n.id = i.tag_name_id",
+                (
+                    [tag.job.video_id for tag in new_tags],
+                    [tag.job.user_id for tag in new_tags],
+                    [name_ids[tag.tag] for tag in new_tags],
+                    [tag.youtube_timestamp for tag in new_tags],
+                    list(range(first_version, first_version + len(new_tags))),
+                    tag_list_id,
+                    tag_list_id,
+                    tag_list_id,
+                    EVENTS_CHANNEL,
+                ),
+            )
+            written += len(new_tags)
+        return written
@@ -24,7 +24,20 @@ if "_test" not in DB_URL:
 @pytest.fixture
 def app():
     # create the app with common test config
-    app = create_app({"TESTING": True, "DATABASE": DB_URL})
+    # passwords are hashed on the request thread, without worker processes,
+    # pages aren't cached, which needs a connection listening for events,
+    # the app isn't warmed up, and the details of new videos are fetched
+    # on the request thread
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": DB_URL,
+            "PASSWORD_HASH_WORKERS": 0,
+            "FRAGMENT_CACHE_MAX_BYTES": 0,
+            "WARM_UP": False,
+            "VIDEO_DETAILS_WORKERS": 0,
+        }
+    )
 
     # connect to the database using the DB_URL provided above.
     with app.app_context():
@@ -41,6 +54,7 @@ def app():
             "TRUNCATE video CASCADE;"
         )
         dm._connection.commit()
+    app.extensions["db_pool"].close()
 
 
 @pytest.fixture
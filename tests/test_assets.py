@@ -0,0 +1,66 @@
+import gzip
+
+from videobookmarks import create_app
+from videobookmarks.assets import minify_css, minify_js
+from .conftest import DB_URL
+
+
+def test_minify():
+    js = (
+        "// a comment\n"
+        "function f() {\n"
+        "    const a = 'http://example.com'; // kept\n"
+        "\n"
+        "    return `first\n"
+        "    second`;\n"
+        "}\n"
+    )
+    assert minify_js(js) == (
+        "function f() {\n"
+        "const a = 'http://example.com'; // kept\n"
+        "return `first\n"
+        "    second`;\n"
+        "}\n"
+    )
+    css = "/* a\n comment */\nhtml {\n    color: red;\n}\n\n"
+    assert minify_css(css) == "html {\ncolor: red;\n}\n"
+
+
+def test_templates_use_assets(app, client):
+    asset = app.extensions["assets"]["style.css"]
+    assert asset.fingerprinted_name != "style.css"
+    page = client.get("/authenticate/login").get_data(as_text=True)
+    assert f'href="/assets/{asset.fingerprinted_name}"' in page
+    assert "/static/" not in page
+
+
+def test_serve_asset(app, client):
+    asset = app.extensions["assets"]["view.js"]
+    url = f"/assets/{asset.fingerprinted_name}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == "text/javascript"
+    assert response.data == asset.data
+    assert len(asset.data) < len(client.get("/static/view.js").data)
+    cache_control = response.cache_control
+    assert cache_control.public and cache_control.immutable
+    assert cache_control.max_age == 365 * 24 * 60 * 60
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.content_encoding == "gzip"
+    assert gzip.decompress(response.data) == asset.data
+    # only the fingerprinted names are served
+    assert client.get("/assets/view.js").status_code == 404
+
+
+def test_assets_disabled():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": DB_URL,
+            "ASSETS_ENABLED": False,
+            "WARM_UP": False,
+        }
+    )
+    page = app.test_client().get("/authenticate/login").get_data(as_text=True)
+    assert 'href="/static/style.css"' in page
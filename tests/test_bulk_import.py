@@ -0,0 +1,159 @@
+import io
+
+from psycopg.pq import TransactionStatus
+
+from videobookmarks import tag
+from videobookmarks.bulk_import import parse_rows
+from videobookmarks.datamodel.datamodel import ImportRow, RejectedRow
+from videobookmarks.db import get_datamodel
+from .conftest import CreateTagList
+
+
+def test_parse_rows():
+    lines = io.StringIO(
+        "video_id,timestamp,tag\n"
+        "abc,1.5,bird\n"
+        'abc, 2 ,"tree, big"\n'
+        "\n"
+        "abc,2\n"
+        "abc,soon,bird\n"
+        "abc,-1,bird\n"
+        "abc,nan,bird\n"
+        ",1,bird\n"
+        "abc,1,\n"
+        "abc,1,much too long\n"
+    )
+    rows = list(parse_rows(lines, max_tag_length=9))
+    assert rows == [
+        ImportRow(2, "abc", 1.5, "bird"),
+        ImportRow(3, "abc", 2.0, "tree, big"),
+        RejectedRow(5, "expected 3 columns"),
+        RejectedRow(6, "timestamp is not a number"),
+        RejectedRow(7, "timestamp is not a time in the video"),
+        RejectedRow(8, "timestamp is not a time in the video"),
+        RejectedRow(9, "missing video_id"),
+        RejectedRow(10, "missing tag"),
+        RejectedRow(11, "tag is longer than 9"),
+    ]
+
+
+def test_import(app, client, auth, monkeypatch):
+    artifacts = CreateTagList(app)
+
+    def get_videos_details(video_ids):
+        # new_video is on youtube, missing_video isn't
+        return {
+            video_id: {"title": "new title", "thumbnail_url": "new.jpg"}
+            for video_id in video_ids
+            if video_id == "new_video"
+        }
+
+    monkeypatch.setattr(tag, "get_videos_details", get_videos_details)
+    auth.login(artifacts.username, artifacts.password)
+    body = (
+        f"{artifacts.yt_video_id},1,bird\n"
+        "new_video,2,tree\n"
+        "missing_video,3,bird\n"
+        "new_video,not a time,bird\n"
+        "new_video,4,bird\n"
+    )
+    response = client.post(
+        f"/import/{artifacts.tag_list_id}",
+        data=body,
+        content_type="text/csv",
+    )
+    assert response.status_code == 200
+    assert response.json["imported"] == 3
+    assert response.json["rejected"] == 2
+    assert response.json["rejected_rows"] == [
+        {"line": 3, "reason": "unknown youtube video"},
+        {"line": 4, "reason": "timestamp is not a number"},
+    ]
+    assert response.json["version"] == 3
+    assert response.json["rows_per_second"] > 0
+
+    with app.app_context():
+        datamodel = get_datamodel()
+        tag_list = datamodel.get_tag_list(artifacts.tag_list_id)
+        assert tag_list.num_tags == 3
+        assert tag_list.num_videos == 2
+        assert tag_list.version == 3
+        changes = datamodel.get_tag_list_changes(artifacts.tag_list_id, None, 10)
+        assert [(c.version, c.tag, c.link) for c in changes.changes] == [
+            (1, "bird", artifacts.yt_video_id),
+            (2, "tree", "new_video"),
+            (3, "bird", "new_video"),
+        ]
+        assert changes.changes[1].title == "new title"
+
+    # the same file as a form upload
+    response = client.post(
+        f"/import/{artifacts.tag_list_id}",
+        data={"file": (io.BytesIO(body.encode()), "tags.csv")},
+    )
+    assert response.json["imported"] == 3
+    assert response.json["version"] == 6
+
+
+def test_import_errors(app, client, auth):
+    artifacts = CreateTagList(app)
+    other = CreateTagList(app, suffix="_other")
+    auth.login(other.username, other.password)
+    url = f"/import/{artifacts.tag_list_id}"
+    response = client.post(url, data="a,1,b\n", content_type="text/csv")
+    assert response.status_code == 403
+    auth.login(artifacts.username, artifacts.password)
+    assert client.post(url, data={}).status_code == 400
+    response = client.post(url, data=b"a,1,\xff\n", content_type="text/csv")
+    assert response.status_code == 400
+    response = client.post("/import/0", data="a,1,b\n", content_type="text/csv")
+    assert response.status_code == 404
+
+
+def test_import_command(app, runner, tmp_path):
+    artifacts = CreateTagList(app)
+    path = tmp_path / "tags.csv"
+    path.write_text(
+        "video_id,timestamp,tag\n"
+        f"{artifacts.yt_video_id},1,bird\n"
+        f"{artifacts.yt_video_id},2,\n"
+    )
+    result = runner.invoke(args=["import-tags", str(artifacts.tag_list_id), str(path)])
+    assert "Imported 1 tags and rejected 1 rows" in result.output
+    assert "line 3: missing tag" in result.output
+    with app.app_context():
+        tags = get_datamodel().get_video_tags(artifacts.video_id, artifacts.tag_list_id)
+        assert [t.tag for t in tags] == ["bird"]
+        assert tags[0].user_id == artifacts.user_id
+
+
+def test_import_resolves_videos_outside_the_transaction(app):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        datamodel = get_datamodel()
+
+        def resolve_videos(links):
+            assert links == ["new_video"]
+            # nothing is locked while youtube is asked
+            status = datamodel._connection.info.transaction_status
+            assert status == TransactionStatus.IDLE
+            # a page opens the same new video meanwhile
+            datamodel.create_pending_video_id("new_video", "pending.jpg", "pending")
+            return {"new_video": {"title": "new title", "thumbnail_url": "new.jpg"}}
+
+        result = datamodel.import_tags(
+            artifacts.tag_list_id,
+            artifacts.user_id,
+            [ImportRow(1, "new_video", 1.0, "bird")],
+            resolve_videos,
+            10,
+        )
+        assert result.imported == 1
+        count = datamodel._connection.execute(
+            "SELECT COUNT(*) as count FROM video WHERE link = 'new_video'"
+        ).fetchone()["count"]
+        assert count == 1
+        staging = datamodel._connection.execute(
+            "SELECT to_regclass('import_staging') as staging"
+        ).fetchone()["staging"]
+        assert staging is None
@@ -0,0 +1,91 @@
+from videobookmarks import compact
+from videobookmarks.datamodel.datamodel import GroupedTag, Tag
+from .conftest import CreateTagList
+from videobookmarks.db import get_datamodel
+
+
+def test_encode_compact_round_trip():
+    tags = [
+        GroupedTag(tag="bird", count=2, links=["link_0", "link_1"]),
+        GroupedTag(tag="tree", count=1, links=["link_1"]),
+    ]
+    payload = compact.encode_compact(GroupedTag, tags)
+    assert payload["strings"] == ["bird", "tree", "link_0", "link_1"]
+    assert payload["columns"]["links"] == {"string_lists": [[2, 3], [3]]}
+    assert compact.decode_compact(payload) == [
+        {"tag": "bird", "count": 2, "links": ["link_0", "link_1"]},
+        {"tag": "tree", "count": 1, "links": ["link_1"]},
+    ]
+
+
+def test_encode_compact_constant_columns():
+    tags = [
+        Tag(user_id=1, tag_list_id=2, video_id=3, tag="bird", youtube_timestamp=1.5),
+        Tag(user_id=1, tag_list_id=2, video_id=3, tag="bird", youtube_timestamp=2.5),
+    ]
+    payload = compact.encode_compact(Tag, tags)
+    assert payload["columns"]["tag_list_id"] == {"constant": 2}
+    assert payload["columns"]["youtube_timestamp"] == {"values": [1.5, 2.5]}
+    assert len(compact.decode_compact(payload)) == 2
+
+
+def test_encode_compact_empty():
+    payload = compact.encode_compact(Tag, [])
+    assert payload["length"] == 0
+    assert set(payload["columns"]) == {
+        "user_id",
+        "tag_list_id",
+        "video_id",
+        "tag",
+        "youtube_timestamp",
+    }
+    assert compact.decode_compact(payload) == []
+
+
+def test_get_tags_compact(app, client):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        dm = get_datamodel()
+        dm.add_tag(
+            "test",
+            1.0,
+            artifacts.tag_list_id,
+            artifacts.video_id,
+            artifacts.user_id,
+        )
+    plain = client.get(f"get_tags/{artifacts.tag_list_id}")
+    assert plain.mimetype == "application/json"
+    assert "Accept" in plain.headers["Vary"]
+    response = client.get(
+        f"get_tags/{artifacts.tag_list_id}",
+        headers={"Accept": compact.COMPACT_JSON_MIMETYPE},
+    )
+    assert response.mimetype == compact.COMPACT_JSON_MIMETYPE
+    assert compact.decode_compact(response.json) == plain.json
+
+
+def test_changes_compact(app, client):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        dm = get_datamodel()
+        for timestamp in [1.0, 2.0]:
+            dm.add_tag(
+                "test",
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+    plain = client.get(f"changes/{artifacts.tag_list_id}")
+    assert plain.mimetype == "application/json"
+    assert "Accept" in plain.headers["Vary"]
+    response = client.get(
+        f"changes/{artifacts.tag_list_id}",
+        headers={"Accept": compact.COMPACT_JSON_MIMETYPE},
+    )
+    assert response.mimetype == compact.COMPACT_JSON_MIMETYPE
+    payload = response.json
+    # the video of both tags is only sent once
+    assert payload["changes"]["columns"]["link"] == {"constant": artifacts.yt_video_id}
+    payload["changes"] = compact.decode_compact(payload["changes"])
+    assert payload == plain.json
@@ -0,0 +1,94 @@
+import gzip
+
+import werkzeug.wsgi
+
+from videobookmarks import compression
+from videobookmarks.db import get_datamodel
+from .conftest import CreateTagList
+
+
+def add_tags(app, artifacts, count):
+    with app.app_context():
+        dm = get_datamodel()
+        for i in range(count):
+            dm.add_tag(
+                f"tag number {i}",
+                float(i),
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+
+
+def test_compress_json(app, client):
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, 50)
+    plain = client.get(f"/get_tags/{artifacts.tag_list_id}")
+    assert plain.content_encoding is None
+    response = client.get(
+        f"/get_tags/{artifacts.tag_list_id}",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert response.content_encoding == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_small_responses_not_compressed(app, client):
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, 1)
+    response = client.get(
+        f"/get_tags/{artifacts.tag_list_id}",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert response.content_encoding is None
+
+
+def test_compress_large_body_streamed(app, client):
+    app.config["COMPRESSION_STREAM_MIN_SIZE"] = 2048
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, 100)
+    plain = client.get(f"/get_tags/{artifacts.tag_list_id}")
+    response = client.get(
+        f"/get_tags/{artifacts.tag_list_id}",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert response.content_encoding == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_static_precompressed(app, client):
+    assert "view.js" in app.extensions["precompressed_static"]
+    plain = client.get("/static/view.js")
+    response = client.get("/static/view.js", headers={"Accept-Encoding": "gzip"})
+    assert response.content_encoding == "gzip"
+    assert response.data == (
+        app.extensions["precompressed_static"]["view.js"].variants["gzip"]
+    )
+    assert gzip.decompress(response.data) == plain.data
+    assert response.headers["ETag"].startswith("W/")
+
+
+def test_static_precompressed_closes_the_file(app, client):
+    closed = []
+
+    class FileWrapper(werkzeug.wsgi.FileWrapper):
+        def close(self):
+            closed.append(self.file.name)
+            super().close()
+
+    response = client.get(
+        "/static/view.js",
+        headers={"Accept-Encoding": "gzip"},
+        environ_overrides={"wsgi.file_wrapper": FileWrapper},
+    )
+    assert response.content_encoding == "gzip"
+    assert len(closed) == 1 and closed[0].endswith("view.js")
+
+
+def test_compress_stream():
+    data = b"some data " * 10000
+    chunks = [data[i : i + 1000] for i in range(0, len(data), 1000)]
+    compressed = b"".join(compression.compress_stream(chunks, "gzip", 6))
+    assert gzip.decompress(compressed) == data
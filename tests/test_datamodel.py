@@ -1,4 +1,13 @@
-from videobookmarks.datamodel.datamodel import GroupedTag, GroupedVideo, Tag
+import pytest
+
+from videobookmarks.datamodel.datamodel import (
+    GroupedTag,
+    GroupedVideo,
+    Tag,
+    TagChange,
+    TagSuggestion,
+    VideoSearchResult,
+)
 from videobookmarks.db import get_datamodel
 from werkzeug.security import check_password_hash
 from .conftest import CreateTagList
@@ -102,9 +111,10 @@ def test_add_tag(app):
             tag_list_artifacts.user_id,
         )
         tag = datamodel._connection.execute(
-            "SELECT *"
-            " FROM tag"
-            " WHERE id = %s",
+            "SELECT t.*, n.name as tag"
+            " FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " WHERE t.id = %s",
             (tag_id,)
         ).fetchone()
         assert tag["tag"] == test_tag
@@ -447,4 +457,421 @@ def test_delete_tag_list(app):
         tl = datamodel.get_tag_list(tag_list_id)
         tag_list_ids = [t.id for t in datamodel.get_tag_lists()]
         assert tl.deleted is True
-        assert tl.id not in tag_list_ids
\ No newline at end of file
+        assert tl.id not in tag_list_ids
+
+
+def test_tag_names_are_shared(app):
+    with app.app_context():
+        artifacts_1 = CreateTagList(app, suffix="_1")
+        artifacts_2 = CreateTagList(app, suffix="_2")
+        datamodel = get_datamodel()
+        for artifacts in [artifacts_1, artifacts_1, artifacts_2]:
+            datamodel.add_tag(
+                "a bird",
+                1,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        rows = datamodel._connection.execute(
+            "SELECT DISTINCT tag_name_id FROM tag WHERE tag_list_id = ANY(%s)",
+            ([artifacts_1.tag_list_id, artifacts_2.tag_list_id],),
+        ).fetchall()
+        assert len(rows) == 1
+        name = datamodel._connection.execute(
+            "SELECT name FROM tag_name WHERE id = %s", (rows[0]["tag_name_id"],)
+        ).fetchone()
+        assert name["name"] == "a bird"
+        assert [
+            (t.tag, t.count) for t in datamodel.get_tag_list_tags(artifacts_1.tag_list_id)
+        ] == [("a bird", 2)]
+
+
+def test_archive_and_restore_tag_list(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        live = CreateTagList(app, suffix="_live")
+        datamodel = get_datamodel()
+        for artifact in [artifacts, live]:
+            for timestamp in range(5):
+                datamodel.add_tag(
+                    "bird",
+                    timestamp,
+                    artifact.tag_list_id,
+                    artifact.video_id,
+                    artifact.user_id,
+                )
+        with pytest.raises(KeyError):
+            datamodel.restore_tag_list(artifacts.tag_list_id, 2)
+        datamodel.delete_tag_list(artifacts.tag_list_id)
+
+        def count(table, tag_list_id):
+            return datamodel._connection.execute(
+                f"SELECT COUNT(*) as n FROM {table} WHERE tag_list_id = %s",
+                (tag_list_id,),
+            ).fetchone()["n"]
+
+        assert datamodel.archive_deleted_tag_lists(2) == 5
+        assert count("tag", artifacts.tag_list_id) == 0
+        assert count("tag_archive", artifacts.tag_list_id) == 5
+        # live lists are left alone, and archived lists aren't visited again
+        assert count("tag", live.tag_list_id) == 5
+        assert datamodel.archive_deleted_tag_lists(2) == 0
+        # so no tags can be added to deleted lists
+        with pytest.raises(KeyError):
+            datamodel.add_tag(
+                "bird",
+                9,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        assert count("tag", artifacts.tag_list_id) == 0
+
+        assert datamodel.restore_tag_list(artifacts.tag_list_id, 2) == 5
+        assert count("tag", artifacts.tag_list_id) == 5
+        assert count("tag_archive", artifacts.tag_list_id) == 0
+        tag_list = datamodel.get_tag_list(artifacts.tag_list_id)
+        assert tag_list.deleted is False
+        assert tag_list.version == 7
+        assert len(datamodel.get_tag_list_tags(artifacts.tag_list_id)) == 1
+        with pytest.raises(KeyError):
+            datamodel.restore_tag_list(-1, 2)
+
+
+def test_archive_commands(app, runner):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        datamodel.add_tag(
+            "bird", 1, artifacts.tag_list_id, artifacts.video_id, artifacts.user_id
+        )
+        datamodel.delete_tag_list(artifacts.tag_list_id)
+    result = runner.invoke(args=["archive-deleted-tags", "--batch-size", "10"])
+    assert "Archived 1 tags." in result.output
+    result = runner.invoke(args=["restore-tag-list", str(artifacts.tag_list_id)])
+    assert "with 1 archived tags" in result.output
+    result = runner.invoke(args=["restore-tag-list", str(artifacts.tag_list_id)])
+    assert result.exit_code != 0
+    assert "is not deleted" in result.output
+
+
+def test_get_tag_counts(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        for tag, timestamp in [("bird", 1), ("bird", 2), ("tree", 3)]:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        tag_counts = datamodel.get_tag_counts(artifacts.tag_list_id)
+        assert sorted(tag_counts, key=lambda t: t.tag) == [
+            TagSuggestion(tag="bird", count=2),
+            TagSuggestion(tag="tree", count=1),
+        ]
+
+
+def test_get_tag_suggestions_near(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        for tag, timestamp in [
+            ("Bird", 10),
+            ("Bird", 12),
+            ("bike", 15),
+            ("bin_", 100),
+            ("tree", 11),
+        ]:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        suggestions = datamodel.get_tag_suggestions_near(
+            artifacts.tag_list_id,
+            artifacts.video_id,
+            timestamp=11,
+            window=5,
+            prefix="bi",
+            limit=10,
+        )
+        assert suggestions == [
+            TagSuggestion(tag="Bird", count=2),
+            TagSuggestion(tag="bike", count=1),
+        ]
+        # the underscore is matched literally, not as a wildcard
+        suggestions = datamodel.get_tag_suggestions_near(
+            artifacts.tag_list_id,
+            artifacts.video_id,
+            timestamp=100,
+            window=5,
+            prefix="bi_",
+            limit=10,
+        )
+        assert suggestions == []
+
+
+def test_search_tag_lists(app):
+    with app.app_context():
+        datamodel = get_datamodel()
+        user_id = datamodel.add_user("na", "na")
+        birds_id = datamodel.create_tag_list(
+            "Birds of the forest", "every bird call", user_id
+        )
+        calls_id = datamodel.create_tag_list(
+            "Phone calls", "a list about birds in phone calls", user_id
+        )
+        deleted_id = datamodel.create_tag_list("Bird watching", "", user_id)
+        datamodel.create_tag_list("Trees", "oak and pine", user_id)
+        datamodel.delete_tag_list(deleted_id)
+        tag_lists = datamodel.search_tag_lists("bird", 10)
+        # matches in the name rank above matches in the description
+        assert [tl.id for tl in tag_lists] == [birds_id, calls_id]
+        assert datamodel.search_tag_lists("bird", 1)[0].id == birds_id
+        assert datamodel.search_tag_lists("bird -phone", 10)[0].id == birds_id
+        assert datamodel.search_tag_lists("volcano", 10) == []
+
+
+def test_search_videos(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        video_id = datamodel.create_video_id(
+            "abc123", "fakethumbnailurl.com", "Amazing volcano eruption"
+        )
+        # not tagged in any list, so it can't be returned
+        datamodel.create_video_id(
+            "def456", "fakethumbnailurl.com", "Another volcano"
+        )
+        datamodel.add_tag(
+            "lava", 1, artifacts.tag_list_id, video_id, artifacts.user_id
+        )
+        results = datamodel.search_videos("volcanoes", 10)
+        assert results == [
+            VideoSearchResult(
+                link="abc123",
+                title="Amazing volcano eruption",
+                thumbnail="fakethumbnailurl.com",
+                tag_list_id=artifacts.tag_list_id,
+                tag_list_name=artifacts.tag_list_name,
+            )
+        ]
+        datamodel.delete_tag_list(artifacts.tag_list_id)
+        assert datamodel.search_videos("volcano", 10) == []
+
+
+def test_add_tag_updates_counters(app):
+    with app.app_context():
+        artifacts_0 = CreateTagList(app, suffix="_0")
+        artifacts_1 = CreateTagList(app, suffix="_1")
+        datamodel = get_datamodel()
+        tag_list = datamodel.get_tag_list(artifacts_0.tag_list_id)
+        assert tag_list.num_tags == 0
+        assert tag_list.num_videos == 0
+        assert tag_list.last_tagged_at is None
+        for video_id in [artifacts_0.video_id, artifacts_0.video_id, artifacts_1.video_id]:
+            datamodel.add_tag(
+                "na",
+                0,
+                artifacts_0.tag_list_id,
+                video_id,
+                artifacts_0.user_id,
+            )
+        tag_list = datamodel.get_tag_list(artifacts_0.tag_list_id)
+        assert tag_list.num_tags == 3
+        assert tag_list.num_videos == 2
+        assert tag_list.last_tagged_at is not None
+        # the other list is untouched
+        assert datamodel.get_tag_list(artifacts_1.tag_list_id).num_tags == 0
+
+
+def test_get_tag_list_changes(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        for tag, timestamp in [("a", 1.0), ("b", 2.0), ("c", 3.0)]:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        snapshot = datamodel.get_tag_list_changes(artifacts.tag_list_id, None, 10)
+        assert snapshot.version == 3
+        assert snapshot.snapshot is True
+        assert snapshot.deleted is False
+        assert snapshot.changes[0] == TagChange(
+            version=1,
+            tag="a",
+            video_id=artifacts.video_id,
+            youtube_timestamp=1.0,
+            link=artifacts.yt_video_id,
+            title="fake youtube title",
+            thumbnail="fakethumbnailurl.com",
+        )
+        assert [c.tag for c in snapshot.changes] == ["a", "b", "c"]
+
+        delta = datamodel.get_tag_list_changes(artifacts.tag_list_id, 1, 10)
+        assert delta.version == 3
+        assert delta.snapshot is False
+        assert [c.tag for c in delta.changes] == ["b", "c"]
+        delta = datamodel.get_tag_list_changes(artifacts.tag_list_id, 3, 10)
+        assert delta.snapshot is False
+        assert delta.changes == []
+
+        # too far behind, or ahead of the tag list, gets a snapshot
+        for since_version in [0, 4]:
+            changes = datamodel.get_tag_list_changes(
+                artifacts.tag_list_id, since_version, 2
+            )
+            assert changes.snapshot is True
+            assert len(changes.changes) == 3
+
+        datamodel.delete_tag_list(artifacts.tag_list_id)
+        deleted = datamodel.get_tag_list_changes(artifacts.tag_list_id, 3, 10)
+        assert deleted.deleted is True
+        assert deleted.version == 4
+        assert datamodel.get_tag_list(artifacts.tag_list_id).version == 4
+        assert datamodel.get_tag_list_changes(-1, None, 10) is None
+
+
+def test_get_tag_list_changes_for_video(app):
+    with app.app_context():
+        artifacts = CreateTagList(app, suffix="_0")
+        other = CreateTagList(app, suffix="_1")
+        datamodel = get_datamodel()
+        for tag, video_id in [
+            ("a", artifacts.video_id),
+            ("b", other.video_id),
+            ("c", artifacts.video_id),
+        ]:
+            datamodel.add_tag(
+                tag, 1.0, artifacts.tag_list_id, video_id, artifacts.user_id
+            )
+        snapshot = datamodel.get_tag_list_changes(
+            artifacts.tag_list_id, None, 10, artifacts.video_id
+        )
+        assert snapshot.version == 3
+        assert [c.tag for c in snapshot.changes] == ["a", "c"]
+        delta = datamodel.get_tag_list_changes(
+            artifacts.tag_list_id, 1, 10, other.video_id
+        )
+        assert delta.version == 3
+        assert delta.snapshot is False
+        assert [c.tag for c in delta.changes] == ["b"]
+
+
+def test_get_tag_list_page(app):
+    with app.app_context():
+        artifacts = [CreateTagList(app, suffix=f"_{i}") for i in range(5)]
+        datamodel = get_datamodel()
+        datamodel.delete_tag_list(artifacts[2].tag_list_id)
+        page = datamodel.get_tag_list_page("created", 2)
+        assert [tl.id for tl in page.tag_lists] == [
+            artifacts[4].tag_list_id,
+            artifacts[3].tag_list_id,
+        ]
+        page = datamodel.get_tag_list_page("created", 2, page.next_cursor)
+        assert [tl.id for tl in page.tag_lists] == [
+            artifacts[1].tag_list_id,
+            artifacts[0].tag_list_id,
+        ]
+        assert page.next_cursor is None
+
+
+def test_get_tag_list_page_sorts(app):
+    with app.app_context():
+        artifacts = [CreateTagList(app, suffix=f"_{i}") for i in range(3)]
+        datamodel = get_datamodel()
+        for i, tag_count in enumerate([2, 3, 1]):
+            for _ in range(tag_count):
+                datamodel.add_tag(
+                    "na",
+                    0,
+                    artifacts[i].tag_list_id,
+                    artifacts[i].video_id,
+                    artifacts[i].user_id,
+                )
+        ids = [a.tag_list_id for a in artifacts]
+        page = datamodel.get_tag_list_page("tags", 2)
+        assert [tl.id for tl in page.tag_lists] == [ids[1], ids[0]]
+        page = datamodel.get_tag_list_page("tags", 2, page.next_cursor)
+        assert [tl.id for tl in page.tag_lists] == [ids[2]]
+        page = datamodel.get_tag_list_page("activity", 3)
+        assert [tl.id for tl in page.tag_lists] == [ids[2], ids[1], ids[0]]
+
+
+def test_get_tag_list_page_invalid(app):
+    with app.app_context():
+        CreateTagList(app, suffix="_0")
+        CreateTagList(app, suffix="_1")
+        datamodel = get_datamodel()
+        with pytest.raises(ValueError):
+            datamodel.get_tag_list_page("name", 10)
+        with pytest.raises(ValueError):
+            datamodel.get_tag_list_page("created", 0)
+        cursor = datamodel.get_tag_list_page("created", 1).next_cursor
+        with pytest.raises(ValueError):
+            datamodel.get_tag_list_page("tags", 10, cursor)
+        with pytest.raises(ValueError):
+            datamodel.get_tag_list_page("tags", 10, "not a cursor")
+
+
+def test_find_tag_occurrences(app):
+    with app.app_context():
+        artifacts = [CreateTagList(app, suffix=f"_{i}") for i in range(3)]
+        datamodel = get_datamodel()
+        tags = [
+            (0, "goal", 20.0),
+            (0, "goal", 5.0),
+            (0, "miss", 7.0),
+            (1, "goal", 3.0),
+            (2, "goal", 1.0),
+        ]
+        for i, tag, timestamp in tags:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts[i].tag_list_id,
+                artifacts[i].video_id,
+                artifacts[i].user_id,
+            )
+        datamodel.delete_tag_list(artifacts[1].tag_list_id)
+        page = datamodel.find_tag_occurrences("goal", 2)
+        assert [tl.tag_list_id for tl in page.tag_lists] == [artifacts[0].tag_list_id]
+        assert page.tag_lists[0].username == artifacts[0].username
+        [video] = page.tag_lists[0].videos
+        assert (video.link, video.timestamps) == (artifacts[0].yt_video_id, [5.0, 20.0])
+        page = datamodel.find_tag_occurrences("goal", 2, page.next_cursor)
+        assert [tl.tag_list_id for tl in page.tag_lists] == [artifacts[2].tag_list_id]
+        assert page.tag_lists[0].videos[0].timestamps == [1.0]
+        assert page.next_cursor is None
+        assert datamodel.find_tag_occurrences("Goal", 10).tag_lists == []
+
+
+def test_find_tag_occurrences_invalid(app):
+    with app.app_context():
+        artifacts = CreateTagList(app)
+        datamodel = get_datamodel()
+        for timestamp in [1.0, 2.0]:
+            datamodel.add_tag(
+                "goal",
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+        cursor = datamodel.find_tag_occurrences("goal", 1).next_cursor
+        with pytest.raises(ValueError):
+            datamodel.find_tag_occurrences("miss", 10, cursor)
+        with pytest.raises(ValueError):
+            datamodel.find_tag_occurrences("goal", 10, "not a cursor")
+        with pytest.raises(ValueError):
+            datamodel.find_tag_occurrences("goal", 0)
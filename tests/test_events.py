@@ -0,0 +1,125 @@
+import json
+import threading
+
+from psycopg import connect
+
+from videobookmarks.datamodel.datamodel import EVENTS_CHANNEL
+from videobookmarks.db import get_datamodel
+from videobookmarks.events import (
+    RESET_EVENT,
+    EventBroker,
+    Subscription,
+    format_event,
+    stream_events,
+)
+from .conftest import CreateTagList
+
+
+def test_publish_to_tag_list_subscribers():
+    broker = EventBroker("unused", queue_size=10)
+    first = Subscription(1, 10)
+    second = Subscription(2, 10)
+    broker._subscriptions = {1: {first}, 2: {second}}
+    broker.publish({"type": "tag", "tag_list_id": 1})
+    broker.publish({"type": "video"})
+    assert first.get(0) == {"type": "tag", "tag_list_id": 1}
+    assert first.get(0) == {"type": "video"}
+    assert first.get(0) is None
+    assert second.get(0) == {"type": "video"}
+    assert second.get(0) is None
+
+
+def test_subscription_overflow_resets():
+    subscription = Subscription(1, 2)
+    for _ in range(3):
+        subscription.put({"type": "tag", "tag_list_id": 1})
+    assert subscription.get(0) == RESET_EVENT
+    assert subscription.get(0) is None
+    subscription.put({"type": "tag", "tag_list_id": 1})
+    assert subscription.get(0) == {"type": "tag", "tag_list_id": 1}
+
+
+def test_subscription_overflow_from_another_thread():
+    subscription = Subscription(1, 2)
+    count = 20000
+
+    def publish():
+        for version in range(count):
+            subscription.put({"type": "tag", "tag_list_id": 1, "version": version})
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    received = []
+    while thread.is_alive() or received[-1:] != [None]:
+        received.append(subscription.get(0))
+    thread.join()
+    # every event that was dropped is followed by a reset
+    last = -1
+    for event in received:
+        if event == RESET_EVENT:
+            last = None
+        elif event is not None:
+            assert last is None or event["version"] == last + 1
+            last = event["version"]
+
+
+def test_stream_events():
+    broker = EventBroker("unused", queue_size=10)
+    subscription = Subscription(1, 10)
+    broker._subscriptions = {1: {subscription}}
+    subscription.put({"type": "tag", "tag_list_id": 1})
+    stream = stream_events(broker, subscription, heartbeat=0)
+    assert next(stream) == "retry: 3000\n\n"
+    assert next(stream) == format_event({"type": "tag", "tag_list_id": 1})
+    assert next(stream) == ": heartbeat\n\n"
+    stream.close()
+    assert broker._subscriptions == {}
+
+
+def test_format_event():
+    event = {"type": "tag", "tag_list_id": 1, "tag": "a\nb"}
+    assert format_event(event) == (f"event: tag\ndata: {json.dumps(event)}\n\n")
+
+
+def test_add_tag_notifies(app):
+    with connect(app.config["DB_URL"], autocommit=True) as listener:
+        listener.execute(f"LISTEN {EVENTS_CHANNEL}")
+        with app.app_context():
+            artifacts = CreateTagList(app)
+            datamodel = get_datamodel()
+            datamodel.add_tag(
+                "bird",
+                12.5,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+            datamodel.delete_tag_list(artifacts.tag_list_id)
+        events = []
+        notifies = listener.notifies()
+        for notify in notifies:
+            events.append(json.loads(notify.payload))
+            if len(events) == 4:
+                notifies.close()
+    assert [event["type"] for event in events] == [
+        "video",
+        "tag_list_created",
+        "tag",
+        "tag_list_deleted",
+    ]
+    assert events[1] == {
+        "type": "tag_list_created",
+        "tag_list_id": artifacts.tag_list_id,
+        "version": 0,
+    }
+    tag_event = events[2]
+    assert tag_event["tag_list_id"] == artifacts.tag_list_id
+    assert tag_event["video_id"] == artifacts.video_id
+    assert tag_event["tag"] == "bird"
+    assert tag_event["youtube_timestamp"] == 12.5
+    assert tag_event["version"] == 1
+    assert events[3] == {
+        "type": "tag_list_deleted",
+        "tag_list_id": artifacts.tag_list_id,
+        "version": 2,
+    }
@@ -0,0 +1,110 @@
+import time
+
+from videobookmarks import create_app
+from videobookmarks.db import get_datamodel
+from videobookmarks.events import RESET_EVENT
+from videobookmarks.fragments import FragmentCache
+from .conftest import DB_URL, CreateTagList
+
+
+def test_versions():
+    cache = FragmentCache(max_bytes=1000)
+    renders = []
+
+    def render(text):
+        def inner():
+            renders.append(text)
+            return text
+
+        return inner
+
+    assert cache.get_or_render("index", (), None, render("a")) == "a"
+    assert cache.get_or_render("view", (), 1, render("b")) == "b"
+    assert cache.get_or_render("index", (), None, render("c")) == "a"
+    assert cache.get_or_render("view", (), 1, render("d")) == "b"
+    assert renders == ["a", "b"]
+    # a change to another tag list only changes the index
+    cache.handle_event({"type": "tag", "tag_list_id": 2})
+    assert cache.get_or_render("index", (), None, render("e")) == "e"
+    assert cache.get_or_render("view", (), 1, render("f")) == "b"
+    cache.bump(1)
+    assert cache.get_or_render("view", (), 1, render("g")) == "g"
+    cache.handle_event(RESET_EVENT)
+    assert len(cache) == 0
+    assert cache.get_or_render("view", (), 1, render("h")) == "h"
+    assert (cache.hits, cache.misses) == (3, 5)
+
+
+def test_evicts_least_recently_used():
+    cache = FragmentCache(max_bytes=10)
+    cache.get_or_render("a", (), None, lambda: "aaaa")
+    cache.get_or_render("b", (), None, lambda: "bbbb")
+    cache.get_or_render("a", (), None, lambda: "")
+    cache.get_or_render("c", (), None, lambda: "cccc")
+    assert cache.size == 8
+    assert cache.get_or_render("a", (), None, lambda: "new") == "aaaa"
+    assert cache.get_or_render("b", (), None, lambda: "new") == "new"
+    # larger than the whole cache, never stored
+    assert cache.get_or_render("d", (), None, lambda: "d" * 11) == "d" * 11
+    assert cache.size <= 10
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cached_pages():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": DB_URL,
+            "PASSWORD_HASH_WORKERS": 0,
+            "WARM_UP": False,
+        }
+    )
+    client = app.test_client()
+    cache = app.extensions["fragment_cache"]
+    broker = app.extensions["event_broker"]
+    artifacts = CreateTagList(app)
+    try:
+        client.get("/")
+        wait_for(lambda: broker.listening)
+        first = client.get("/").data
+        assert client.get("/").data == first
+        assert cache.hits == 1
+        view = client.get(f"/{artifacts.tag_list_id}/view")
+        assert view.status_code == 200
+        assert client.get(f"/{artifacts.tag_list_id}/view").data == view.data
+        assert cache.hits == 2
+
+        # created through another worker, seen once the event arrives
+        with app.app_context():
+            get_datamodel().create_tag_list("another list", "", artifacts.user_id)
+        wait_for(lambda: b"another list" in client.get("/").data)
+
+        # logged in users always get a fresh page
+        hits = cache.hits
+        client.post(
+            "/authenticate/login",
+            data={"username": artifacts.username, "password": artifacts.password},
+        )
+        assert b"Log Out" in client.get("/").data
+        assert cache.hits == hits
+        client.delete(f"/delete_tag_list/{artifacts.tag_list_id}")
+        client.get("/authenticate/logout")
+        # deleted by this worker, so the page changes without waiting
+        assert artifacts.tag_list_name.encode() not in client.get("/").data
+    finally:
+        with app.app_context():
+            connection = get_datamodel()._connection
+            connection.execute(
+                "TRUNCATE users CASCADE;"
+                "TRUNCATE tag CASCADE;"
+                "TRUNCATE tag_list CASCADE;"
+                "TRUNCATE video CASCADE;"
+            )
+            connection.commit()
+        app.extensions["db_pool"].close()
@@ -0,0 +1,74 @@
+from videobookmarks import create_app
+from videobookmarks.db import get_datamodel
+from videobookmarks.metrics import Counter, Gauge, Histogram, MetricsRegistry
+from .conftest import CreateTagList
+
+
+def test_histogram_render():
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), (0.1, 1.0))
+    histogram.observe(0.05, ("a",))
+    histogram.observe(0.5, ("a",))
+    histogram.observe(5.0, ("a",))
+    assert histogram.count(("a",)) == 3
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="a",le="0.1"} 1',
+        'latency_seconds_bucket{route="a",le="1.0"} 2',
+        'latency_seconds_bucket{route="a",le="+Inf"} 3',
+        'latency_seconds_sum{route="a"} 5.55',
+        'latency_seconds_count{route="a"} 3',
+    ]
+
+
+def test_counter_and_gauge():
+    counter = Counter("errors_total", "Errors.", ("kind",))
+    counter.inc(('a"b',))
+    counter.inc(('a"b',), 2)
+    assert counter.render()[2] == 'errors_total{kind="a\\"b"} 3'
+    gauge = Gauge("open", "Open.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.value() == 1
+    assert Gauge("answer", "Answer.", function=lambda: 42).render()[2] == "answer 42"
+
+
+def test_metrics_disabled(app, client):
+    assert "metrics" not in app.extensions
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_endpoint(app):
+    metrics_app = create_app(
+        {"TESTING": True, "METRICS_ENABLED": True, "WARM_UP": False}
+    )
+    registry: MetricsRegistry = metrics_app.extensions["metrics"]
+    artifacts = CreateTagList(metrics_app)
+    client = metrics_app.test_client()
+    response = client.get(f"/get_tags/{artifacts.tag_list_id}")
+    assert response.status_code == 200
+    assert registry.request_duration.count(("GET", "tag.get_tag_list_tags", "200")) == 1
+    assert registry.datamodel_duration.count(("get_tag_list_tags",)) == 1
+    # every connection has been closed again
+    assert registry.db_connections_open.value() == 0
+    assert registry.db_connections_opened.value() >= 2
+
+    with metrics_app.app_context():
+        datamodel = get_datamodel()
+        try:
+            datamodel.delete_tag_list(-1)
+        except KeyError:
+            pass
+    assert registry.datamodel_errors.value(("delete_tag_list",)) == 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert (
+        'videobookmarks_datamodel_duration_seconds_count{method="get_tag_list_tags"} 1'
+        in body
+    )
+    assert "# TYPE videobookmarks_request_duration_seconds histogram" in body
+    metrics_app.extensions["db_pool"].close()
@@ -0,0 +1,55 @@
+import json
+import re
+
+from videobookmarks.datamodel.datamodel import PostgresDataModel
+from videobookmarks.datamodel.slow_query_log import SlowQueryLog
+from .conftest import CreateTagList
+
+PARTITION = re.compile(r"\btag_p\d+\b")
+
+
+def scanned_partitions(plan):
+    return {
+        partition
+        for line in plan.splitlines()
+        if "never executed" not in line
+        for partition in PARTITION.findall(line)
+    }
+
+
+def test_queries_read_one_partition(app, tmp_path):
+    """
+    Every query on tag for a single tag list only reads the partition of
+    that tag list. The plans are captured with the slow query log.
+    """
+    artifacts = CreateTagList(app)
+    path = tmp_path / "plans.jsonl"
+    log = SlowQueryLog(str(path), threshold=0, max_explains_per_minute=1000)
+    datamodel = PostgresDataModel(app.config["DB_URL"], slow_query_log=log)
+    tag_list_id = artifacts.tag_list_id
+    video_id = artifacts.video_id
+    try:
+        datamodel.add_tag("bird", 1.0, tag_list_id, video_id, artifacts.user_id)
+        datamodel.get_tag_list_tags(tag_list_id)
+        datamodel.get_tag_list_videos(tag_list_id)
+        datamodel.get_video_tags(video_id, tag_list_id)
+        datamodel.get_tag_list_changes(tag_list_id, None, 10)
+        datamodel.get_tag_list_changes(tag_list_id, 0, 10)
+        datamodel.get_tag_counts(tag_list_id)
+        datamodel.get_tag_suggestions_near(tag_list_id, video_id, 1.0, 30, "b", 10)
+    finally:
+        datamodel.close()
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    tag_queries = [
+        entry
+        for entry in entries
+        if re.search(r"\b(FROM|JOIN|INTO) tag\b", entry["query"])
+    ]
+    assert len(tag_queries) >= 8
+    for entry in tag_queries:
+        assert entry["plan"] is not None, entry["query"]
+        assert len(scanned_partitions(entry["plan"])) == 1, (
+            entry["query"],
+            entry["plan"],
+        )
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+from flask import g
+
+from videobookmarks.metrics import MetricsRegistry
+from videobookmarks.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def test_hash_and_check_in_workers():
+    registry = MetricsRegistry()
+    hasher = PasswordHasher(1, 4, 5.0, registry)
+    try:
+        password_hash = hasher.hash("secret")
+        assert hasher.check(password_hash, "secret")
+        assert not hasher.check(password_hash, "wrong")
+    finally:
+        hasher.shutdown()
+    rendered = registry.render()
+    assert 'videobookmarks_password_hash_queue_seconds_count{operation="hash"} 1' in (
+        rendered
+    )
+    assert (
+        'videobookmarks_password_hash_duration_seconds_count{operation="check"} 2'
+        in (rendered)
+    )
+
+
+def test_busy(app, client, auth):
+    auth.register()
+    hasher = app.extensions["password_hasher"]
+    hasher.queue_timeout = 0.01
+    # take every slot, as if other logins were being hashed
+    taken = 0
+    while hasher._slots.acquire(blocking=False):
+        taken += 1
+    try:
+        response = auth.login()
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "5"
+    finally:
+        for _ in range(taken):
+            hasher._slots.release()
+    assert auth.login().status_code == 302
+
+
+def test_busy_is_not_a_wrong_password():
+    hasher = PasswordHasher(0, 1, 0.01)
+    password_hash = hasher.hash("secret")
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(*args):
+        started.set()
+        release.wait(5)
+        return True
+
+    thread = threading.Thread(target=hasher._run, args=("check", slow))
+    thread.start()
+    started.wait(5)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.check(password_hash, "secret")
+    finally:
+        release.set()
+        thread.join()
+    assert hasher.check(password_hash, "secret")
+
+
+def test_no_connection_held_while_hashing(app, auth, monkeypatch):
+    hasher = app.extensions["password_hasher"]
+    holding = []
+    hash, check = hasher.hash, hasher.check
+
+    def record(function):
+        def wrapped(*args):
+            holding.append("datamodel" in g)
+            return function(*args)
+
+        return wrapped
+
+    monkeypatch.setattr(hasher, "hash", record(hash))
+    monkeypatch.setattr(hasher, "check", record(check))
+    assert auth.register().status_code == 302
+    assert auth.login().status_code == 302
+    assert holding == [False, False]
@@ -0,0 +1,67 @@
+import json
+
+from videobookmarks.datamodel.datamodel import PostgresDataModel
+from videobookmarks.datamodel.slow_query_log import SlowQueryLog, is_read_only
+from .conftest import CreateTagList
+
+
+def read_entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_is_read_only():
+    assert is_read_only("SELECT * FROM tag WHERE id = %s")
+    assert is_read_only("  WITH t AS (SELECT 1) SELECT * FROM t")
+    assert not is_read_only("INSERT INTO tag VALUES (1)")
+    assert not is_read_only("WITH d AS (UPDATE tag_list SET deleted = true) SELECT 1")
+    assert not is_read_only("SELECT pg_notify('a', 'b')")
+
+
+def test_slow_query_log(app, tmp_path):
+    artifacts = CreateTagList(app)
+    path = tmp_path / "slow.jsonl"
+    log = SlowQueryLog(str(path), threshold=0)
+    datamodel = PostgresDataModel(app.config["DB_URL"], slow_query_log=log)
+    try:
+        datamodel.add_tag(
+            "bird", 1.0, artifacts.tag_list_id, artifacts.video_id, artifacts.user_id
+        )
+        tags = datamodel.get_tag_list_tags(artifacts.tag_list_id)
+        datamodel.add_user("someone", "secret")
+    finally:
+        datamodel.close()
+    entries = read_entries(path)
+    # the EXPLAIN of the insert didn't add a second tag
+    assert tags[0].count == 1
+    select = next(
+        e for e in entries if e["query"].startswith("SELECT n.name as tag, g.count")
+    )
+    assert select["params"] == [artifacts.tag_list_id]
+    assert select["rowcount"] == 1
+    assert "actual time" in select["plan"]
+    insert = next(e for e in entries if "INSERT INTO tag " in e["query"])
+    assert insert["plan"] is not None
+    assert "actual time" not in insert["plan"]
+    add_user = next(e for e in entries if "INSERT INTO users" in e["query"])
+    assert add_user["params"] == "<redacted>"
+
+
+def test_slow_query_log_rate_limit(app, tmp_path):
+    artifacts = CreateTagList(app)
+    path = tmp_path / "slow.jsonl"
+    log = SlowQueryLog(str(path), threshold=0, max_explains_per_minute=1)
+    datamodel = PostgresDataModel(app.config["DB_URL"], slow_query_log=log)
+    try:
+        datamodel.get_tag_list(artifacts.tag_list_id)
+        datamodel.get_tag_list(artifacts.tag_list_id)
+    finally:
+        datamodel.close()
+    plans = [entry["plan"] for entry in read_entries(path)]
+    assert len(plans) == 2
+    assert plans[0] is not None
+    assert plans[1] is None
+    # nothing is logged under the threshold
+    log = SlowQueryLog(str(tmp_path / "fast.jsonl"), threshold=60)
+    log.record(None, "SELECT 1", None, 0.5, 1)
+    assert not (tmp_path / "fast.jsonl").exists()
@@ -0,0 +1,68 @@
+from videobookmarks.datamodel.datamodel import TagSuggestion
+from videobookmarks import suggestions
+from videobookmarks.suggestions import TagSuggestionCache, TagSuggestionIndex
+
+
+def test_suggest_prefix():
+    index = TagSuggestionIndex(
+        [
+            TagSuggestion(tag="bird", count=3),
+            TagSuggestion(tag="Bike", count=5),
+            TagSuggestion(tag="tree", count=10),
+        ]
+    )
+    assert index.suggest("bi", 10) == [
+        TagSuggestion(tag="Bike", count=5),
+        TagSuggestion(tag="bird", count=3),
+    ]
+    assert index.suggest("", 1) == [TagSuggestion(tag="tree", count=10)]
+    assert index.suggest("x", 10) == []
+
+
+def test_suggest_after_add():
+    index = TagSuggestionIndex([TagSuggestion(tag="bird", count=1)])
+    index.add("bike")
+    index.add("bike")
+    assert index.suggest("b", 10) == [
+        TagSuggestion(tag="bike", count=2),
+        TagSuggestion(tag="bird", count=1),
+    ]
+
+
+def test_suggest_large_prefix_range(monkeypatch):
+    monkeypatch.setattr(suggestions, "RANK_BY_PREFIX_MAX_CANDIDATES", 2)
+    index = TagSuggestionIndex(
+        [TagSuggestion(tag=f"tag{i}", count=i) for i in range(10)]
+    )
+    assert index.suggest("tag", 3) == [
+        TagSuggestion(tag="tag9", count=9),
+        TagSuggestion(tag="tag8", count=8),
+        TagSuggestion(tag="tag7", count=7),
+    ]
+
+
+class RecordingDataModel:
+    """
+    Records a tag, as another request would, while the index is built.
+    """
+
+    def __init__(self, cache, tag):
+        self.cache = cache
+        self.tag = tag
+
+    def get_tag_counts(self, tag_list_id):
+        self.cache.record_tag(tag_list_id, self.tag)
+        return [TagSuggestion(tag="bird", count=1)]
+
+
+def test_cache_applies_tags_recorded_during_build():
+    cache = TagSuggestionCache(max_lists=10, ttl=60)
+    datamodel = RecordingDataModel(cache, "bike")
+    assert cache.suggest(datamodel, 1, "b", 10) == [
+        TagSuggestion(tag="bike", count=1),
+        TagSuggestion(tag="bird", count=1),
+    ]
+    # and the kept index has it too
+    assert cache.get(datamodel, 1).suggest("bik", 10) == [
+        TagSuggestion(tag="bike", count=1)
+    ]
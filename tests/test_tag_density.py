@@ -0,0 +1,105 @@
+from videobookmarks.db import get_datamodel
+from videobookmarks.density import get_tag_density_cache
+from .conftest import CreateTagList
+
+
+def add_tags(app, artifacts, tags):
+    with app.app_context():
+        datamodel = get_datamodel()
+        for tag, timestamp in tags:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+
+
+def test_tag_density(app):
+    artifacts = CreateTagList(app)
+    add_tags(
+        app,
+        artifacts,
+        [("bird", 1.0), ("bird", 9.5), ("tree", 10.0), ("bird", 35.0), ("tree", -1)],
+    )
+    with app.app_context():
+        density = get_datamodel().get_tag_density(
+            artifacts.video_id, artifacts.tag_list_id, 10.0, 500, 1
+        )
+    assert density.bucket_width == 10.0
+    assert density.counts == [3, 1, 0, 1]
+    # only the most used one
+    assert density.by_tag == {"bird": [2, 0, 0, 1]}
+    assert density.peak == 0.0
+    assert density.version == 5
+
+
+def test_tag_density_max_buckets(app):
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, [("bird", 0.0), ("bird", 99.0), ("bird", 100.0)])
+    with app.app_context():
+        density = get_datamodel().get_tag_density(
+            artifacts.video_id, artifacts.tag_list_id, 1.0, 4, 0
+        )
+    # widened to a whole number of seconds, with the last tag in the last bucket
+    assert density.bucket_width == 26.0
+    assert density.counts == [1, 0, 0, 2]
+    assert density.by_tag is None
+    assert density.peak == 78.0
+
+
+def test_tag_density_no_tags(app):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        datamodel = get_datamodel()
+        density = datamodel.get_tag_density(
+            artifacts.video_id, artifacts.tag_list_id, 10.0, 500, 0
+        )
+        assert density.counts == []
+        assert density.peak is None
+        assert datamodel.get_tag_density(artifacts.video_id, -1, 10.0, 500, 0) is None
+
+
+def test_tag_density_cache(app, monkeypatch):
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, [("bird", 1.0)])
+    with app.app_context():
+        datamodel = get_datamodel()
+        cache = get_tag_density_cache()
+        computed = []
+        get_tag_density = datamodel.get_tag_density
+
+        def counting(*args):
+            computed.append(args)
+            return get_tag_density(*args)
+
+        monkeypatch.setattr(datamodel, "get_tag_density", counting)
+        args = (artifacts.video_id, artifacts.tag_list_id, 10.0, 0)
+        assert cache.get(datamodel, *args).counts == [1]
+        assert cache.get(datamodel, *args).counts == [1]
+        assert len(computed) == 1
+        # a new version of the tag list makes the entry stale
+        datamodel.add_tag(
+            "tree", 2.0, artifacts.tag_list_id, artifacts.video_id, artifacts.user_id
+        )
+        assert cache.get(datamodel, *args).counts == [2]
+        assert len(computed) == 2
+
+
+def test_tag_density_route(app, client):
+    artifacts = CreateTagList(app)
+    add_tags(app, artifacts, [("bird", 1.0), ("tree", 12.0)])
+    url = f"/tag_density/{artifacts.video_id}/{artifacts.tag_list_id}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json["counts"] == [1, 1]
+    assert response.json["bucket_width"] == 10.0
+    assert response.json["by_tag"] is None
+    response = client.get(url, query_string={"width": 5, "by_tag": 1})
+    assert response.json["counts"] == [1, 0, 1]
+    assert response.json["by_tag"] == {"bird": [1, 0, 0], "tree": [0, 0, 1]}
+    assert client.get(url, query_string={"width": 0}).status_code == 400
+    assert client.get(url, query_string={"width": "inf"}).status_code == 400
+    response = client.get(f"/tag_density/{artifacts.video_id}/-1")
+    assert response.status_code == 404
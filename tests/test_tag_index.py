@@ -0,0 +1,159 @@
+import random
+
+from videobookmarks.datamodel.datamodel import TagVideoPair
+from videobookmarks.events import RESET_EVENT
+from videobookmarks.tag_index import (
+    MATCH_ALL,
+    TagFilterResult,
+    TagIndexCache,
+    TagVideoIndex,
+)
+from .conftest import CreateTagList
+
+
+def make_index():
+    return TagVideoIndex(
+        [
+            TagVideoPair(tag="bird", link="a"),
+            TagVideoPair(tag="tree", link="a"),
+            TagVideoPair(tag="bird", link="b"),
+            TagVideoPair(tag="sky", link="c"),
+        ]
+    )
+
+
+def test_filter():
+    index = make_index()
+    assert index.filter([], []) == TagFilterResult(
+        videos=["a", "b", "c"], tags=["bird", "sky", "tree"], num_videos=3, num_tags=3
+    )
+    assert index.filter(["tree", "sky"], ["b"]) == TagFilterResult(
+        videos=["a", "c"], tags=["bird"], num_videos=2, num_tags=1
+    )
+    assert index.filter(["bird", "tree"], ["a", "b"], MATCH_ALL) == TagFilterResult(
+        videos=["a"], tags=["bird"], num_videos=1, num_tags=1
+    )
+    # names that aren't in the tag list match nothing
+    assert index.filter(["bird", "unknown"], [], MATCH_ALL).videos == []
+    assert index.filter(["bird", "unknown"], []).videos == ["a", "b"]
+    assert index.filter(["bird"], [], limit=1).videos == ["a"]
+    assert index.filter(["bird"], [], limit=0) == TagFilterResult(
+        videos=[], tags=[], num_videos=2, num_tags=3
+    )
+
+
+def test_add():
+    index = make_index()
+    size = index.nbytes
+    index.add("sky", "b")
+    index.add("sky", "b")
+    index.add("rain", "d")
+    assert index.filter(["sky"], []).videos == ["b", "c"]
+    assert index.filter([], ["d"]).tags == ["rain"]
+    assert (index.num_tags, index.num_videos) == (4, 4)
+    assert index.nbytes > size
+
+
+def test_filter_many():
+    rng = random.Random(0)
+    pairs = {
+        (f"tag{rng.randrange(50)}", f"v{rng.randrange(2000)}") for _ in range(5000)
+    }
+    index = TagVideoIndex([TagVideoPair(tag=tag, link=link) for tag, link in pairs])
+    videos_of = {}
+    for tag, link in pairs:
+        videos_of.setdefault(tag, set()).add(link)
+    result = index.filter(["tag1", "tag2"], [])
+    assert result.videos == sorted(videos_of["tag1"] | videos_of["tag2"])
+    result = index.filter(["tag1", "tag2"], [], MATCH_ALL)
+    assert result.videos == sorted(videos_of["tag1"] & videos_of["tag2"])
+
+
+def test_cache_events():
+    cache = TagIndexCache(max_bytes=1024 * 1024)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [TagVideoPair(tag="bird", link="a")]
+
+    index = cache.get(1, load)
+    assert cache.get(1, load) is index
+    cache.handle_event({"type": "tag", "tag_list_id": 1, "tag": "sky", "link": "b"})
+    assert index.filter([], []).videos == ["a", "b"]
+    assert cache.size == index.nbytes
+    cache.handle_event({"type": "tag_list_deleted", "tag_list_id": 1})
+    assert len(cache) == 0
+    cache.get(1, load)
+    cache.handle_event(RESET_EVENT)
+    assert (len(cache), cache.size) == (0, 0)
+    assert len(loads) == 2
+    assert cache.get(2, lambda: None) is None
+
+
+def test_cache_tags_added_while_building():
+    cache = TagIndexCache(max_bytes=1024 * 1024)
+
+    def load():
+        # committed after the pairs were read
+        cache.record_tag(1, "sky", "b")
+        return [TagVideoPair(tag="bird", link="a")]
+
+    assert cache.get(1, load).filter(["sky"], []).videos == ["b"]
+    assert len(cache) == 1
+
+    def load_reset():
+        cache.invalidate(2)
+        return [TagVideoPair(tag="bird", link="a")]
+
+    cache.get(2, load_reset)
+    # may have missed changes, so it isn't kept
+    assert len(cache) == 1
+
+
+def test_cache_evicts_least_recently_used():
+    def load(link):
+        return lambda: [TagVideoPair(tag="bird", link=link)]
+
+    size = TagVideoIndex(load("a")()).nbytes
+    cache = TagIndexCache(max_bytes=2 * size)
+    cache.get(1, load("a"))
+    cache.get(2, load("b"))
+    cache.get(1, load("a"))
+    cache.get(3, load("c"))
+    assert cache.size <= 2 * size
+    loads = []
+    cache.get(1, lambda: loads.append(1) or [])
+    assert loads == []
+    # not kept without the events
+    cache.get(4, load("d"), keep=False)
+    assert len(cache) == 2
+
+
+def test_filter_route(app, client, auth):
+    artifacts = CreateTagList(app)
+    auth.login(artifacts.username, artifacts.password)
+    for tag, timestamp in [("bird", 1.0), ("tree", 2.0)]:
+        response = client.post(
+            "/add_tag",
+            json={
+                "tag": tag,
+                "timestamp": timestamp,
+                "tag_list_id": artifacts.tag_list_id,
+                "yt_video_id": artifacts.yt_video_id,
+            },
+        )
+        assert response.status_code == 200
+    url = f"/filter/{artifacts.tag_list_id}"
+    response = client.get(url, query_string={"tag": ["bird", "sky"]})
+    assert response.json == {
+        "videos": [artifacts.yt_video_id],
+        "tags": ["bird", "tree"],
+        "num_videos": 1,
+        "num_tags": 2,
+    }
+    response = client.get(url, query_string={"tag": ["bird", "sky"], "match": "all"})
+    assert response.json["num_videos"] == 0
+    assert client.get(url, query_string={"match": "some"}).status_code == 400
+    assert client.get(url, query_string={"limit": -1}).status_code == 400
+    assert client.get("/filter/-1").status_code == 404
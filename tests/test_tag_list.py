@@ -1,3 +1,8 @@
+import csv
+import html
+import io
+import json
+import re
 import unittest
 from videobookmarks.db import get_datamodel
 from .conftest import CreateTagList
@@ -190,6 +195,23 @@ def test_get_videos(app, client, auth):
     )
 
 
+def test_add_tag_to_deleted_tag_list(app, client, auth):
+    artifacts = CreateTagList(app)
+    auth.login(artifacts.username, artifacts.password)
+    with app.app_context():
+        get_datamodel().delete_tag_list(artifacts.tag_list_id)
+    response = client.post(
+        '/add_tag',
+        json={
+            'tag': 'monkey',
+            'timestamp': 1.123,
+            'tag_list_id': artifacts.tag_list_id,
+            'yt_video_id': artifacts.yt_video_id,
+        }
+    )
+    assert response.status_code == 404
+
+
 def test_create_tag_on_existing_video(app, client, auth):
     artifacts = CreateTagList(app)
     auth.login(artifacts.username, artifacts.password)
@@ -206,9 +228,10 @@ def test_create_tag_on_existing_video(app, client, auth):
     with app.app_context():
         dm = get_datamodel()
         tag_row = dm._connection.execute(
-            "SELECT tag, youtube_timestamp, video_id, tag_list_id"
-            " FROM tag"
-            " WHERE id=%s",
+            "SELECT n.name as tag, youtube_timestamp, video_id, tag_list_id"
+            " FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " WHERE t.id=%s",
             (tag_id,)
         ).fetchone()
         assert tag_row["tag"] == "monkey"
@@ -280,9 +303,10 @@ def test_create_tag_on_existing_video_new_video(app, client, auth):
 
         # test the actual tag was inserted accurately
         tag_row = dm._connection.execute(
-            "SELECT tag, youtube_timestamp, video_id, tag_list_id"
-            " FROM tag"
-            " WHERE id=%s",
+            "SELECT n.name as tag, youtube_timestamp, video_id, tag_list_id"
+            " FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " WHERE t.id=%s",
             (tag_id,)
         ).fetchone()
         assert tag_row["tag"] == "monkey"
@@ -332,3 +356,215 @@ def test_delete_tag_list_different_user(app, client, auth):
         assert artifacts.tag_list_id in tag_list_ids
         tag_list = dm.get_tag_list(artifacts.tag_list_id)
         assert tag_list.deleted is False
+
+
+def test_suggest_tags(app, client, auth):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        dm = get_datamodel()
+        for tag, timestamp in [("monkey", 1.0), ("monkey", 2.0), ("moose", 50.0)]:
+            dm.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+    response = client.get(f"/suggest_tags/{artifacts.tag_list_id}?prefix=MO")
+    assert response.status_code == 200
+    assert response.json == [
+        {"tag": "monkey", "count": 2},
+        {"tag": "moose", "count": 1},
+    ]
+    # tags near the current timestamp of the video come first
+    response = client.get(
+        f"/suggest_tags/{artifacts.tag_list_id}"
+        f"?prefix=mo&video_id={artifacts.video_id}&timestamp=49"
+    )
+    assert [s["tag"] for s in response.json] == ["moose", "monkey"]
+
+
+def test_suggest_tags_after_add_tag(app, client, auth):
+    artifacts = CreateTagList(app)
+    auth.login(artifacts.username, artifacts.password)
+    # load the suggestion index before the tag is added
+    response = client.get(f"/suggest_tags/{artifacts.tag_list_id}")
+    assert response.json == []
+    client.post(
+        '/add_tag',
+        json={
+            'tag': 'monkey',
+            'timestamp': 1.123,
+            'tag_list_id': artifacts.tag_list_id,
+            'yt_video_id': artifacts.yt_video_id,
+        }
+    )
+    response = client.get(f"/suggest_tags/{artifacts.tag_list_id}?prefix=m")
+    assert response.json == [{"tag": "monkey", "count": 1}]
+
+
+def test_changes(app, client, auth):
+    artifacts = CreateTagList(app)
+    auth.login(artifacts.username, artifacts.password)
+    response = client.get(f"/changes/{artifacts.tag_list_id}")
+    assert response.json == {
+        "version": 0,
+        "deleted": False,
+        "snapshot": True,
+        "changes": [],
+    }
+    client.post(
+        '/add_tag',
+        json={
+            "tag": "bird",
+            "timestamp": 5,
+            "tag_list_id": artifacts.tag_list_id,
+            "yt_video_id": artifacts.yt_video_id,
+        },
+    )
+    response = client.get(f"/changes/{artifacts.tag_list_id}?since=0")
+    assert response.json["version"] == 1
+    assert response.json["snapshot"] is False
+    assert [c["tag"] for c in response.json["changes"]] == ["bird"]
+    response = client.get(f"/changes/{artifacts.tag_list_id}?since=1")
+    assert response.json["changes"] == []
+    response = client.get(
+        f"/changes/{artifacts.tag_list_id}?since=0&video_id={artifacts.video_id + 1}"
+    )
+    assert response.json["version"] == 1
+    assert response.json["changes"] == []
+    assert client.get("/changes/0").status_code == 404
+
+
+def test_export(app, client):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        datamodel = get_datamodel()
+        for tag, timestamp in [("bird", 1.5), ("tree, big", 2.0), ("bird", 3.0)]:
+            datamodel.add_tag(
+                tag,
+                timestamp,
+                artifacts.tag_list_id,
+                artifacts.video_id,
+                artifacts.user_id,
+            )
+    # smaller than the tag list, so that it is sent in several chunks
+    app.config["EXPORT_BATCH_SIZE"] = 2
+    response = client.get(f"/export/{artifacts.tag_list_id}")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert "attachment" in response.headers["Content-Disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert [row["tag"] for row in rows] == ["bird", "tree, big", "bird"]
+    assert rows[0]["version"] == "1"
+    assert rows[0]["link"] == artifacts.yt_video_id
+    assert rows[0]["youtube_timestamp"] == "1.5"
+    assert rows[0]["username"] == artifacts.username
+
+    response = client.get(f"/export/{artifacts.tag_list_id}?format=jsonl")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line["tag"] for line in lines] == ["bird", "tree, big", "bird"]
+    assert lines[1]["title"] == "fake youtube title"
+
+    assert client.get(f"/export/{artifacts.tag_list_id}?format=xml").status_code == 400
+    assert client.get("/export/0").status_code == 404
+
+
+def test_index_search(app, client):
+    artifacts = CreateTagList(app, suffix="_searchable")
+    CreateTagList(app, suffix="_other")
+    response = client.get('/?q=searchable')
+    assert response.status_code == 200
+    assert artifacts.tag_list_name in response.data.decode()
+    assert 'tag list name_other' not in response.data.decode()
+    assert 'value="searchable"' in response.data.decode()
+
+
+def test_search(app, client):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        dm = get_datamodel()
+        dm.add_tag(
+            'test',
+            1.0,
+            artifacts.tag_list_id,
+            artifacts.video_id,
+            artifacts.user_id,
+        )
+    response = client.get('/search?q=youtube')
+    assert response.status_code == 200
+    assert response.json["tag_lists"] == []
+    assert response.json["videos"] == [
+        {
+            "link": artifacts.yt_video_id,
+            "title": "fake youtube title",
+            "thumbnail": "fakethumbnailurl.com",
+            "tag_list_id": artifacts.tag_list_id,
+            "tag_list_name": artifacts.tag_list_name,
+        }
+    ]
+    response = client.get('/search?q=description')
+    assert [tl["id"] for tl in response.json["tag_lists"]] == [artifacts.tag_list_id]
+
+
+def test_index_pagination(app, client):
+    app.config["TAG_LIST_PAGE_SIZE"] = 1
+    first = CreateTagList(app, suffix="_first")
+    second = CreateTagList(app, suffix="_second")
+    response = client.get('/')
+    assert second.tag_list_name in response.data.decode()
+    assert first.tag_list_name not in response.data.decode()
+    assert 'Next page' in response.data.decode()
+    next_link = re.search(r'href="(/\?[^"]*cursor=[^"]*)"', response.data.decode())
+    response = client.get(html.unescape(next_link.group(1)))
+    assert first.tag_list_name in response.data.decode()
+    assert 'Next page' not in response.data.decode()
+
+
+def test_index_invalid_sort(app, client):
+    response = client.get('/?sort=nonsense')
+    assert response.status_code == 400
+
+
+def test_tag_occurrences(app, client):
+    artifacts = CreateTagList(app)
+    with app.app_context():
+        get_datamodel().add_tag(
+            'goal',
+            12.5,
+            artifacts.tag_list_id,
+            artifacts.video_id,
+            artifacts.user_id,
+        )
+    response = client.get('/tag_occurrences?tag=goal')
+    assert response.json == {
+        'tag': 'goal',
+        'tag_lists': [
+            {
+                'tag_list_id': artifacts.tag_list_id,
+                'name': artifacts.tag_list_name,
+                'username': artifacts.username,
+                'videos': [
+                    {
+                        'video_id': artifacts.video_id,
+                        'link': artifacts.yt_video_id,
+                        'title': 'fake youtube title',
+                        'thumbnail': 'fakethumbnailurl.com',
+                        'timestamps': [12.5],
+                    }
+                ],
+            }
+        ],
+        'next_cursor': None,
+    }
+    assert client.get('/tag_occurrences').status_code == 400
+    response = client.get('/tag_occurrences?tag=goal&cursor=nonsense')
+    assert response.status_code == 400
+
+
+def test_missing_tag_list_pages(app, client):
+    for url in ['/999999/view', '/tagging/999999/some_video']:
+        response = client.get(url)
+        assert response.status_code == 404
+        assert "Tag list id 999999 doesn&#39;t exist." in response.data.decode()
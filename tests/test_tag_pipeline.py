@@ -0,0 +1,153 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from psycopg import connect
+
+from videobookmarks.db import get_datamodel
+from .conftest import DB_URL, CreateTagList
+
+# the framework is shipped in the lambda images rather than the app
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "containers", "ml_pipeline_containers"
+    ),
+)
+from tag_pipeline import (  # noqa: E402
+    BulkTagSink,
+    GeneratedTag,
+    Job,
+    Pipeline,
+    PipelineError,
+    Sink,
+    Stage,
+)
+
+
+class ListSink(Sink):
+    def __init__(self, delay=0.0):
+        self.items = []
+        self.closed = False
+        self.aborted = False
+        self.delay = delay
+
+    def write(self, item):
+        time.sleep(self.delay)
+        self.items.append(item)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_pipeline():
+    sink = ListSink()
+    pipeline = Pipeline(
+        source=lambda: range(100),
+        stages=[
+            Stage("double", lambda x: [x, x], workers=3),
+            Stage("even", lambda x: [x] if x % 2 == 0 else [], workers=2),
+        ],
+        sink=sink,
+        queue_size=4,
+    )
+    metrics = pipeline.run()
+    assert sorted(sink.items) == sorted(2 * list(range(0, 100, 2)))
+    assert sink.closed
+    assert list(metrics) == ["source", "double", "even", "sink"]
+    assert metrics["source"].items_out == 100
+    assert (metrics["double"].items_in, metrics["double"].items_out) == (100, 200)
+    assert (metrics["even"].items_in, metrics["even"].items_out) == (200, 100)
+    assert metrics["sink"].items_in == 100
+    assert metrics["sink"].throughput > 0
+
+
+def test_backpressure():
+    produced = []
+    sink = ListSink(delay=0.002)
+    ahead = []
+
+    def source():
+        for i in range(50):
+            produced.append(i)
+            ahead.append(len(produced) - len(sink.items))
+            yield i
+
+    Pipeline(source, [Stage("copy", lambda x: [x])], sink, queue_size=2).run()
+    assert len(sink.items) == 50
+    # two queues, and an item in each of the three stages after the source
+    assert max(ahead) <= 2 * 2 + 3 + 1
+
+
+def test_pipeline_error():
+    sink = ListSink()
+
+    def fail(x):
+        if x == 5:
+            raise ValueError("bad item")
+        return [x]
+
+    thread_count = threading.active_count()
+    with pytest.raises(PipelineError) as error:
+        Pipeline(lambda: range(1000), [Stage("fail", fail)], sink, queue_size=2).run()
+    assert isinstance(error.value.__cause__, ValueError)
+    assert not sink.closed
+    assert sink.aborted
+    assert threading.active_count() == thread_count
+
+
+def test_bulk_tag_sink(app):
+    artifacts = CreateTagList(app)
+    job = Job(
+        "emotions.parquet", artifacts.video_id, artifacts.tag_list_id, artifacts.user_id
+    )
+    missing = Job("emotions.parquet", artifacts.video_id, -1, artifacts.user_id)
+    sink = BulkTagSink(lambda: connect(DB_URL), batch_size=2)
+    for tag in [
+        GeneratedTag(job, "happy", 1.0),
+        GeneratedTag(job, "sad", 2.0),
+        GeneratedTag(missing, "happy", 3.0),
+        GeneratedTag(job, "happy", 4.0),
+    ]:
+        sink.write(tag)
+    sink.close()
+    assert sink.written == 3
+    with app.app_context():
+        datamodel = get_datamodel()
+        tag_list = datamodel.get_tag_list(artifacts.tag_list_id)
+        rows = datamodel._connection.execute(
+            "SELECT n.name, youtube_timestamp, list_version FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " WHERE tag_list_id = %s ORDER BY list_version",
+            (artifacts.tag_list_id,),
+        ).fetchall()
+    assert [(row["name"], row["youtube_timestamp"]) for row in rows] == [
+        ("happy", 1.0),
+        ("sad", 2.0),
+        ("happy", 4.0),
+    ]
+    assert (tag_list.num_tags, tag_list.num_videos) == (3, 1)
+    assert rows[-1]["list_version"] == tag_list.version
+
+
+def test_bulk_tag_sink_abort(app):
+    artifacts = CreateTagList(app)
+    job = Job(
+        "emotions.parquet", artifacts.video_id, artifacts.tag_list_id, artifacts.user_id
+    )
+    sink = BulkTagSink(lambda: connect(DB_URL), batch_size=2)
+    for timestamp in range(3):
+        sink.write(GeneratedTag(job, "happy", float(timestamp)))
+    # the first batch was written, but not committed
+    sink.abort()
+    assert sink.written == 0
+    with app.app_context():
+        datamodel = get_datamodel()
+        tag_list = datamodel.get_tag_list(artifacts.tag_list_id)
+        assert len(datamodel.get_tag_list_tags(artifacts.tag_list_id)) == 0
+    assert tag_list.num_tags == 0
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+from videobookmarks import create_app
+from videobookmarks.db import get_datamodel
+from videobookmarks.video_details import (
+    RateLimiter,
+    VideoDetailsResolver,
+    placeholder_details,
+)
+from .conftest import DB_URL, CreateTagList
+
+
+def get_video(app, video_id):
+    with app.app_context():
+        return (
+            get_datamodel()
+            ._connection.execute(
+                "SELECT link, title, thumbnail, details_pending FROM video WHERE id = %s",
+                (video_id,),
+            )
+            .fetchone()
+        )
+
+
+def create_pending_video(app, link):
+    placeholder = placeholder_details(link)
+    with app.app_context():
+        video_id, created = get_datamodel().create_pending_video_id(
+            link, placeholder["thumbnail_url"], placeholder["title"]
+        )
+    assert created
+    return video_id
+
+
+def make_resolver(app, provider, **kwargs):
+    options = dict(
+        workers=2,
+        max_calls_per_second=None,
+        max_attempts=3,
+        retry_delay=0.01,
+        batch_size=50,
+    )
+    options.update(kwargs)
+    return VideoDetailsResolver(app, provider, **options)
+
+
+def test_tagging_page_does_not_wait(app, client):
+    artifacts = CreateTagList(app)
+    fetched = threading.Event()
+    release = threading.Event()
+
+    def provider(links):
+        fetched.set()
+        release.wait(5)
+        return {link: {"title": "a title", "thumbnail_url": "a.jpg"} for link in links}
+
+    resolver = make_resolver(app, provider)
+    app.extensions["video_details"] = resolver
+    try:
+        response = client.get(f"/tagging/{artifacts.tag_list_id}/new_video")
+        assert response.status_code == 200
+        assert fetched.wait(5)
+        with app.app_context():
+            video_id = get_datamodel().load_video_id("new_video")
+        video = get_video(app, video_id)
+        assert video["title"] == "new_video"
+        assert video["details_pending"]
+        # a second visit doesn't create or queue it again
+        client.get(f"/tagging/{artifacts.tag_list_id}/new_video")
+        release.set()
+        assert resolver.wait_until_idle(5)
+        video = get_video(app, video_id)
+        assert (video["title"], video["thumbnail"]) == ("a title", "a.jpg")
+        assert not video["details_pending"]
+    finally:
+        release.set()
+        resolver.close()
+
+
+def test_retry_and_unknown_videos(app):
+    video_id = create_pending_video(app, "flaky")
+    unknown_id = create_pending_video(app, "unknown")
+    calls = []
+
+    def provider(links):
+        calls.append(sorted(links))
+        if len(calls) < 3:
+            raise ConnectionError("youtube is down")
+        return {"flaky": {"title": "flaky title", "thumbnail_url": "flaky.jpg"}}
+
+    resolver = make_resolver(app, provider, workers=1)
+    try:
+        # the other one is queued too, by the recovery of pending videos
+        resolver.submit(video_id, "flaky")
+        assert resolver.wait_until_idle(5)
+    finally:
+        resolver.close()
+    assert len(calls) >= 3
+    assert get_video(app, video_id)["title"] == "flaky title"
+    unknown = get_video(app, unknown_id)
+    assert unknown["title"] == "unknown"
+    assert not unknown["details_pending"]
+
+
+def test_give_up(app):
+    video_id = create_pending_video(app, "broken")
+    calls = []
+
+    def provider(links):
+        calls.append(links)
+        raise ConnectionError("youtube is down")
+
+    resolver = make_resolver(app, provider, workers=1, max_attempts=2)
+    try:
+        resolver.submit(video_id, "broken")
+        assert resolver.wait_until_idle(5)
+    finally:
+        resolver.close()
+    assert len(calls) == 2
+    # left pending for the next worker process
+    assert get_video(app, video_id)["details_pending"]
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(100)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.03
+
+
+def test_fake_provider():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": DB_URL,
+            "YT_API_KEY": None,
+            "VIDEO_DETAILS_PROVIDER": "fake",
+            "VIDEO_DETAILS_WORKERS": 0,
+            "PASSWORD_HASH_WORKERS": 0,
+            "FRAGMENT_CACHE_MAX_BYTES": 0,
+            "WARM_UP": False,
+        }
+    )
+    try:
+        artifacts = CreateTagList(app)
+        client = app.test_client()
+        response = client.get(f"/tagging/{artifacts.tag_list_id}/fake_video")
+        assert response.status_code == 200
+        with app.app_context():
+            video_id = get_datamodel().load_video_id("fake_video")
+        video = get_video(app, video_id)
+        assert video["title"] == "Video fake_video"
+        assert not video["details_pending"]
+    finally:
+        with app.app_context():
+            connection = get_datamodel()._connection
+            connection.execute(
+                "TRUNCATE users CASCADE;"
+                "TRUNCATE tag CASCADE;"
+                "TRUNCATE tag_list CASCADE;"
+                "TRUNCATE video CASCADE;"
+            )
+            connection.commit()
+        app.extensions["db_pool"].close()
+
+
+def test_youtube_errors_are_raised(app, monkeypatch):
+    import requests
+
+    from videobookmarks.tag import get_videos_details
+
+    def get(url, params, timeout):
+        response = requests.Response()
+        response.status_code = 403
+        response._content = b'{"error": {"code": 403, "message": "quota"}}'
+        return response
+
+    monkeypatch.setattr(requests, "get", get)
+    with app.app_context():
+        # rather than taking the videos for unknown ones
+        with pytest.raises(requests.HTTPError):
+            get_videos_details(["some_video"])
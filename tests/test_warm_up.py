@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from videobookmarks import create_app
+from videobookmarks.db import get_datamodel
+from .conftest import DB_URL, CreateTagList
+
+
+def test_warm_up():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": DB_URL,
+            "PASSWORD_HASH_WORKERS": 0,
+            "FRAGMENT_CACHE_MAX_BYTES": 0,
+            "DB_POOL_MIN_SIZE": 2,
+        }
+    )
+    pool = app.extensions["db_pool"]
+    try:
+        assert pool.get_stats()["pool_available"] == 2
+        cache_directory = os.path.join(app.instance_path, "jinja_cache")
+        assert len(os.listdir(cache_directory)) >= len(app.jinja_env.list_templates())
+        artifacts = CreateTagList(app)
+        client = app.test_client()
+        for _ in range(3):
+            assert client.get(f"/{artifacts.tag_list_id}/view").status_code == 200
+        # the requests took their connection from the pool and gave it back
+        assert pool.get_stats()["connections_num"] == 2
+        assert pool.get_stats()["pool_available"] == 2
+    finally:
+        with app.app_context():
+            connection = get_datamodel()._connection
+            connection.execute(
+                "TRUNCATE users CASCADE;"
+                "TRUNCATE tag CASCADE;"
+                "TRUNCATE tag_list CASCADE;"
+                "TRUNCATE video CASCADE;"
+            )
+            connection.commit()
+        pool.close()
+
+
+def test_missing_config():
+    with pytest.raises(ValueError, match="YT_API_KEY"):
+        create_app({"TESTING": True, "YT_API_KEY": None, "WARM_UP": False})
@@ -3,12 +3,6 @@ from typing import Optional, Mapping, Any
 
 from flask import Flask, request, redirect, Response
 
-DB_URL = os.getenv("DB_URL")
-if DB_URL is None:
-    raise ValueError(
-        "Missing DB_URL environment variable, could not connect to Database"
-    )
-
 
 def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     """Create and configure an instance of the Flask application."""
@@ -17,7 +11,93 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
         # a default secret that should be overridden by instance config
         SECRET_KEY="dev",
         # store the database in the instance folder
-        DB_URL=DB_URL,
+        DB_URL=os.getenv("DB_URL"),
+        YT_API_KEY=os.getenv("YT_API_KEY"),
+        # requests take a connection from a pool of at most DB_POOL_MAX_SIZE
+        # connections, waiting up to DB_POOL_TIMEOUT seconds for one. 0
+        # connects for every request instead.
+        DB_POOL_MIN_SIZE=2,
+        DB_POOL_MAX_SIZE=10,
+        DB_POOL_TIMEOUT=30.0,
+        # compile the templates, open the connection pool and run the most
+        # common queries in create_app, so that the first requests don't
+        # pay for it. Compiled templates are cached in the instance folder.
+        WARM_UP=True,
+        TEMPLATE_BYTECODE_CACHE=True,
+        # how many tag lists keep an in memory tag suggestion index, and
+        # how many seconds before an index is rebuilt from the database
+        SUGGESTION_CACHE_MAX_LISTS=256,
+        SUGGESTION_CACHE_TTL=30.0,
+        # the tag density heatmap of the tagging page counts the tags in
+        # buckets of TAG_DENSITY_BUCKET_WIDTH seconds by default, at most
+        # TAG_DENSITY_MAX_BUCKETS per video, with the counts of the
+        # TAG_DENSITY_MAX_TAGS most used tag names when they are asked for,
+        # and keeps the counts of up to TAG_DENSITY_CACHE_SIZE videos in
+        # memory (0 turns it off)
+        TAG_DENSITY_BUCKET_WIDTH=10.0,
+        TAG_DENSITY_MAX_BUCKETS=500,
+        TAG_DENSITY_MAX_TAGS=20,
+        TAG_DENSITY_CACHE_SIZE=1024,
+        # how many bytes of tag/video indexes are kept in memory for /filter,
+        # see videobookmarks.tag_index. 0 builds one for every request.
+        TAG_INDEX_MAX_BYTES=64 * 1024 * 1024,
+        # how many tag lists are shown on each page of the index
+        TAG_LIST_PAGE_SIZE=25,
+        # a client that is further behind than this many changes gets a
+        # full snapshot of the tag list instead of the changes
+        TAG_LIST_MAX_CHANGES=1000,
+        # how many rows /export reads from the database and sends at a time
+        EXPORT_BATCH_SIZE=1000,
+        # how many tags `flask archive-deleted-tags` and `flask
+        # restore-tag-list` move per transaction, which bounds how long
+        # they lock a tag list
+        TAG_ARCHIVE_BATCH_SIZE=5000,
+        # compress responses for clients that accept gzip or brotli. Bodies
+        # under COMPRESSION_MIN_SIZE bytes aren't worth it, bodies over
+        # COMPRESSION_STREAM_MIN_SIZE are compressed while they are sent.
+        COMPRESSION_ENABLED=True,
+        COMPRESSION_LEVEL=6,
+        COMPRESSION_MIN_SIZE=1024,
+        COMPRESSION_STREAM_MIN_SIZE=1024 * 1024,
+        # serve minified copies of the static js and css files under names
+        # that include a hash of their content, cached for a year. They are
+        # built at startup, turn this off while editing the static files.
+        ASSETS_ENABLED=True,
+        # how many bytes of rendered index and tag list pages are kept for
+        # anonymous users, see videobookmarks.fragments. 0 turns it off.
+        FRAGMENT_CACHE_MAX_BYTES=8 * 1024 * 1024,
+        # live tag list updates: how many events can wait for a slow client
+        # before it has to reload, and how often idle streams send a heartbeat
+        EVENTS_QUEUE_SIZE=100,
+        EVENTS_HEARTBEAT_SECONDS=15.0,
+        # hash passwords in this many worker processes (None for one per cpu,
+        # 0 for on the request thread), with at most PASSWORD_HASH_MAX_PENDING
+        # hashes waiting or running. A login or registration that waits more
+        # than PASSWORD_HASH_QUEUE_TIMEOUT seconds for a slot gets a 503.
+        PASSWORD_HASH_WORKERS=None,
+        PASSWORD_HASH_MAX_PENDING=16,
+        PASSWORD_HASH_QUEUE_TIMEOUT=5.0,
+        # new videos are created with placeholder details, which
+        # VIDEO_DETAILS_WORKERS threads (0 for the request thread) fetch from
+        # VIDEO_DETAILS_PROVIDER: "youtube", "fake" or a function, see
+        # videobookmarks.video_details. Failed calls are retried after
+        # VIDEO_DETAILS_RETRY_DELAY seconds, doubled every attempt.
+        VIDEO_DETAILS_PROVIDER="youtube",
+        VIDEO_DETAILS_WORKERS=2,
+        VIDEO_DETAILS_MAX_CALLS_PER_SECOND=5.0,
+        VIDEO_DETAILS_MAX_ATTEMPTS=5,
+        VIDEO_DETAILS_RETRY_DELAY=1.0,
+        # time requests, DataModel methods and external calls, and serve
+        # the results at /metrics
+        METRICS_ENABLED=False,
+        # log the sql statements slower than this many seconds, with their
+        # query plans, as json lines to SLOW_QUERY_LOG_PATH (by default
+        # slow_queries.jsonl in the instance folder). None turns it off.
+        # EXPLAIN runs the statement again, so only a sample is explained.
+        SLOW_QUERY_THRESHOLD=None,
+        SLOW_QUERY_LOG_PATH=None,
+        SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1.0,
+        SLOW_QUERY_MAX_EXPLAINS_PER_MINUTE=10,
     )
 
     if test_config is None:
@@ -26,16 +106,42 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     else:
         # load the test config if passed in
         app.config.update(test_config)
+    if not app.config["DB_URL"]:
+        raise ValueError(
+            "Missing DB_URL environment variable, could not connect to Database"
+        )
+    if (
+        app.config["VIDEO_DETAILS_PROVIDER"] == "youtube"
+        and not app.config["YT_API_KEY"]
+    ):
+        raise ValueError("YT_API_KEY not set")
 
     # register the database commands
     from videobookmarks import db
     from videobookmarks import authenticate, tag
+    from videobookmarks import assets, bulk_import, compression, events, metrics
+    from videobookmarks import density, fragments, passwords, suggestions, warm_up
+    from videobookmarks import tag_index, video_details
 
+    # first, so that the request timer wraps all the other hooks
+    metrics.init_app_metrics(app)
     db.init_app_datamodel(app)
+    passwords.init_app_passwords(app)
+    suggestions.init_app_suggestions(app)
+    density.init_app_density(app)
+    compression.init_app_compression(app)
+    assets.init_app_assets(app)
+    events.init_app_events(app)
+    fragments.init_app_fragments(app)
+    tag_index.init_app_tag_index(app)
+    bulk_import.init_app_bulk_import(app)
+    video_details.init_app_video_details(app)
     app.register_blueprint(authenticate.bp)
     app.register_blueprint(tag.bp)
 
     app.add_url_rule("/", endpoint="index")
+    # last, once everything it warms up is registered
+    warm_up.init_app_warm_up(app)
 
     @app.before_request  # type: ignore
     def before_request() -> Optional[Response]:
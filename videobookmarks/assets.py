@@ -0,0 +1,179 @@
+"""
+Minified, fingerprinted copies of the static javascript and css files.
+
+Flask serves the static folder with a short cache lifetime, so browsers
+revalidate every script and stylesheet on each page view. Instead, the js
+and css files are minified at startup and given a name that includes a hash
+of their content, e.g. view.3f2a1b9c0d.js, which templates get with
+asset_url("view.js"). Since a changed file gets a new name, the assets are
+served from memory at /assets/<name> with a far future, immutable
+Cache-Control, and precompressed like the other static files.
+
+Files aren't watched for changes, turn ASSETS_ENABLED off while editing
+them to get the plain /static files instead.
+"""
+
+import dataclasses
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Iterable, Iterator
+
+from flask import Flask, Response
+from flask import abort
+from flask import current_app
+from flask import url_for
+
+from videobookmarks.compression import choose_encoding, precompress
+
+# a year, the longest max-age that caches are required to honour
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+# how many hex digits of the content hash are put in the name
+HASH_LENGTH = 10
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+@dataclasses.dataclass(frozen=True)
+class Asset:
+    """
+    name: of the file in the static folder
+    fingerprinted_name: the name it is served as, with the content hash
+    mimetype: of the file
+    data: the minified content
+    variants: the compressed data by encoding
+    """
+
+    name: str
+    fingerprinted_name: str
+    mimetype: str
+    data: bytes
+    variants: Dict[str, bytes]
+
+
+def _strip_lines(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def minify_js(source: str) -> str:
+    """
+    A conservative minifier: removes indentation, blank lines and lines
+    that only hold a // comment. Line breaks are kept since javascript
+    relies on them to end statements without semicolons, and lines inside
+    multi-line template literals are left as they are.
+    """
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith("//"):
+                lines.append(stripped)
+        if line.count("`") % 2 == 1:
+            in_template = not in_template
+    return "\n".join(lines) + "\n"
+
+
+def minify_css(source: str) -> str:
+    """
+    Removes comments, indentation and blank lines.
+    """
+    return "\n".join(_strip_lines(_CSS_COMMENT.sub("", source).splitlines())) + "\n"
+
+
+MINIFIERS = {
+    "application/javascript": minify_js,
+    "text/javascript": minify_js,
+    "text/css": minify_css,
+}
+
+
+def fingerprinted_name(name: str, data: bytes) -> str:
+    """
+    :return: name with the hash of data before the extension
+    """
+    root, extension = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return f"{root}.{digest}{extension}"
+
+
+def build_assets(static_folder: str, compress: bool) -> Dict[str, Asset]:
+    """
+    Minify and fingerprint every js and css file in the static folder.
+    :param compress: whether to precompress the minified files
+    :return: the assets by name and by fingerprinted name
+    """
+    assets: Dict[str, Asset] = {}
+    if not os.path.isdir(static_folder):
+        return assets
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            mimetype = mimetypes.guess_type(filename)[0]
+            if mimetype not in MINIFIERS:
+                continue
+            path = os.path.join(directory, filename)
+            with open(path, encoding="utf-8") as f:
+                data = MINIFIERS[mimetype](f.read()).encode()
+            name = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            asset = Asset(
+                name=name,
+                fingerprinted_name=fingerprinted_name(name, data),
+                mimetype=mimetype,
+                data=data,
+                variants=precompress(data) if compress else {},
+            )
+            assets[asset.name] = asset
+            assets[asset.fingerprinted_name] = asset
+    return assets
+
+
+def asset_url(name: str) -> str:
+    """
+    Template global.
+    :param name: of a file in the static folder
+    :return: the url of its fingerprinted asset, or of the static file if
+            it isn't one
+    """
+    asset = current_app.extensions["assets"].get(name)
+    if asset is None:
+        return url_for("static", filename=name)
+    return url_for("asset", name=asset.fingerprinted_name)
+
+
+def serve_asset(name: str) -> Response:
+    asset = current_app.extensions["assets"].get(name)
+    if asset is None or asset.fingerprinted_name != name:
+        abort(404)
+    encoding = choose_encoding() if asset.variants else None
+    if encoding is not None and encoding in asset.variants:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        response.content_encoding = encoding
+    else:
+        response = Response(asset.data, mimetype=asset.mimetype)
+    if asset.variants:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app_assets(app: Flask) -> None:
+    """
+    Build the assets, register the route that serves them and the asset_url
+    template global. This is called by the application factory.
+    """
+    if app.config["ASSETS_ENABLED"] and app.static_folder is not None:
+        app.extensions["assets"] = build_assets(
+            app.static_folder, app.config["COMPRESSION_ENABLED"]
+        )
+    else:
+        app.extensions["assets"] = {}
+    app.add_url_rule("/assets/<path:name>", endpoint="asset", view_func=serve_asset)
+    app.add_template_global(asset_url)
@@ -10,9 +10,9 @@ from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
-from werkzeug.security import check_password_hash
 
-from videobookmarks.db import get_datamodel
+from videobookmarks.db import close_datamodel, get_datamodel
+from videobookmarks.passwords import get_password_hasher
 
 bp = Blueprint("authenticate", __name__, url_prefix="/authenticate")
 
@@ -52,7 +52,6 @@ def register() -> Union[str, Response]:
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        datamodel = get_datamodel()
         error = None
         if not username:
             error = "Username is required."
@@ -60,8 +59,12 @@ def register() -> Union[str, Response]:
             error = "Password is required."
 
         if error is None:
+            # hashed in a worker process, see videobookmarks.passwords,
+            # without holding a pooled connection while waiting for a slot
+            close_datamodel()
+            password_hash = get_password_hasher().hash(password)
             try:
-                datamodel.add_user(username, password)
+                get_datamodel().add_user_with_password_hash(username, password_hash)
             except psycopg.IntegrityError:
                 # The username was already taken, which caused the
                 # commit to fail. Show a validation error.
@@ -80,11 +83,12 @@ def login() -> Union[str, Response]:
         username = request.form["username"]
         password = request.form["password"]
         error = None
-        datamodel = get_datamodel()
-        user = datamodel.get_user_with_name(username)
+        user = get_datamodel().get_user_with_name(username)
+        # the connection goes back to the pool while the password is checked
+        close_datamodel()
         if user is None:
             error = "Incorrect username."
-        elif not check_password_hash(user.password, password):
+        elif not get_password_hasher().check(user.password, password):
             error = "Incorrect password."
         if error is None:
             # store the user id in a new session and return to the index
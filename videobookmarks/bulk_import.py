@@ -0,0 +1,186 @@
+"""
+Bulk import of tags from csv files, e.g. bookmarks exported from other tools.
+
+Each row of the file is `video_id,timestamp,tag`, where video_id is the
+Youtube ID of the video and timestamp is in seconds. A header row with those
+names is skipped. The file is parsed while it is read and the valid rows are
+loaded by PostgresDataModel.import_tags in a single transaction, rows that
+can't be imported are counted and reported by line instead of failing the
+whole import.
+
+Tags are imported with the /import/<tag_list_id> route or the
+`flask import-tags` command.
+"""
+
+import csv
+import dataclasses
+import math
+import time
+from typing import IO, Any, Iterable, Iterator, List, Union
+
+import click
+from flask import Flask
+from flask.cli import with_appcontext
+
+from videobookmarks.datamodel.datamodel import (
+    DataModel,
+    ImportResult,
+    ImportRow,
+    RejectedRow,
+    VideoResolver,
+)
+
+HEADER = ["video_id", "timestamp", "tag"]
+# how many of the rejected rows are listed in the report, the rest are only
+# counted
+MAX_REPORTED_REJECTIONS = 100
+
+
+def parse_rows(
+    lines: Iterable[str], max_tag_length: int
+) -> Iterator[Union[ImportRow, RejectedRow]]:
+    """
+    :param lines: the lines of a csv file
+    :return: an ImportRow for every valid row, a RejectedRow for the others
+    """
+    for index, row in enumerate(csv.reader(lines)):
+        line = index + 1
+        if index == 0 and [value.strip().lower() for value in row] == HEADER:
+            continue
+        if not row:
+            continue
+        if len(row) != len(HEADER):
+            yield RejectedRow(line, f"expected {len(HEADER)} columns")
+            continue
+        if any("\0" in value for value in row):
+            # postgres can't store it in text
+            yield RejectedRow(line, "contains a NUL character")
+            continue
+        link, timestamp, tag = (value.strip() for value in row)
+        if not link:
+            yield RejectedRow(line, "missing video_id")
+            continue
+        try:
+            youtube_timestamp = float(timestamp)
+        except ValueError:
+            yield RejectedRow(line, "timestamp is not a number")
+            continue
+        if not math.isfinite(youtube_timestamp) or youtube_timestamp < 0:
+            yield RejectedRow(line, "timestamp is not a time in the video")
+            continue
+        if not tag:
+            yield RejectedRow(line, "missing tag")
+            continue
+        if len(tag) > max_tag_length:
+            yield RejectedRow(line, f"tag is longer than {max_tag_length}")
+            continue
+        yield ImportRow(line, link, youtube_timestamp, tag)
+
+
+@dataclasses.dataclass(frozen=True)
+class ImportReport:
+    """
+    An ImportResult that includes the rows rejected while parsing, and how
+    long the import took.
+    """
+
+    imported: int
+    rejected: int
+    rejected_rows: List[RejectedRow]
+    version: int
+    seconds: float
+    rows_per_second: float
+
+
+def import_csv(
+    datamodel: DataModel,
+    tag_list_id: int,
+    user_id: int,
+    lines: Iterable[str],
+    resolve_videos: VideoResolver,
+    max_tag_length: int,
+) -> ImportReport:
+    """
+    Parse a csv file and import its valid rows into a tag list.
+    Raises a KeyError if the tag list does not exist.
+    """
+    start = time.perf_counter()
+    parse_rejected: List[RejectedRow] = []
+    num_parse_rejected = 0
+
+    def valid_rows() -> Iterator[ImportRow]:
+        nonlocal num_parse_rejected
+        for row in parse_rows(lines, max_tag_length):
+            if isinstance(row, ImportRow):
+                yield row
+            else:
+                num_parse_rejected += 1
+                if len(parse_rejected) < MAX_REPORTED_REJECTIONS:
+                    parse_rejected.append(row)
+
+    result: ImportResult = datamodel.import_tags(
+        tag_list_id,
+        user_id,
+        valid_rows(),
+        resolve_videos,
+        MAX_REPORTED_REJECTIONS,
+    )
+    seconds = time.perf_counter() - start
+    rejected_rows = sorted(
+        parse_rejected + list(result.rejected_rows), key=lambda row: row.line
+    )[:MAX_REPORTED_REJECTIONS]
+    rejected = num_parse_rejected + result.rejected
+    return ImportReport(
+        imported=result.imported,
+        rejected=rejected,
+        rejected_rows=rejected_rows,
+        version=result.version,
+        seconds=round(seconds, 3),
+        rows_per_second=round((result.imported + rejected) / max(seconds, 1e-9), 1),
+    )
+
+
+def report_lines(report: ImportReport) -> Iterator[str]:
+    yield (
+        f"Imported {report.imported} tags and rejected {report.rejected} rows"
+        f" in {report.seconds:.1f}s ({report.rows_per_second:.0f} rows/s)."
+    )
+    for row in report.rejected_rows:
+        yield f"line {row.line}: {row.reason}"
+    if report.rejected > len(report.rejected_rows):
+        yield f"... and {report.rejected - len(report.rejected_rows)} more"
+
+
+@click.command("import-tags")
+@click.argument("tag_list_id", type=int)
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@with_appcontext  # type: ignore
+def import_tags_command(tag_list_id: int, file: IO[Any]) -> None:
+    """Import the tags in a csv file of video_id,timestamp,tag rows into a
+    tag list, as the owner of the tag list."""
+    from videobookmarks.db import get_datamodel
+    from videobookmarks.tag import MAX_TAG_LENGTH
+    from videobookmarks.video_details import get_video_details_resolver
+
+    datamodel = get_datamodel()
+    tag_list = datamodel.get_tag_list(tag_list_id)
+    if tag_list is None:
+        raise click.ClickException(f"The tag list id {tag_list_id} does not exist")
+    report = import_csv(
+        datamodel,
+        tag_list_id,
+        tag_list.user_id,
+        file,
+        get_video_details_resolver().provider,
+        MAX_TAG_LENGTH,
+    )
+    for line in report_lines(report):
+        click.echo(line)
+
+
+def init_app_bulk_import(app: Flask) -> None:
+    """
+    Register the import-tags command with the Flask app. This is called by
+    the application factory.
+    """
+    app.cli.add_command(import_tags_command)
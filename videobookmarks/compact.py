@@ -0,0 +1,173 @@
+"""
+A compact, column oriented encoding for the lists of dataclasses returned by
+the json routes.
+
+The plain json encoding repeats every string for every row it appears in,
+e.g. the youtube links of GroupedTag.links or the tag names of
+GroupedVideo.tags. The compact encoding stores each distinct string once in
+a dictionary and refers to it by its index:
+
+    {
+        "length": 2,
+        "strings": ["bird", "tree"],
+        "columns": {
+            "tag": {"strings": [0, 1]},
+            "count": {"values": [4, 1]},
+            "tag_list_id": {"constant": 3},
+            "tags": {"string_lists": [[0, 1], [1]]}
+        }
+    }
+
+Columns where every row has the same value are sent once as a constant.
+Clients opt in with the Accept header, static/compact.js decodes it back
+into the plain rows. Routes that return an object with a list of rows, like
+/changes, only encode that list this way.
+"""
+
+import dataclasses
+import json
+from typing import Any, Dict, List, Sequence, Type
+
+from flask import Response
+from flask import current_app
+from flask import request
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+COMPACT_JSON_MIMETYPE = "application/vnd.videobookmarks.compact+json"
+COMPACT_MSGPACK_MIMETYPE = "application/vnd.videobookmarks.compact+msgpack"
+
+
+class StringTable:
+    """
+    Assigns every distinct string an index in the order they are first seen.
+    """
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self._indexes: Dict[str, int] = {}
+
+    def index(self, string: str) -> int:
+        index = self._indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self._indexes[string] = index
+            self.strings.append(string)
+        return index
+
+
+def _encode_column(values: List[Any], strings: StringTable) -> Dict[str, Any]:
+    if len(values) > 1 and all(value == values[0] for value in values):
+        return {"constant": values[0]}
+    if values and all(isinstance(value, str) for value in values):
+        return {"strings": [strings.index(value) for value in values]}
+    if values and all(
+        isinstance(value, (list, tuple))
+        and all(isinstance(item, str) for item in value)
+        for value in values
+    ):
+        return {
+            "string_lists": [
+                [strings.index(item) for item in value] for value in values
+            ]
+        }
+    return {"values": values}
+
+
+def encode_compact(row_type: Type[Any], rows: Sequence[Any]) -> Dict[str, Any]:
+    """
+    :param row_type: the dataclass of the rows, used for the column names
+            so that an empty list still has all of its columns
+    :param rows: the dataclass instances to encode
+    :return: the compact encoding of the rows, see the module docstring
+    """
+    strings = StringTable()
+    columns = {}
+    for field in dataclasses.fields(row_type):
+        values = [getattr(row, field.name) for row in rows]
+        columns[field.name] = _encode_column(values, strings)
+    return {"length": len(rows), "strings": strings.strings, "columns": columns}
+
+
+def decode_compact(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn the compact encoding back into the rows as plain dictionaries.
+    """
+    length = payload["length"]
+    strings = payload["strings"]
+    decoded_columns = {}
+    for name, column in payload["columns"].items():
+        if "constant" in column:
+            decoded_columns[name] = [column["constant"]] * length
+        elif "strings" in column:
+            decoded_columns[name] = [strings[i] for i in column["strings"]]
+        elif "string_lists" in column:
+            decoded_columns[name] = [
+                [strings[i] for i in indexes] for indexes in column["string_lists"]
+            ]
+        else:
+            decoded_columns[name] = column["values"]
+    return [
+        {name: values[i] for name, values in decoded_columns.items()}
+        for i in range(length)
+    ]
+
+
+def available_mimetypes() -> List[str]:
+    mimetypes = [JSON_MIMETYPE, COMPACT_JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(COMPACT_MSGPACK_MIMETYPE)
+    return mimetypes
+
+
+def _best_mimetype() -> str:
+    mimetype: str = request.accept_mimetypes.best_match(
+        available_mimetypes(), default=JSON_MIMETYPE
+    )
+    return mimetype
+
+
+def _compact_response(payload: Dict[str, Any], mimetype: str) -> Response:
+    if mimetype == COMPACT_MSGPACK_MIMETYPE:
+        return Response(msgpack.packb(payload), mimetype=COMPACT_MSGPACK_MIMETYPE)
+    body = json.dumps(payload, separators=(",", ":"))
+    return Response(body, mimetype=COMPACT_JSON_MIMETYPE)
+
+
+def respond(row_type: Type[Any], rows: Sequence[Any]) -> Response:
+    """
+    Return the rows in the encoding asked for by the Accept header of the
+    current request. Plain json is used unless a compact encoding is
+    explicitly preferred.
+    """
+    mimetype = _best_mimetype()
+    if mimetype == JSON_MIMETYPE:
+        response = current_app.json.response(rows)
+    else:
+        response = _compact_response(encode_compact(row_type, rows), mimetype)
+    response.vary.add("Accept")
+    return response
+
+
+def respond_with_rows(value: Any, field: str, row_type: Type[Any]) -> Response:
+    """
+    Like respond, for a dataclass with a list of rows in one of its fields,
+    e.g. the changes of a TagListChanges. Only that field is compact encoded,
+    the others are sent as they are.
+    """
+    mimetype = _best_mimetype()
+    if mimetype == JSON_MIMETYPE:
+        response = current_app.json.response(value)
+    else:
+        payload = {
+            name: getattr(value, name)
+            for name in [item.name for item in dataclasses.fields(value)]
+        }
+        payload[field] = encode_compact(row_type, payload[field])
+        response = _compact_response(payload, mimetype)
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,233 @@
+"""
+Compression of responses based on the Accept-Encoding header.
+
+Dynamic responses (mostly the json routes) are compressed after the view has
+run, as long as they are larger than COMPRESSION_MIN_SIZE. Bodies larger than
+COMPRESSION_STREAM_MIN_SIZE and streamed responses are compressed chunk by
+chunk while they are sent, so the client starts receiving data right away
+and the full compressed body is never held in memory.
+
+Static files never change while the app is running, so they are compressed
+once at startup with the slowest, best settings and the precompressed bytes
+are served from memory.
+
+brotli is used when the brotli package is installed and the client accepts
+it, gzip otherwise.
+"""
+
+import dataclasses
+import gzip
+import mimetypes
+import os
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from flask import Flask, Response
+from flask import current_app
+from flask import request
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "application/vnd.videobookmarks.compact+json",
+    "application/x-ndjson",
+    "image/svg+xml",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def available_encodings() -> List[str]:
+    """
+    The encodings this server can produce, most preferred first.
+    """
+    if brotli is not None:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+def choose_encoding() -> Optional[str]:
+    """
+    :return: the encoding to use for the current request, None if the
+            client doesn't accept any of the available encodings
+    """
+    encoding: Optional[str] = request.accept_encodings.best_match(available_encodings())
+    return encoding
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """
+    :param level: 1 to 9, fastest to smallest. For brotli this is scaled
+            to the 0 to 11 quality range.
+    """
+    if encoding == "br":
+        return bytes(brotli.compress(data, quality=round(level * 11 / 9)))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(
+    chunks: Iterable[bytes], encoding: str, level: int
+) -> Iterator[bytes]:
+    """
+    Compress an iterable of chunks as it is consumed.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=round(level * 11 / 9))
+        for chunk in chunks:
+            compressed = compressor.process(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+    else:
+        # wbits=31 writes the gzip header and trailer
+        gzip_compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            compressed = gzip_compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield gzip_compressor.flush()
+
+
+def _slices(data: bytes) -> Iterator[bytes]:
+    for start in range(0, len(data), STREAM_CHUNK_SIZE):
+        yield data[start : start + STREAM_CHUNK_SIZE]
+
+
+@dataclasses.dataclass(frozen=True)
+class PrecompressedFile:
+    mtime: float
+    variants: Dict[str, bytes]
+
+
+def precompress(data: bytes) -> Dict[str, bytes]:
+    """
+    Compress data with every available encoding at the highest level,
+    keeping only the variants that are actually smaller.
+    """
+    variants = {}
+    for encoding in available_encodings():
+        compressed = compress(data, encoding, 9)
+        if len(compressed) < len(data):
+            variants[encoding] = compressed
+    return variants
+
+
+def precompress_static_files(app: Flask) -> Dict[str, PrecompressedFile]:
+    """
+    Compress every compressible file in the static folder.
+    :return: the compressed variants by filename, relative to the static folder
+    """
+    precompressed: Dict[str, PrecompressedFile] = {}
+    static_folder = app.static_folder
+    if static_folder is None or not os.path.isdir(static_folder):
+        return precompressed
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            mimetype = mimetypes.guess_type(filename)[0]
+            if mimetype not in COMPRESSIBLE_MIMETYPES:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < app.config["COMPRESSION_MIN_SIZE"]:
+                continue
+            name = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            precompressed[name] = PrecompressedFile(
+                mtime=os.path.getmtime(path),
+                variants=precompress(data),
+            )
+    return precompressed
+
+
+def _weaken_etag(response: Response) -> None:
+    # the compressed body is a different representation of the same
+    # resource, a strong etag would claim that they are byte for byte equal
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def _compress_static(response: Response, encoding: str) -> None:
+    filename = (request.view_args or {}).get("filename")
+    precompressed = current_app.extensions["precompressed_static"].get(filename)
+    if precompressed is None or encoding not in precompressed.variants:
+        return
+    path = os.path.join(current_app.static_folder or "", filename or "")
+    if os.path.getmtime(path) != precompressed.mtime:
+        # changed since startup, e.g. while developing
+        return
+    # set_data drops the file wrapper of the original body, which would
+    # otherwise keep the file open
+    original = response.response
+    if hasattr(original, "close"):
+        original.close()
+    response.direct_passthrough = False
+    response.set_data(precompressed.variants[encoding])
+    response.content_encoding = encoding
+    _weaken_etag(response)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    after_request handler that compresses the response if the client
+    accepts it and it is worth it.
+    """
+    config = current_app.config
+    if not config["COMPRESSION_ENABLED"]:
+        return response
+    if response.status_code != 200 or response.content_encoding:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    level = config["COMPRESSION_LEVEL"]
+
+    if request.endpoint == "static":
+        _compress_static(response, encoding)
+        return response
+    if response.direct_passthrough:
+        # file responses outside of the static folder are left as they are
+        return response
+
+    if response.is_streamed:
+        chunks: Iterable[bytes] = response.iter_encoded()
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESSION_MIN_SIZE"]:
+            return response
+        if len(data) < config["COMPRESSION_STREAM_MIN_SIZE"]:
+            response.set_data(compress(data, encoding, level))
+            response.content_encoding = encoding
+            _weaken_etag(response)
+            return response
+        chunks = _slices(data)
+    response.response = compress_stream(chunks, encoding, level)
+    response.headers.pop("Content-Length", None)
+    response.content_encoding = encoding
+    _weaken_etag(response)
+    return response
+
+
+def init_app_compression(app: Flask) -> None:
+    """
+    Precompress the static files and register response compression with
+    the Flask app. This is called by the application factory.
+    """
+    if app.config["COMPRESSION_ENABLED"]:
+        app.extensions["precompressed_static"] = precompress_static_files(app)
+    else:
+        app.extensions["precompressed_static"] = {}
+    app.after_request(compress_response)
@@ -1,11 +1,19 @@
 import abc
+import base64
 import dataclasses
-from typing import List, Sequence, Optional
+import datetime
+import itertools
+import json
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Optional, Tuple
 
-from psycopg import connect
-from psycopg.rows import dict_row
+from psycopg import Connection, Cursor, connect
+from psycopg.rows import DictRow, dict_row
+from psycopg_pool import ConnectionPool
 from werkzeug.security import generate_password_hash
 
+from videobookmarks.datamodel.slow_query_log import Parameters, SlowQueryLog
+
 
 @dataclasses.dataclass(frozen=True)
 class User:
@@ -23,6 +31,23 @@ class TagList:
     user_id: int
     created: int
     deleted: bool
+    num_tags: int = 0
+    num_videos: int = 0
+    last_tagged_at: Optional[datetime.datetime] = None
+    version: int = 0
+
+
+@dataclasses.dataclass(frozen=True)
+class TagListPage:
+    """
+    One page of the tag lists shown on the index page.
+        tag_lists: the tag lists on this page
+        next_cursor: pass this to get_tag_list_page to get the next page,
+                None if this is the last page
+    """
+
+    tag_lists: Sequence[TagList]
+    next_cursor: Optional[str]
 
 
 @dataclasses.dataclass(frozen=True)
@@ -77,6 +102,306 @@ class GroupedVideo:
     tags: Sequence[str]
 
 
+@dataclasses.dataclass(frozen=True)
+class TagVideoPair:
+    """
+    A tag name that is used at least once on a video of a tag list.
+        tag: the name of the tag
+        link: Youtube ID of the video
+    """
+
+    tag: str
+    link: str
+
+
+@dataclasses.dataclass(frozen=True)
+class VideoOccurrences:
+    """
+    Where a tag is used on a video of a tag list.
+        video_id: id of the video in the database
+        link: Youtube ID of the video
+        title: Title of the video according to youtube
+        thumbnail: url of video thumbnail
+        timestamps: the timestamps the tag is at, in order
+    """
+
+    video_id: int
+    link: str
+    title: str
+    thumbnail: str
+    timestamps: Sequence[float]
+
+
+@dataclasses.dataclass(frozen=True)
+class TagListOccurrences:
+    """
+    Where a tag is used in a tag list.
+        tag_list_id: id of the tag list
+        name: the name of the tag list
+        username: who created the tag list
+        videos: the videos the tag is used on, in the order of their ids
+    """
+
+    tag_list_id: int
+    name: str
+    username: str
+    videos: Sequence[VideoOccurrences]
+
+
+@dataclasses.dataclass(frozen=True)
+class TagOccurrencePage:
+    """
+    One page of the uses of a tag across every tag list.
+        tag: the name of the tag
+        tag_lists: the tag lists on this page, in the order of their ids.
+                The first and last ones can continue on the previous and
+                next pages.
+        next_cursor: pass this to find_tag_occurrences to get the next
+                page, None if this is the last page
+    """
+
+    tag: str
+    tag_lists: Sequence[TagListOccurrences]
+    next_cursor: Optional[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class TagSuggestion:
+    """
+    A tag name that can be suggested to a user while they are tagging.
+        tag: the name of the tag
+        count: how often the tag appears in the tag list, or near the
+                requested timestamp for timestamp based suggestions
+    """
+
+    tag: str
+    count: int
+
+
+@dataclasses.dataclass(frozen=True)
+class VideoSearchResult:
+    """
+    A video whose title matched a search, along with a tag list that it
+    has been tagged in. A video that appears in several tag lists is
+    returned once for each of them.
+        link: Youtube ID of the video
+        title: Title of the video according to youtube
+        thumbnail: url of video thumbnail
+        tag_list_id: id of a tag list that has tags on this video
+        tag_list_name: name of that tag list
+    """
+
+    link: str
+    title: str
+    thumbnail: str
+    tag_list_id: int
+    tag_list_name: str
+
+
+@dataclasses.dataclass(frozen=True)
+class TagChange:
+    """
+    A tag that was added to a tag list, along with the video it is on.
+        version: the version of the tag list that added this tag
+        tag: the name of the tag
+        video_id: id of the video
+        youtube_timestamp: the time in the video that was tagged
+        link: Youtube ID of the video
+        title: Title of the video according to youtube
+        thumbnail: url of video thumbnail
+    """
+
+    version: int
+    tag: str
+    video_id: int
+    youtube_timestamp: float
+    link: str
+    title: str
+    thumbnail: str
+
+
+@dataclasses.dataclass(frozen=True)
+class TagListChanges:
+    """
+    What changed in a tag list since a version that a client has seen.
+        version: the current version of the tag list, pass this as
+                since_version the next time
+        deleted: whether the tag list has been deleted
+        snapshot: if True, changes holds every tag of the tag list and
+                replaces whatever the client had, otherwise it holds only
+                the tags added since the requested version
+        changes: the tags, in the order they were added
+    """
+
+    version: int
+    deleted: bool
+    snapshot: bool
+    changes: Sequence[TagChange]
+
+
+@dataclasses.dataclass(frozen=True)
+class ExportedTag:
+    """
+    A row of a tag list export.
+        version: the version of the tag list that added this tag
+        tag: the name of the tag
+        link: Youtube ID of the video
+        title: Title of the video according to youtube
+        youtube_timestamp: the time in the video that was tagged
+        created: when the tag was added
+        username: who added the tag, None if their account was removed
+    """
+
+    version: int
+    tag: str
+    link: str
+    title: str
+    youtube_timestamp: float
+    created: datetime.datetime
+    username: Optional[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class TagDensity:
+    """
+    How many tags of a tag list fall in each stretch of a video.
+        version: the version of the tag list that the counts include the
+                tags of, they can include a few later ones too
+        bucket_width: the length of every bucket in seconds, the first one
+                starts at 0
+        counts: the number of tags in each bucket, up to the last tag
+        by_tag: the counts of the most used tag names, most used first, if
+                they were asked for
+        peak: where the bucket with the most tags starts, None if the video
+                has no tags
+    """
+
+    version: int
+    bucket_width: float
+    counts: List[int]
+    by_tag: Optional[Dict[str, List[int]]]
+    peak: Optional[float]
+
+
+@dataclasses.dataclass(frozen=True)
+class PendingVideo:
+    """
+    A video whose title and thumbnail are still placeholders.
+        id: id of the video
+        link: Youtube ID of the video
+    """
+
+    id: int
+    link: str
+
+
+@dataclasses.dataclass(frozen=True)
+class ImportRow:
+    """
+    A tag to import, see videobookmarks.bulk_import.
+        line: the line of the file it was read from, for error messages
+        link: Youtube ID of the video
+        youtube_timestamp: the time in the video that was tagged
+        tag: the name of the tag
+    """
+
+    line: int
+    link: str
+    youtube_timestamp: float
+    tag: str
+
+
+@dataclasses.dataclass(frozen=True)
+class RejectedRow:
+    """
+    A row of an import that was left out.
+        line: the line of the file it was read from
+        reason: why it was left out
+    """
+
+    line: int
+    reason: str
+
+
+@dataclasses.dataclass(frozen=True)
+class ImportResult:
+    """
+    The outcome of an import.
+        imported: the number of tags that were added
+        rejected: the number of rows that were left out
+        rejected_rows: the first of the rejected rows, by line
+        version: the version of the tag list after the import
+    """
+
+    imported: int
+    rejected: int
+    rejected_rows: Sequence[RejectedRow]
+    version: int
+
+
+# Looks up youtube videos that aren't in the video table yet, by their
+# Youtube ID, and returns their title and thumbnail_url. Videos that
+# youtube doesn't know are left out.
+VideoResolver = Callable[[Sequence[str]], Dict[str, Dict[str, str]]]
+
+
+# The orderings that the index page can use, the sql expression that is
+# sorted on (descending) and the type it is cast to when read from a cursor.
+# Each of these has a matching partial index on tag_list.
+TAG_LIST_SORTS = {
+    "created": ("tl.created", "timestamp"),
+    "activity": ("COALESCE(tl.last_tagged_at, tl.created)", "timestamp"),
+    "tags": ("tl.num_tags", "integer"),
+}
+
+TAG_LIST_COLUMNS = (
+    "tl.id, name, description, user_id, username, created, deleted,"
+    " num_tags, num_videos, last_tagged_at, version"
+)
+
+# The columns shared by tag and tag_archive, that archiving moves
+TAG_COLUMNS = (
+    "id, user_id, tag_list_id, video_id, tag_name_id, youtube_timestamp, created,"
+    " list_version"
+)
+
+
+# The postgres NOTIFY channel that changes to tag lists are sent on,
+# see videobookmarks.events
+EVENTS_CHANNEL = "tag_list_events"
+
+
+def encode_cursor(sort: str, value: object, id: int) -> str:
+    """
+    Create an opaque cursor that points just past a row of a sorted page.
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, object, int]:
+    """
+    Reverse of encode_cursor, raises ValueError if the cursor is not valid.
+    """
+    try:
+        sort, value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+    if not isinstance(id, int):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return sort, value, id
+
+
+def escape_like(value: str) -> str:
+    """
+    Escape the LIKE wildcards in a user supplied string so that it can
+    be used as a literal prefix.
+    """
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
 class DataModel(abc.ABC):
     @abc.abstractmethod
     def close(self) -> None:
@@ -92,6 +417,16 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def add_user_with_password_hash(
+        self, username: str, password_hash: str
+    ) -> Optional[int]:
+        """
+        Like add_user, for a password that has already been hashed, see
+        videobookmarks.passwords
+        """
+        ...
+
     @abc.abstractmethod
     def get_user_with_id(self, user_id: int) -> Optional[User]:
         """
@@ -113,6 +448,25 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def get_tag_list_page(
+        self,
+        sort: str,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> TagListPage:
+        """
+        Get a page of the tag lists where the deleted column is set to false.
+        :param sort: one of TAG_LIST_SORTS, "created" for the newest lists,
+                "activity" for the most recently tagged and "tags" for
+                the lists with the most tags
+        :param limit: the maximum number of tag lists on the page, at least 1
+        :param cursor: the next_cursor of the previous page, None for the
+                first page
+        Raises ValueError if the sort or the cursor is not valid.
+        """
+        ...
+
     @abc.abstractmethod
     def get_tag_list(self, tag_list_id: int) -> Optional[TagList]:
         """
@@ -140,6 +494,14 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def get_tag_video_pairs(self, tag_list_id: int) -> Sequence[TagVideoPair]:
+        """
+        :return: every distinct tag name and video of a tag list that are
+                used together, for videobookmarks.tag_index
+        """
+        ...
+
     @abc.abstractmethod
     def get_video_tags(self, video_id: int, tag_list_id: int) -> Sequence[Tag]:
         """
@@ -150,6 +512,120 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def get_tag_density(
+        self,
+        video_id: int,
+        tag_list_id: int,
+        bucket_width: float,
+        max_buckets: int,
+        max_tags: int,
+    ) -> Optional[TagDensity]:
+        """
+        Count the tags of a tag list on a video in buckets of bucket_width
+        seconds. The buckets are made wider, to a whole number of seconds,
+        if the video would need more than max_buckets of them.
+        :param max_tags: also count the max_tags most used tag names of the
+                video on their own, 0 for none
+        :return: None if the tag list does not exist or is deleted
+        """
+        ...
+
+    @abc.abstractmethod
+    def find_tag_occurrences(
+        self,
+        tag: str,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> TagOccurrencePage:
+        """
+        Find every use of a tag name in the tag lists that aren't deleted.
+        :param tag: the name of the tag, case sensitive
+        :param limit: the maximum number of uses on the page, at least 1
+        :param cursor: the next_cursor of the previous page, None for the
+                first page
+        Raises ValueError if the cursor is not valid.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_tag_list_changes(
+        self,
+        tag_list_id: int,
+        since_version: Optional[int],
+        max_changes: int,
+        video_id: Optional[int] = None,
+    ) -> Optional[TagListChanges]:
+        """
+        Return the tags added to a tag list after since_version. A full
+        snapshot is returned instead when since_version is None, when it
+        is not a version of this tag list, or when more than max_changes
+        changes have been made since then.
+        :param video_id: only return the tags on this video, e.g. for the
+                tagging page of the video
+        :return: None if the tag list does not exist
+        """
+        ...
+
+    @abc.abstractmethod
+    def export_tag_list(
+        self, tag_list_id: int, batch_size: int
+    ) -> Iterator[ExportedTag]:
+        """
+        Every tag of a tag list, in the order they were added. The rows are
+        fetched from a server side cursor batch_size at a time, so memory use
+        doesn't depend on the size of the tag list. The datamodel can't be
+        used for anything else until the iterator is exhausted or closed.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_tag_counts(self, tag_list_id: int) -> Sequence[TagSuggestion]:
+        """
+        Get every distinct tag in a tag list along with how often it is used.
+        This is much smaller than get_tag_list_tags because it does not
+        aggregate the video links.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_tag_suggestions_near(
+        self,
+        tag_list_id: int,
+        video_id: int,
+        timestamp: float,
+        window: float,
+        prefix: str,
+        limit: int,
+    ) -> Sequence[TagSuggestion]:
+        """
+        Get the most common tags starting with prefix (case insensitive)
+        that were used on a video within `window` seconds of timestamp,
+        most common first.
+        """
+        ...
+
+    @abc.abstractmethod
+    def search_tag_lists(self, query: str, limit: int) -> List[TagList]:
+        """
+        Full text search over the names and descriptions of the tag lists
+        that have not been deleted.
+        :param query: search terms, quoted phrases and -exclusions are allowed
+        :return: at most `limit` tag lists, best match first
+        """
+        ...
+
+    @abc.abstractmethod
+    def search_videos(self, query: str, limit: int) -> Sequence[VideoSearchResult]:
+        """
+        Full text search over video titles.
+        :param query: search terms, quoted phrases and -exclusions are allowed
+        :return: the tag lists that the best matching `limit` videos appear
+                in, best match first. Videos that are not in any tag list
+                are not returned.
+        """
+        ...
+
     @abc.abstractmethod
     def create_tag_list(
         self,
@@ -160,6 +636,7 @@ class DataModel(abc.ABC):
         """
         Create a new tag_list for a given user id
         return the id of that tag list
+        Subscribers to EVENTS_CHANNEL are notified once it is committed.
         """
         ...
 
@@ -181,6 +658,37 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def create_pending_video_id(
+        self, yt_link: str, thumbnail_url: str, title: str
+    ) -> Tuple[int, bool]:
+        """
+        Create a video with a placeholder thumbnail and title, and
+        details_pending set, unless there already is one with yt_link.
+        :return: the id of the video, and whether it was created
+        """
+        ...
+
+    @abc.abstractmethod
+    def set_video_details(
+        self, video_id: int, thumbnail_url: Optional[str], title: Optional[str]
+    ) -> bool:
+        """
+        Replace the placeholders of a pending video and clear its
+        details_pending. None keeps the placeholders, e.g. for a video that
+        youtube doesn't know. Subscribers to EVENTS_CHANNEL are notified of
+        the new details once they are committed.
+        :return: False if the video doesn't exist or isn't pending
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_pending_videos(self, limit: int) -> List[PendingVideo]:
+        """
+        :return: the videos whose details are pending, oldest first
+        """
+        ...
+
     @abc.abstractmethod
     def add_tag(
         self,
@@ -190,7 +698,11 @@ class DataModel(abc.ABC):
         video_id: int,
         user_id: int,
     ) -> Optional[int]:
-        """Add a new tag to a video, return the id of that new tag"""
+        """
+        Add a new tag to a video, return the id of that new tag.
+        Subscribers to EVENTS_CHANNEL are notified once the tag is committed.
+        Raises a KeyError if the tag list does not exist or is deleted.
+        """
         ...
 
     @abc.abstractmethod
@@ -203,32 +715,114 @@ class DataModel(abc.ABC):
         """
         ...
 
+    @abc.abstractmethod
+    def import_tags(
+        self,
+        tag_list_id: int,
+        user_id: int,
+        rows: Iterable[ImportRow],
+        resolve_videos: VideoResolver,
+        max_rejected_rows: int,
+    ) -> ImportResult:
+        """
+        Add many tags to a tag list in a single transaction. The videos that
+        aren't in the database yet are looked up with resolve_videos all at
+        once, before that transaction, the rows of videos it doesn't find are
+        rejected.
+        Raises a KeyError if the tag list does not exist.
+        :param max_rejected_rows: how many of the rejected rows to return
+        """
+        ...
+
+    @abc.abstractmethod
+    def archive_deleted_tag_lists(self, batch_size: int) -> int:
+        """
+        Move the tags of deleted tag lists out of the tag table into the
+        archive, batch_size tags per transaction.
+        :return: the number of tags that were moved
+        """
+        ...
+
+    @abc.abstractmethod
+    def restore_tag_list(self, tag_list_id: int, batch_size: int) -> int:
+        """
+        Undo delete_tag_list, moving the archived tags of the tag list back
+        into the tag table, batch_size tags per transaction.
+        Raises a KeyError if the tag list does not exist or isn't deleted.
+        :return: the number of tags that were moved back
+        """
+        ...
+
 
 class PostgresDataModel(DataModel):
     """
     The postgres implementation of the DataModel
     """
 
-    def __init__(self, db_url: str):
-        self._connection = connect(
-            db_url,
-            row_factory=dict_row,
-        )
+    def __init__(
+        self,
+        db_url: str,
+        slow_query_log: Optional[SlowQueryLog] = None,
+        pool: Optional[ConnectionPool[Connection[DictRow]]] = None,
+    ):
+        """
+        :param slow_query_log: where to log the statements that run slower
+                than its threshold, None to not time statements at all
+        :param pool: to take the connection from, and give it back to on
+                close, rather than connecting to db_url
+        """
+        self._pool = pool
+        if pool is None:
+            self._connection = connect(
+                db_url,
+                row_factory=dict_row,
+            )
+        else:
+            self._connection = pool.getconn()
+        self._slow_query_log = slow_query_log
 
     def close(self) -> None:
-        self._connection.close()
+        if self._pool is None:
+            self._connection.close()
+        else:
+            # end the transaction of the reads, which the pool would
+            # otherwise roll back with a warning
+            if not self._connection.closed:
+                self._connection.rollback()
+            self._pool.putconn(self._connection)
+
+    def _execute(self, query: str, params: Parameters = None) -> Cursor[DictRow]:
+        if self._slow_query_log is None:
+            return self._connection.execute(query, params)
+        start = time.perf_counter()
+        cursor = self._connection.execute(query, params)
+        self._slow_query_log.record(
+            self._connection,
+            query,
+            params,
+            time.perf_counter() - start,
+            cursor.rowcount,
+        )
+        return cursor
 
     def add_user(self, username: str, password: str) -> Optional[int]:
         """
         return the id of the user
         """
-        new_id_row = self._connection.execute(
+        return self.add_user_with_password_hash(
+            username, generate_password_hash(password)
+        )
+
+    def add_user_with_password_hash(
+        self, username: str, password_hash: str
+    ) -> Optional[int]:
+        new_id_row = self._execute(
             (
                 "INSERT INTO users (username, password)"
                 " VALUES (%s, %s)"
                 " RETURNING id"
             ),
-            (username, generate_password_hash(password)),
+            (username, password_hash),
         ).fetchone()
         self._connection.commit()
         if new_id_row is None:
@@ -238,7 +832,7 @@ class PostgresDataModel(DataModel):
         return new_id
 
     def get_user_with_id(self, user_id: int) -> Optional[User]:
-        user = self._connection.execute(
+        user = self._execute(
             "SELECT id, username, password FROM users WHERE id = %s",
             (user_id,),
         ).fetchone()
@@ -248,7 +842,7 @@ class PostgresDataModel(DataModel):
             return None
 
     def get_user_with_name(self, username: str) -> Optional[User]:
-        user = self._connection.execute(
+        user = self._execute(
             "SELECT id, username, password FROM users WHERE username = %s",
             (username,),
         ).fetchone()
@@ -258,17 +852,57 @@ class PostgresDataModel(DataModel):
             return None
 
     def get_tag_lists(self) -> List[TagList]:
-        tag_lists = self._connection.execute(
-            "SELECT tl.id, name, description, user_id, username, created, deleted"
+        tag_lists = self._execute(
+            f"SELECT {TAG_LIST_COLUMNS}"
             " FROM tag_list tl JOIN users u ON tl.user_id = u.id"
             " WHERE deleted = false"
             " ORDER BY created DESC"
         ).fetchall()
         return [TagList(**tl) for tl in tag_lists]
 
+    def get_tag_list_page(
+        self,
+        sort: str,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> TagListPage:
+        if sort not in TAG_LIST_SORTS:
+            raise ValueError(f"Unknown sort {sort!r}")
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        sort_expression, sort_type = TAG_LIST_SORTS[sort]
+        conditions = "deleted = false"
+        arguments: List[object] = []
+        if cursor is not None:
+            cursor_sort, cursor_value, cursor_id = decode_cursor(cursor)
+            if cursor_sort != sort:
+                raise ValueError("The cursor belongs to a different sort order")
+            conditions += f" AND ({sort_expression}, tl.id) < (%s::{sort_type}, %s)"
+            arguments.extend([cursor_value, cursor_id])
+        # fetch one extra row to find out if there is another page
+        arguments.append(limit + 1)
+        rows = self._execute(
+            f"SELECT {TAG_LIST_COLUMNS}, {sort_expression} as sort_value"
+            " FROM tag_list tl JOIN users u ON tl.user_id = u.id"
+            f" WHERE {conditions}"
+            f" ORDER BY {sort_expression} DESC, tl.id DESC"
+            " LIMIT %s",
+            arguments,
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, last["sort_value"], last["id"])
+        tag_lists = []
+        for row in rows:
+            del row["sort_value"]
+            tag_lists.append(TagList(**row))
+        return TagListPage(tag_lists=tag_lists, next_cursor=next_cursor)
+
     def get_tag_list(self, tag_list_id: int) -> Optional[TagList]:
-        tag_list = self._connection.execute(
-            "SELECT tl.id, name, description, username, user_id, created, deleted"
+        tag_list = self._execute(
+            f"SELECT {TAG_LIST_COLUMNS}"
             " FROM tag_list tl"
             " JOIN users u ON tl.user_id = u.id"
             " WHERE tl.id = %s",
@@ -283,17 +917,24 @@ class PostgresDataModel(DataModel):
         self,
         tag_list_id: int,
     ) -> Sequence[GroupedTag]:
+        # grouped on the tag_name ids, the names are only looked up for
+        # the grouped rows
         statement = (
-            "SELECT tag, COUNT(*) as count, ARRAY_AGG(DISTINCT v.link) as links"
-            " FROM tag t"
-            " JOIN video v on t.video_id = v.id"
-            " WHERE tag_list_id = %s"
-            " GROUP BY tag"
-            " ORDER BY tag ASC"
+            "SELECT n.name as tag, g.count, g.links"
+            " FROM ("
+            "    SELECT tag_name_id, COUNT(*) as count,"
+            "        ARRAY_AGG(DISTINCT v.link) as links"
+            "    FROM tag t"
+            "    JOIN video v on t.video_id = v.id"
+            "    WHERE tag_list_id = %s"
+            "    GROUP BY tag_name_id"
+            " ) g"
+            " JOIN tag_name n ON n.id = g.tag_name_id"
+            " ORDER BY n.name ASC"
         )
         arguments = (tag_list_id,)
 
-        tag_list_tags = self._connection.execute(
+        tag_list_tags = self._execute(
             statement,
             arguments,
         ).fetchall()
@@ -305,50 +946,419 @@ class PostgresDataModel(DataModel):
         tag_list_id: int,
     ) -> Sequence[GroupedVideo]:
         statement = (
-            "SELECT link, thumbnail, title,"
-            " COUNT(*) as num_tags,"
-            " ARRAY_AGG(DISTINCT tag) as tags"
-            " FROM video v"
-            " JOIN tag t ON t.video_id = v.id"
-            " WHERE t.tag_list_id = %s"
-            " GROUP BY link, thumbnail, title"
-            " ORDER BY count(*) DESC"
+            "SELECT link, thumbnail, title, g.num_tags,"
+            " ARRAY("
+            "    SELECT name FROM tag_name"
+            "    WHERE id = ANY(g.tag_name_ids)"
+            "    ORDER BY name"
+            " ) as tags"
+            " FROM ("
+            "    SELECT video_id, COUNT(*) as num_tags,"
+            "        ARRAY_AGG(DISTINCT tag_name_id) as tag_name_ids"
+            "    FROM tag"
+            "    WHERE tag_list_id = %s"
+            "    GROUP BY video_id"
+            " ) g"
+            " JOIN video v ON v.id = g.video_id"
+            " ORDER BY g.num_tags DESC"
         )
         arguments = (tag_list_id,)
 
-        tag_list_videos = self._connection.execute(
+        tag_list_videos = self._execute(
             statement,
             arguments,
         ).fetchall()
         return [GroupedVideo(**video) for video in tag_list_videos]
 
+    def get_tag_video_pairs(self, tag_list_id: int) -> Sequence[TagVideoPair]:
+        # made distinct on the ids, the names and links are only looked up
+        # for the distinct pairs
+        pairs = self._execute(
+            "SELECT n.name AS tag, v.link"
+            " FROM ("
+            "    SELECT DISTINCT tag_name_id, video_id FROM tag"
+            "    WHERE tag_list_id = %s"
+            " ) p"
+            " JOIN tag_name n ON n.id = p.tag_name_id"
+            " JOIN video v ON v.id = p.video_id",
+            (tag_list_id,),
+        ).fetchall()
+        return [TagVideoPair(**pair) for pair in pairs]
+
     def get_video_tags(self, video_id: int, tag_list_id: int) -> Sequence[Tag]:
-        tags = self._connection.execute(
+        tags = self._execute(
             "SELECT"
-            "    t.user_id,"
+            "    user_id,"
             "    tag_list_id,"
             "    video_id,"
-            "    tag,"
+            "    n.name as tag,"
             "    youtube_timestamp"
             " FROM tag t"
-            " JOIN video v ON v.id = t.video_id"
-            " JOIN tag_list tl ON t.tag_list_id = tl.id"
-            " WHERE tl.id = %s AND v.id = %s"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            # filtering on the partition key, so that only one partition
+            # of tag is read
+            " WHERE tag_list_id = %s AND video_id = %s"
             " ORDER BY youtube_timestamp ASC",
             (tag_list_id, video_id),
         ).fetchall()
         return [Tag(**tag) for tag in tags]
 
+    def get_tag_density(
+        self,
+        video_id: int,
+        tag_list_id: int,
+        bucket_width: float,
+        max_buckets: int,
+        max_tags: int,
+    ) -> Optional[TagDensity]:
+        # read before the tags, so that the counts are at least as new as
+        # the version they are cached under
+        tag_list = self._execute(
+            "SELECT version, deleted FROM tag_list WHERE id = %s",
+            (tag_list_id,),
+        ).fetchone()
+        if tag_list is None or tag_list["deleted"]:
+            return None
+        # t filters on the partition key, so that only one partition of tag
+        # is read
+        rows = self._execute(
+            "WITH t AS ("
+            "    SELECT youtube_timestamp, tag_name_id FROM tag"
+            "    WHERE tag_list_id = %(tag_list_id)s AND video_id = %(video_id)s"
+            " ), w AS ("
+            "    SELECT"
+            "        GREATEST("
+            "            %(bucket_width)s,"
+            "            CEIL((MAX(youtube_timestamp) + 1) / %(max_buckets)s)"
+            "        ) AS width,"
+            "        GREATEST(MAX(youtube_timestamp), 0) AS high"
+            "    FROM t"
+            " ), b AS ("
+            "    SELECT width, FLOOR(high / width)::integer + 1 AS buckets FROM w"
+            " ), binned AS ("
+            "    SELECT b.width, b.buckets, t.tag_name_id,"
+            # tags before 0 count towards the first bucket
+            "        GREATEST("
+            "            width_bucket("
+            "                youtube_timestamp, 0, b.buckets * b.width, b.buckets"
+            "            ),"
+            "            1"
+            "        ) AS bucket"
+            "    FROM t CROSS JOIN b"
+            " ), top AS ("
+            "    SELECT tag_name_id FROM t"
+            "    GROUP BY tag_name_id"
+            "    ORDER BY COUNT(*) DESC, tag_name_id"
+            "    LIMIT %(max_tags)s"
+            " )"
+            " SELECT width, buckets, bucket, NULL AS name, COUNT(*) AS count"
+            " FROM binned"
+            " GROUP BY width, buckets, bucket"
+            " UNION ALL"
+            " SELECT width, buckets, bucket, n.name, COUNT(*) AS count"
+            " FROM binned"
+            " JOIN top USING (tag_name_id)"
+            " JOIN tag_name n ON n.id = binned.tag_name_id"
+            " GROUP BY width, buckets, bucket, n.name",
+            {
+                "tag_list_id": tag_list_id,
+                "video_id": video_id,
+                "bucket_width": bucket_width,
+                "max_buckets": max_buckets,
+                "max_tags": max_tags,
+            },
+        ).fetchall()
+        by_tag: Optional[Dict[str, List[int]]] = {} if max_tags > 0 else None
+        if not rows:
+            return TagDensity(
+                version=tag_list["version"],
+                bucket_width=bucket_width,
+                counts=[],
+                by_tag=by_tag,
+                peak=None,
+            )
+        width = float(rows[0]["width"])
+        counts = [0] * rows[0]["buckets"]
+        names: Dict[str, List[int]] = {}
+        for row in rows:
+            if row["name"] is None:
+                counts[row["bucket"] - 1] = row["count"]
+            else:
+                name_counts = names.setdefault(row["name"], [0] * len(counts))
+                name_counts[row["bucket"] - 1] = row["count"]
+        if by_tag is not None:
+            # the most used first
+            for name in sorted(names, key=lambda name: (-sum(names[name]), name)):
+                by_tag[name] = names[name]
+        return TagDensity(
+            version=tag_list["version"],
+            bucket_width=width,
+            counts=counts,
+            by_tag=by_tag,
+            peak=counts.index(max(counts)) * width,
+        )
+
+    def find_tag_occurrences(
+        self,
+        tag: str,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> TagOccurrencePage:
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        conditions = "t.tag_name_id = %s AND NOT tl.deleted"
+        arguments: List[object] = []
+        if cursor is not None:
+            cursor_tag, value, cursor_id = decode_cursor(cursor)
+            if cursor_tag != tag:
+                raise ValueError("The cursor belongs to a different tag")
+            if not (
+                isinstance(value, list)
+                and len(value) == 3
+                and all(isinstance(v, (int, float)) for v in value)
+            ):
+                raise ValueError(f"Invalid cursor {cursor!r}")
+            conditions += (
+                " AND (t.tag_list_id, t.video_id, t.youtube_timestamp, t.id)"
+                " > (%s, %s, %s, %s)"
+            )
+            arguments.extend([*value, cursor_id])
+        tag_name = self._execute(
+            "SELECT id FROM tag_name WHERE name = %s", (tag,)
+        ).fetchone()
+        if tag_name is None:
+            return TagOccurrencePage(tag=tag, tag_lists=[], next_cursor=None)
+        # fetch one extra row to find out if there is another page
+        arguments.append(limit + 1)
+        rows = self._execute(
+            "SELECT t.id, t.tag_list_id, tl.name, u.username, t.video_id,"
+            "    v.link, v.title, v.thumbnail, t.youtube_timestamp"
+            " FROM tag t"
+            " JOIN tag_list tl ON tl.id = t.tag_list_id"
+            " JOIN users u ON u.id = tl.user_id"
+            " JOIN video v ON v.id = t.video_id"
+            f" WHERE {conditions}"
+            # in the order of tag_tag_name_id_occurrence_idx, so that each
+            # partition's index is read from the cursor and they are merged
+            " ORDER BY t.tag_list_id, t.video_id, t.youtube_timestamp, t.id"
+            " LIMIT %s",
+            [tag_name["id"], *arguments],
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(
+                tag,
+                [last["tag_list_id"], last["video_id"], last["youtube_timestamp"]],
+                last["id"],
+            )
+        tag_lists = []
+        for _, grouped in itertools.groupby(rows, key=lambda r: r["tag_list_id"]):
+            list_rows = list(grouped)
+            videos = []
+            for _, grouped in itertools.groupby(list_rows, key=lambda r: r["video_id"]):
+                video_rows = list(grouped)
+                videos.append(
+                    VideoOccurrences(
+                        video_id=video_rows[0]["video_id"],
+                        link=video_rows[0]["link"],
+                        title=video_rows[0]["title"],
+                        thumbnail=video_rows[0]["thumbnail"],
+                        timestamps=[r["youtube_timestamp"] for r in video_rows],
+                    )
+                )
+            tag_lists.append(
+                TagListOccurrences(
+                    tag_list_id=list_rows[0]["tag_list_id"],
+                    name=list_rows[0]["name"],
+                    username=list_rows[0]["username"],
+                    videos=videos,
+                )
+            )
+        return TagOccurrencePage(tag=tag, tag_lists=tag_lists, next_cursor=next_cursor)
+
+    def get_tag_list_changes(
+        self,
+        tag_list_id: int,
+        since_version: Optional[int],
+        max_changes: int,
+        video_id: Optional[int] = None,
+    ) -> Optional[TagListChanges]:
+        tag_list = self._execute(
+            "SELECT version, deleted FROM tag_list WHERE id = %s",
+            (tag_list_id,),
+        ).fetchone()
+        if tag_list is None:
+            return None
+        version = tag_list["version"]
+        if tag_list["deleted"]:
+            return TagListChanges(
+                version=version, deleted=True, snapshot=False, changes=[]
+            )
+        snapshot = (
+            since_version is None
+            or since_version > version
+            or version - since_version > max_changes
+        )
+        rows = self._execute(
+            "SELECT"
+            "    t.list_version as version,"
+            "    n.name as tag,"
+            "    t.video_id,"
+            "    t.youtube_timestamp,"
+            "    v.link,"
+            "    v.title,"
+            "    v.thumbnail"
+            " FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " JOIN video v ON v.id = t.video_id"
+            " WHERE t.tag_list_id = %s AND t.list_version > %s"
+            " AND (%s::integer IS NULL OR t.video_id = %s)"
+            " ORDER BY t.list_version",
+            (tag_list_id, 0 if snapshot else since_version, video_id, video_id),
+        ).fetchall()
+        changes = [TagChange(**row) for row in rows]
+        # tags committed between the two statements are already included,
+        # and versions are committed in order, so none can be missed
+        if changes:
+            version = max(version, changes[-1].version)
+        return TagListChanges(
+            version=version, deleted=False, snapshot=snapshot, changes=changes
+        )
+
+    def export_tag_list(
+        self, tag_list_id: int, batch_size: int
+    ) -> Iterator[ExportedTag]:
+        # a named cursor is a server side cursor, which only exists inside
+        # the transaction
+        try:
+            with self._connection.cursor(name="export_tag_list") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(
+                    "SELECT"
+                    "    t.list_version as version,"
+                    "    n.name as tag,"
+                    "    v.link,"
+                    "    v.title,"
+                    "    t.youtube_timestamp,"
+                    "    t.created,"
+                    "    u.username"
+                    " FROM tag t"
+                    " JOIN tag_name n ON n.id = t.tag_name_id"
+                    " JOIN video v ON v.id = t.video_id"
+                    " LEFT JOIN users u ON u.id = t.user_id"
+                    " WHERE t.tag_list_id = %s"
+                    " ORDER BY t.list_version",
+                    (tag_list_id,),
+                )
+                for row in cursor:
+                    yield ExportedTag(**row)
+        finally:
+            self._connection.rollback()
+
+    def get_tag_counts(self, tag_list_id: int) -> Sequence[TagSuggestion]:
+        tag_counts = self._execute(
+            "SELECT n.name as tag, g.count"
+            " FROM ("
+            "    SELECT tag_name_id, COUNT(*) as count"
+            "    FROM tag"
+            "    WHERE tag_list_id = %s"
+            "    GROUP BY tag_name_id"
+            " ) g"
+            " JOIN tag_name n ON n.id = g.tag_name_id",
+            (tag_list_id,),
+        ).fetchall()
+        return [TagSuggestion(**tag_count) for tag_count in tag_counts]
+
+    def get_tag_suggestions_near(
+        self,
+        tag_list_id: int,
+        video_id: int,
+        timestamp: float,
+        window: float,
+        prefix: str,
+        limit: int,
+    ) -> Sequence[TagSuggestion]:
+        suggestions = self._execute(
+            "SELECT n.name as tag, COUNT(*) as count"
+            " FROM tag t"
+            " JOIN tag_name n ON n.id = t.tag_name_id"
+            " WHERE tag_list_id = %s"
+            "    AND video_id = %s"
+            "    AND youtube_timestamp BETWEEN %s AND %s"
+            "    AND lower(n.name) LIKE %s"
+            " GROUP BY n.id"
+            " ORDER BY count DESC, tag ASC"
+            " LIMIT %s",
+            (
+                tag_list_id,
+                video_id,
+                timestamp - window,
+                timestamp + window,
+                escape_like(prefix.lower()) + "%",
+                limit,
+            ),
+        ).fetchall()
+        return [TagSuggestion(**suggestion) for suggestion in suggestions]
+
+    def search_tag_lists(self, query: str, limit: int) -> List[TagList]:
+        tag_lists = self._execute(
+            f"SELECT {TAG_LIST_COLUMNS}"
+            " FROM tag_list tl"
+            " JOIN users u ON tl.user_id = u.id,"
+            " websearch_to_tsquery('english', %s) query"
+            " WHERE deleted = false AND search_vector @@ query"
+            " ORDER BY ts_rank(search_vector, query) DESC, created DESC"
+            " LIMIT %s",
+            (query, limit),
+        ).fetchall()
+        return [TagList(**tl) for tl in tag_lists]
+
+    def search_videos(self, query: str, limit: int) -> Sequence[VideoSearchResult]:
+        results = self._execute(
+            "SELECT"
+            "    v.link,"
+            "    v.title,"
+            "    v.thumbnail,"
+            "    tl.id as tag_list_id,"
+            "    tl.name as tag_list_name"
+            " FROM ("
+            "    SELECT id, link, title, thumbnail,"
+            "        ts_rank(search_vector, query) as rank"
+            "    FROM video, websearch_to_tsquery('english', %s) query"
+            "    WHERE search_vector @@ query"
+            "    ORDER BY rank DESC, id ASC"
+            "    LIMIT %s"
+            " ) v"
+            " JOIN LATERAL ("
+            "    SELECT DISTINCT tag_list_id FROM tag WHERE video_id = v.id"
+            " ) t ON true"
+            " JOIN tag_list tl ON tl.id = t.tag_list_id"
+            " WHERE tl.deleted = false"
+            " ORDER BY v.rank DESC, v.id ASC, tl.id ASC",
+            (query, limit),
+        ).fetchall()
+        return [VideoSearchResult(**result) for result in results]
+
     def create_tag_list(
         self, name: str, description: str, user_id: int
     ) -> Optional[int]:
-        id_row = self._connection.execute(
+        id_row = self._execute(
             (
-                "INSERT INTO tag_list (name, description, user_id)"
-                " VALUES (%s, %s, %s)"
-                " RETURNING id"
+                "WITH inserted AS ("
+                "    INSERT INTO tag_list (name, description, user_id)"
+                "    VALUES (%s, %s, %s)"
+                "    RETURNING id, version"
+                " )"
+                " SELECT id, pg_notify(%s, json_build_object("
+                "    'type', 'tag_list_created',"
+                "    'tag_list_id', id,"
+                "    'version', version"
+                " )::text)"
+                " FROM inserted"
             ),
-            (name, description, user_id),
+            (name, description, user_id, EVENTS_CHANNEL),
         ).fetchone()
         self._connection.commit()
         if id_row is None:
@@ -357,7 +1367,7 @@ class PostgresDataModel(DataModel):
         return id
 
     def load_video_id(self, yt_link: str) -> Optional[int]:
-        id_row = self._connection.execute(
+        id_row = self._execute(
             "SELECT id FROM video WHERE link = %s",
             (yt_link,),
         ).fetchone()
@@ -369,13 +1379,23 @@ class PostgresDataModel(DataModel):
     def create_video_id(
         self, yt_link: str, thumbnail_url: str, title: str
     ) -> Optional[int]:
-        id_row = self._connection.execute(
+        id_row = self._execute(
             (
-                "INSERT INTO video (link, thumbnail, title)"
-                " VALUES (%s, %s, %s)"
-                " RETURNING id"
+                "WITH inserted AS ("
+                "    INSERT INTO video (link, thumbnail, title)"
+                "    VALUES (%s, %s, %s)"
+                "    RETURNING id, link, thumbnail, title"
+                " )"
+                " SELECT id, pg_notify(%s, json_build_object("
+                "    'type', 'video',"
+                "    'video_id', id,"
+                "    'link', link,"
+                "    'title', title,"
+                "    'thumbnail', thumbnail"
+                " )::text)"
+                " FROM inserted"
             ),
-            (yt_link, thumbnail_url, title),
+            (yt_link, thumbnail_url, title, EVENTS_CHANNEL),
         ).fetchone()
         self._connection.commit()
         if id_row is None:
@@ -383,15 +1403,124 @@ class PostgresDataModel(DataModel):
         id = int(id_row["id"])
         return id
 
+    def create_pending_video_id(
+        self, yt_link: str, thumbnail_url: str, title: str
+    ) -> Tuple[int, bool]:
+        # link isn't unique, the lock keeps two requests for a new video
+        # from both inserting it
+        self._execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (yt_link,))
+        id_row = self._execute(
+            "SELECT id FROM video WHERE link = %s", (yt_link,)
+        ).fetchone()
+        created = id_row is None
+        if created:
+            id_row = self._execute(
+                "INSERT INTO video (link, thumbnail, title, details_pending)"
+                " VALUES (%s, %s, %s, true)"
+                " RETURNING id",
+                (yt_link, thumbnail_url, title),
+            ).fetchone()
+        self._connection.commit()
+        assert id_row is not None
+        return int(id_row["id"]), created
+
+    def set_video_details(
+        self, video_id: int, thumbnail_url: Optional[str], title: Optional[str]
+    ) -> bool:
+        id_row = self._execute(
+            "WITH updated AS ("
+            "    UPDATE video"
+            "    SET thumbnail = COALESCE(%s, thumbnail),"
+            "        title = COALESCE(%s, title),"
+            "        details_pending = false"
+            "    WHERE id = %s AND details_pending"
+            "    RETURNING id, link, thumbnail, title"
+            " )"
+            " SELECT id, pg_notify(%s, json_build_object("
+            "    'type', 'video',"
+            "    'video_id', id,"
+            "    'link', link,"
+            "    'title', title,"
+            "    'thumbnail', thumbnail"
+            " )::text)"
+            " FROM updated",
+            (thumbnail_url, title, video_id, EVENTS_CHANNEL),
+        ).fetchone()
+        self._connection.commit()
+        return id_row is not None
+
+    def get_pending_videos(self, limit: int) -> List[PendingVideo]:
+        rows = self._execute(
+            "SELECT id, link FROM video WHERE details_pending ORDER BY id LIMIT %s",
+            (limit,),
+        ).fetchall()
+        return [PendingVideo(row["id"], row["link"]) for row in rows]
+
     def add_tag(
         self, tag: str, timestamp: float, tag_list_id: int, video_id: int, user_id: int
     ) -> Optional[int]:
-        tag_id_row = self._connection.execute(
-            "INSERT INTO tag"
-            " (tag_list_id, video_id, user_id, tag, youtube_timestamp)"
-            " VALUES (%s, %s, %s, %s, %s)"
-            " RETURNING id",
-            (tag_list_id, video_id, user_id, tag, timestamp),
+        # Updating the counters first locks the tag list row, so that the
+        # next statement can tell whether this is the first tag on the video
+        # even when another tag for it is being added at the same time.
+        # It also makes the versions of a tag list commit in order. Deleted
+        # tag lists are left out: one may already have been archived, and
+        # its tags would never be looked at again.
+        version_row = self._execute(
+            "UPDATE tag_list"
+            " SET num_tags = num_tags + 1,"
+            "     last_tagged_at = CURRENT_TIMESTAMP,"
+            "     version = version + 1"
+            " WHERE id = %s AND deleted = false"
+            " RETURNING version",
+            (tag_list_id,),
+        ).fetchone()
+        if version_row is None:
+            self._connection.rollback()
+            raise KeyError(
+                f"The tag list id {tag_list_id} does not exist or is deleted"
+            )
+        tag_name_id = self._get_tag_name_id(tag)
+        tag_id_row = self._execute(
+            "WITH new_video AS ("
+            "    UPDATE tag_list SET num_videos = num_videos + 1"
+            "    WHERE id = %s AND NOT EXISTS ("
+            "        SELECT 1 FROM tag WHERE tag_list_id = %s AND video_id = %s"
+            "    )"
+            " ), inserted AS ("
+            "    INSERT INTO tag"
+            "    (tag_list_id, video_id, user_id, tag_name_id, youtube_timestamp,"
+            "        list_version)"
+            "    VALUES (%s, %s, %s, %s, %s, %s)"
+            "    RETURNING id, tag_list_id, video_id, user_id, youtube_timestamp,"
+            "        list_version"
+            " )"
+            # listeners are only notified once the transaction commits
+            " SELECT i.id, pg_notify(%s, json_build_object("
+            "    'type', 'tag',"
+            "    'tag_list_id', i.tag_list_id,"
+            "    'version', i.list_version,"
+            "    'video_id', i.video_id,"
+            "    'user_id', i.user_id,"
+            "    'tag', %s::text,"
+            "    'youtube_timestamp', i.youtube_timestamp,"
+            "    'link', v.link,"
+            "    'title', v.title,"
+            "    'thumbnail', v.thumbnail"
+            " )::text)"
+            " FROM inserted i JOIN video v ON v.id = i.video_id",
+            (
+                tag_list_id,
+                tag_list_id,
+                video_id,
+                tag_list_id,
+                video_id,
+                user_id,
+                tag_name_id,
+                timestamp,
+                version_row["version"],
+                EVENTS_CHANNEL,
+                tag,
+            ),
         ).fetchone()
         self._connection.commit()
         if tag_id_row is None:
@@ -399,16 +1528,309 @@ class PostgresDataModel(DataModel):
         id = int(tag_id_row["id"])
         return id
 
+    def _get_tag_name_id(self, name: str) -> int:
+        """
+        The id of a name in the tag_name dictionary, which is added if it
+        isn't in it yet.
+        """
+        row = self._execute(
+            "SELECT id FROM tag_name WHERE name = %s", (name,)
+        ).fetchone()
+        if row is None:
+            # DO NOTHING returns no row if another transaction added the
+            # name first, the next statement sees it once that one commits
+            row = self._execute(
+                "INSERT INTO tag_name (name) VALUES (%s)"
+                " ON CONFLICT (name) DO NOTHING"
+                " RETURNING id",
+                (name,),
+            ).fetchone()
+        if row is None:
+            row = self._execute(
+                "SELECT id FROM tag_name WHERE name = %s", (name,)
+            ).fetchone()
+        assert row is not None
+        return int(row["id"])
+
     def delete_tag_list(self, tag_list_id: int) -> Optional[int]:
         tl = self.get_tag_list(tag_list_id)
         if tl is None:
             raise KeyError(f"The tag list id {tag_list_id} does not exist")
         if not tl.deleted:
-            self._connection.execute(
-                ("UPDATE tag_list " " SET deleted = true" " WHERE id = %s"),
-                (tag_list_id,),
+            self._execute(
+                "WITH deleted AS ("
+                "    UPDATE tag_list"
+                "    SET deleted = true, version = version + 1"
+                "    WHERE id = %s"
+                "    RETURNING id, version"
+                " )"
+                " SELECT pg_notify(%s, json_build_object("
+                "    'type', 'tag_list_deleted',"
+                "    'tag_list_id', id,"
+                "    'version', version"
+                " )::text)"
+                " FROM deleted",
+                (tag_list_id, EVENTS_CHANNEL),
             )
             self._connection.commit()
             return tag_list_id
         else:
             raise KeyError(f"The tag list id {tag_list_id} has already been deleted")
+
+    def _move_tags(
+        self, source: str, target: str, tag_list_id: int, batch_size: int
+    ) -> int:
+        """
+        Move up to batch_size tags of a tag list from one of tag and
+        tag_archive to the other, in the current transaction.
+        :return: the number of tags moved
+        """
+        cursor = self._execute(
+            "WITH moved AS ("
+            f"    DELETE FROM {source}"
+            "    WHERE tag_list_id = %s AND id IN ("
+            f"        SELECT id FROM {source} WHERE tag_list_id = %s LIMIT %s"
+            "    )"
+            f"    RETURNING {TAG_COLUMNS}"
+            " )"
+            f" INSERT INTO {target} ({TAG_COLUMNS})"
+            f" SELECT {TAG_COLUMNS} FROM moved",
+            (tag_list_id, tag_list_id, batch_size),
+        )
+        return cursor.rowcount
+
+    def import_tags(
+        self,
+        tag_list_id: int,
+        user_id: int,
+        rows: Iterable[ImportRow],
+        resolve_videos: VideoResolver,
+        max_rejected_rows: int,
+    ) -> ImportResult:
+        try:
+            return self._import_tags(
+                tag_list_id, user_id, rows, resolve_videos, max_rejected_rows
+            )
+        except BaseException:
+            self._connection.rollback()
+            raise
+        finally:
+            # the staging table is kept across the transactions of the import
+            if not self._connection.closed:
+                self._execute("DROP TABLE IF EXISTS import_staging")
+                self._connection.commit()
+
+    def _import_tags(
+        self,
+        tag_list_id: int,
+        user_id: int,
+        rows: Iterable[ImportRow],
+        resolve_videos: VideoResolver,
+        max_rejected_rows: int,
+    ) -> ImportResult:
+        # the rows are streamed into a staging table with COPY, and every
+        # step after that works on all of them at once
+        self._execute(
+            "CREATE TEMPORARY TABLE import_staging ("
+            "    line INTEGER NOT NULL,"
+            "    link TEXT NOT NULL,"
+            "    youtube_timestamp FLOAT NOT NULL,"
+            "    tag TEXT NOT NULL"
+            ")"
+        )
+        with self._connection.cursor() as cursor:
+            with cursor.copy(
+                "COPY import_staging (line, link, youtube_timestamp, tag) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row((row.line, row.link, row.youtube_timestamp, row.tag))
+        self._execute("ANALYZE import_staging")
+
+        missing = self._execute(
+            "SELECT DISTINCT link FROM import_staging s"
+            " WHERE NOT EXISTS (SELECT 1 FROM video v WHERE v.link = s.link)"
+        ).fetchall()
+        # youtube is asked outside of any transaction, so that a slow answer
+        # doesn't keep one open
+        self._connection.commit()
+        if missing:
+            details = resolve_videos([row["link"] for row in missing])
+            links = list(details)
+            # the locks of create_pending_video_id, taken in a fixed order
+            # so that two imports of the same new videos can't deadlock
+            self._execute(
+                "SELECT pg_advisory_xact_lock(h) FROM ("
+                "    SELECT DISTINCT hashtext(link) as h FROM unnest(%s::text[]) link"
+                "    ORDER BY h"
+                " ) locks",
+                (links,),
+            )
+            self._execute(
+                "INSERT INTO video (link, thumbnail, title)"
+                " SELECT * FROM unnest(%s::text[], %s::text[], %s::text[])"
+                "    AS d(link, thumbnail, title)"
+                " WHERE NOT EXISTS (SELECT 1 FROM video v WHERE v.link = d.link)",
+                (
+                    links,
+                    [details[link]["thumbnail_url"] for link in links],
+                    [details[link]["title"] for link in links],
+                ),
+            )
+        unknown = self._execute(
+            "WITH unknown AS ("
+            "    DELETE FROM import_staging s"
+            "    WHERE NOT EXISTS (SELECT 1 FROM video v WHERE v.link = s.link)"
+            "    RETURNING line"
+            " )"
+            " SELECT COUNT(*) as count,"
+            "    (ARRAY_AGG(line ORDER BY line))[1:%s] as lines"
+            " FROM unknown",
+            (max_rejected_rows,),
+        ).fetchone()
+        assert unknown is not None
+        rejected_rows = [
+            RejectedRow(line=line, reason="unknown youtube video")
+            for line in unknown["lines"] or []
+        ]
+
+        self._execute(
+            "INSERT INTO tag_name (name)"
+            " SELECT DISTINCT tag FROM import_staging"
+            " ON CONFLICT (name) DO NOTHING"
+        )
+        # locked until the commit, so that the versions of the imported tags
+        # follow the ones added before and come before the ones added after
+        version_row = self._execute(
+            "SELECT version FROM tag_list"
+            " WHERE id = %s AND deleted = false FOR UPDATE",
+            (tag_list_id,),
+        ).fetchone()
+        if version_row is None:
+            raise KeyError(
+                f"The tag list id {tag_list_id} does not exist or is deleted"
+            )
+        imported = self._execute(
+            "INSERT INTO tag"
+            " (tag_list_id, video_id, user_id, tag_name_id, youtube_timestamp,"
+            "    list_version)"
+            " SELECT %s, v.id, %s, n.id, s.youtube_timestamp,"
+            "    %s + ROW_NUMBER() OVER (ORDER BY s.line)"
+            " FROM import_staging s"
+            # video.link isn't unique, the oldest video with a link is used
+            " JOIN ("
+            "    SELECT link, MIN(id) as id FROM video"
+            "    WHERE link IN (SELECT link FROM import_staging)"
+            "    GROUP BY link"
+            " ) v ON v.link = s.link"
+            " JOIN tag_name n ON n.name = s.tag",
+            (tag_list_id, user_id, version_row["version"]),
+        ).rowcount
+        version = version_row["version"]
+        if imported:
+            tag_list_row = self._execute(
+                "WITH imported AS ("
+                "    UPDATE tag_list"
+                "    SET num_tags = num_tags + %s,"
+                "        num_videos = ("
+                "            SELECT COUNT(DISTINCT video_id) FROM tag"
+                "            WHERE tag_list_id = %s"
+                "        ),"
+                "        last_tagged_at = CURRENT_TIMESTAMP,"
+                "        version = version + %s"
+                "    WHERE id = %s"
+                "    RETURNING id, version"
+                " )"
+                # too many tags for one event each, clients reload the list
+                " SELECT version, pg_notify(%s, json_build_object("
+                "    'type', 'reset',"
+                "    'tag_list_id', id,"
+                "    'version', version"
+                " )::text)"
+                " FROM imported",
+                (imported, tag_list_id, imported, tag_list_id, EVENTS_CHANNEL),
+            ).fetchone()
+            assert tag_list_row is not None
+            version = tag_list_row["version"]
+        self._connection.commit()
+        return ImportResult(
+            imported=imported,
+            rejected=unknown["count"],
+            rejected_rows=rejected_rows,
+            version=version,
+        )
+
+    def archive_deleted_tag_lists(self, batch_size: int) -> int:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        moved = 0
+        while True:
+            # the row lock keeps add_tag and restore_tag_list out of the list
+            # until the batch commits, SKIP LOCKED lets two jobs run at once
+            row = self._execute(
+                "SELECT id FROM tag_list"
+                " WHERE deleted = true AND archived_at IS NULL"
+                " LIMIT 1"
+                " FOR UPDATE SKIP LOCKED"
+            ).fetchone()
+            if row is None:
+                self._connection.commit()
+                return moved
+            count = self._move_tags("tag", "tag_archive", row["id"], batch_size)
+            if count < batch_size:
+                self._execute(
+                    "UPDATE tag_list SET archived_at = CURRENT_TIMESTAMP"
+                    " WHERE id = %s",
+                    (row["id"],),
+                )
+            self._connection.commit()
+            moved += count
+
+    def restore_tag_list(self, tag_list_id: int, batch_size: int) -> int:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        row = self._execute(
+            "SELECT deleted FROM tag_list WHERE id = %s FOR UPDATE",
+            (tag_list_id,),
+        ).fetchone()
+        if row is None:
+            self._connection.rollback()
+            raise KeyError(f"The tag list id {tag_list_id} does not exist")
+        if not row["deleted"]:
+            self._connection.rollback()
+            raise KeyError(f"The tag list id {tag_list_id} is not deleted")
+        # a set archived_at keeps the archival job away while the tags are
+        # moved back, the list stays deleted until all of them are
+        self._execute(
+            "UPDATE tag_list"
+            " SET archived_at = COALESCE(archived_at, CURRENT_TIMESTAMP)"
+            " WHERE id = %s",
+            (tag_list_id,),
+        )
+        self._connection.commit()
+        moved = 0
+        while True:
+            self._execute(
+                "SELECT id FROM tag_list WHERE id = %s FOR UPDATE", (tag_list_id,)
+            )
+            count = self._move_tags("tag_archive", "tag", tag_list_id, batch_size)
+            moved += count
+            if count < batch_size:
+                break
+            self._connection.commit()
+        self._execute(
+            "WITH restored AS ("
+            "    UPDATE tag_list"
+            "    SET deleted = false, archived_at = NULL, version = version + 1"
+            "    WHERE id = %s"
+            "    RETURNING id, version"
+            " )"
+            " SELECT pg_notify(%s, json_build_object("
+            "    'type', 'tag_list_restored',"
+            "    'tag_list_id', id,"
+            "    'version', version"
+            " )::text)"
+            " FROM restored",
+            (tag_list_id, EVENTS_CHANNEL),
+        )
+        self._connection.commit()
+        return moved
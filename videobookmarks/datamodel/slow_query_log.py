@@ -0,0 +1,129 @@
+"""
+A log of the statements that PostgresDataModel runs slower than a threshold.
+
+Each slow statement is appended to a file as a line of json with its sql,
+parameters, duration and row count, so that it can be analysed offline.
+A sample of them, at most `max_explains_per_minute`, also get the plan
+postgres used. Statements that only read are explained with
+EXPLAIN (ANALYZE, BUFFERS), which runs them again. Anything that writes
+(or sends a notification) only gets a plain EXPLAIN, and every EXPLAIN
+runs in a savepoint that is rolled back, so logging never changes data.
+"""
+
+import collections
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Deque, Dict, Optional, Sequence, Union
+
+from psycopg import Connection, Error, Rollback
+from psycopg.rows import tuple_row
+
+Parameters = Optional[Union[Sequence[Any], Dict[str, Any]]]
+
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|pg_notify|nextval)\b", re.I)
+
+
+def is_read_only(query: str) -> bool:
+    """
+    Whether it is safe to run a statement again for EXPLAIN ANALYZE.
+    """
+    start = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    return start in ("SELECT", "WITH") and _WRITES.search(query) is None
+
+
+class SlowQueryLog:
+    """
+    Appends the statements slower than a threshold to a json lines file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold: float,
+        explain_sample_rate: float = 1.0,
+        max_explains_per_minute: int = 10,
+    ):
+        """
+        :param path: the file the slow statements are appended to
+        :param threshold: in seconds, statements that take longer are logged
+        :param explain_sample_rate: the fraction of slow statements that are
+                explained, between 0 and 1
+        :param max_explains_per_minute: the most EXPLAINs run in any minute,
+                the ones past this are logged without a plan
+        """
+        self.path = path
+        self.threshold = threshold
+        self.explain_sample_rate = explain_sample_rate
+        self.max_explains_per_minute = max_explains_per_minute
+        self._lock = threading.Lock()
+        self._explain_times: Deque[float] = collections.deque()
+
+    def _take_explain(self) -> bool:
+        if random.random() >= self.explain_sample_rate:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._explain_times and now - self._explain_times[0] > 60:
+                self._explain_times.popleft()
+            if len(self._explain_times) >= self.max_explains_per_minute:
+                return False
+            self._explain_times.append(now)
+        return True
+
+    def explain(
+        self, connection: Connection[Any], query: str, params: Parameters
+    ) -> Optional[str]:
+        """
+        :return: the plan of the statement as text, None if it failed
+        """
+        if is_read_only(query):
+            statement = f"EXPLAIN (ANALYZE, BUFFERS) {query}"
+        else:
+            statement = f"EXPLAIN {query}"
+        plan = None
+        try:
+            with connection.transaction():
+                with connection.cursor(row_factory=tuple_row) as cursor:
+                    rows = cursor.execute(statement, params).fetchall()
+                plan = "\n".join(row[0] for row in rows)
+                raise Rollback()
+        except Error:
+            return None
+        return plan
+
+    def record(
+        self,
+        connection: Connection[Any],
+        query: str,
+        params: Parameters,
+        duration: float,
+        rowcount: int,
+    ) -> None:
+        """
+        Log a statement if it took longer than the threshold.
+        :param duration: how long the statement took, in seconds
+        """
+        if duration < self.threshold:
+            return
+        if "password" in query.lower():
+            logged_params: Any = "<redacted>"
+        else:
+            logged_params = params
+        entry = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "rowcount": rowcount,
+            "query": query,
+            "params": logged_params,
+            "plan": None,
+        }
+        if self._take_explain():
+            entry["plan"] = self.explain(connection, query, params)
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
@@ -1,7 +1,29 @@
+import os
+from typing import Optional
+
+import click
 from flask import Flask
 from flask import current_app
+from flask.cli import with_appcontext
+from psycopg import Connection
+from psycopg.rows import DictRow, dict_row
+from psycopg_pool import ConnectionPool
 
 from videobookmarks.datamodel.datamodel import PostgresDataModel
+from videobookmarks.datamodel.slow_query_log import SlowQueryLog
+
+
+def get_db_pool() -> Optional[ConnectionPool[Connection[DictRow]]]:
+    """
+    The connection pool of the app, opened if it isn't yet. None if
+    DB_POOL_MAX_SIZE is 0 and every request connects on its own.
+    """
+    pool: Optional[ConnectionPool[Connection[DictRow]]] = current_app.extensions.get(
+        "db_pool"
+    )
+    if pool is not None:
+        pool.open()
+    return pool
 
 
 def get_datamodel() -> PostgresDataModel:
@@ -11,12 +33,20 @@ def get_datamodel() -> PostgresDataModel:
     """
     from flask import g
 
-    if "datamodel" not in g or type(g.datamodel) != PostgresDataModel:
-        g.datamodel = PostgresDataModel(current_app.config["DB_URL"])
+    if "datamodel" not in g or not isinstance(g.datamodel, PostgresDataModel):
+        # a subclass that records metrics, see videobookmarks.metrics
+        datamodel_class = current_app.extensions.get(
+            "datamodel_class", PostgresDataModel
+        )
+        g.datamodel = datamodel_class(
+            current_app.config["DB_URL"],
+            slow_query_log=current_app.extensions.get("slow_query_log"),
+            pool=get_db_pool(),
+        )
     return g.datamodel
 
 
-def close_datamodel() -> None:
+def close_datamodel(e: Optional[BaseException] = None) -> None:
     """If this request connected to the database, close the
     connection.
     """
@@ -28,8 +58,75 @@ def close_datamodel() -> None:
         datamodel.close()
 
 
+@click.command("archive-deleted-tags")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help="Tags moved per transaction, TAG_ARCHIVE_BATCH_SIZE by default.",
+)
+@with_appcontext  # type: ignore
+def archive_deleted_tags_command(batch_size: Optional[int]) -> None:
+    """Move the tags of deleted tag lists into the archive."""
+    if batch_size is None:
+        batch_size = current_app.config["TAG_ARCHIVE_BATCH_SIZE"]
+    moved = get_datamodel().archive_deleted_tag_lists(batch_size)
+    click.echo(f"Archived {moved} tags.")
+
+
+@click.command("restore-tag-list")
+@click.argument("tag_list_id", type=int)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help="Tags moved per transaction, TAG_ARCHIVE_BATCH_SIZE by default.",
+)
+@with_appcontext  # type: ignore
+def restore_tag_list_command(tag_list_id: int, batch_size: Optional[int]) -> None:
+    """Undelete a tag list and move its archived tags back."""
+    if batch_size is None:
+        batch_size = current_app.config["TAG_ARCHIVE_BATCH_SIZE"]
+    try:
+        moved = get_datamodel().restore_tag_list(tag_list_id, batch_size)
+    except KeyError as e:
+        raise click.ClickException(e.args[0])
+    click.echo(f"Restored tag list {tag_list_id} with {moved} archived tags.")
+
+
 def init_app_datamodel(app: Flask) -> None:
-    """Register database functions with the Flask app. This is called by
-    the application factory.
+    """Register database functions with the Flask app, create the
+    connection pool, and the slow query log if SLOW_QUERY_THRESHOLD is
+    set. This is called by the application factory.
     """
     app.teardown_appcontext(close_datamodel)
+    app.cli.add_command(archive_deleted_tags_command)
+    app.cli.add_command(restore_tag_list_command)
+    if app.config["DB_POOL_MAX_SIZE"] > 0 and "db_pool" not in app.extensions:
+        # opened on first use, or by the warm up, so that the connections
+        # are made in the worker process rather than in a parent that forks
+        app.extensions["db_pool"] = ConnectionPool(
+            app.config["DB_URL"],
+            kwargs={"row_factory": dict_row},
+            min_size=min(
+                app.config["DB_POOL_MIN_SIZE"], app.config["DB_POOL_MAX_SIZE"]
+            ),
+            max_size=app.config["DB_POOL_MAX_SIZE"],
+            timeout=app.config["DB_POOL_TIMEOUT"],
+            open=False,
+            name="videobookmarks",
+        )
+    threshold = app.config["SLOW_QUERY_THRESHOLD"]
+    if threshold is None:
+        app.extensions.pop("slow_query_log", None)
+        return
+    path = app.config["SLOW_QUERY_LOG_PATH"]
+    if path is None:
+        os.makedirs(app.instance_path, exist_ok=True)
+        path = os.path.join(app.instance_path, "slow_queries.jsonl")
+    app.extensions["slow_query_log"] = SlowQueryLog(
+        path,
+        threshold,
+        explain_sample_rate=app.config["SLOW_QUERY_EXPLAIN_SAMPLE_RATE"],
+        max_explains_per_minute=app.config["SLOW_QUERY_MAX_EXPLAINS_PER_MINUTE"],
+    )
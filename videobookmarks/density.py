@@ -0,0 +1,87 @@
+"""
+Tag density of the videos of a tag list, for the heatmap of the tagging
+timeline.
+
+The counts are binned in the database, see DataModel.get_tag_density, and
+kept for the most recently used (tag list, video, bucket width) in a
+TagDensityCache. An entry is only used while the tag list is still at the
+version it was computed for, so any change to the tag list, from any
+worker, makes its entries stale.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from flask import Flask
+from flask import current_app
+
+from videobookmarks.datamodel.datamodel import DataModel, TagDensity
+
+# tag_list_id, video_id, bucket_width, max_tags
+_Key = Tuple[int, int, float, int]
+
+
+class TagDensityCache:
+    """
+    Keeps the TagDensity of the max_entries most recently used keys.
+    """
+
+    def __init__(self, max_entries: int, max_buckets: int):
+        self.max_entries = max_entries
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_Key, TagDensity]" = OrderedDict()
+
+    def get(
+        self,
+        datamodel: DataModel,
+        video_id: int,
+        tag_list_id: int,
+        bucket_width: float,
+        max_tags: int,
+    ) -> Optional[TagDensity]:
+        """
+        See DataModel.get_tag_density.
+        :return: None if the tag list does not exist or is deleted
+        """
+        tag_list = datamodel.get_tag_list(tag_list_id)
+        if tag_list is None or tag_list.deleted:
+            return None
+        key = (tag_list_id, video_id, bucket_width, max_tags)
+        with self._lock:
+            density = self._entries.get(key)
+            if density is not None and density.version == tag_list.version:
+                self._entries.move_to_end(key)
+                return density
+        density = datamodel.get_tag_density(
+            video_id, tag_list_id, bucket_width, self.max_buckets, max_tags
+        )
+        if density is None or self.max_entries <= 0:
+            return density
+        with self._lock:
+            self._entries[key] = density
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return density
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def get_tag_density_cache() -> TagDensityCache:
+    cache: TagDensityCache = current_app.extensions["tag_density"]
+    return cache
+
+
+def init_app_density(app: Flask) -> None:
+    """
+    Create the tag density cache for the Flask app. This is called by the
+    application factory.
+    """
+    app.extensions["tag_density"] = TagDensityCache(
+        max_entries=app.config["TAG_DENSITY_CACHE_SIZE"],
+        max_buckets=app.config["TAG_DENSITY_MAX_BUCKETS"],
+    )
@@ -0,0 +1,219 @@
+"""
+Live updates of tag lists, pushed to browsers with Server-Sent Events.
+
+PostgresDataModel sends a NOTIFY on EVENTS_CHANNEL whenever a tag is added,
+a video is created or a tag list is created or deleted. Each worker process keeps a
+single connection that LISTENs on that channel and hands every event to the
+subscribers of the tag list it belongs to, so the number of database
+connections doesn't grow with the number of open browser tabs.
+
+Every subscriber holds a request open for as long as the page is open, so
+the app has to be served by threaded or async workers
+(e.g. `gunicorn --threads` or `--worker-class gevent`) for this to scale.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from flask import Flask
+from flask import current_app
+from psycopg import OperationalError, connect
+
+from videobookmarks.datamodel.datamodel import EVENTS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+# sent to a subscriber when events may have been lost, the client should
+# reload the whole tag list
+RESET_EVENT: Event = {"type": "reset"}
+
+
+class Subscription:
+    """
+    The events for a single tag list, queued up for one client.
+    """
+
+    def __init__(self, tag_list_id: int, queue_size: int):
+        self.tag_list_id = tag_list_id
+        self._queue: "queue.Queue[Event]" = queue.Queue(maxsize=queue_size)
+        # put runs on the listening thread and get on the request's, the
+        # lock keeps an overflow from being lost or reported twice
+        self._lock = threading.Lock()
+        self._overflowed = False
+
+    def put(self, event: Event) -> None:
+        with self._lock:
+            if self._overflowed:
+                return
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                # the client isn't keeping up, drop what it hasn't read yet
+                # and tell it to start over rather than letting the queue grow
+                self._overflowed = True
+
+    def get(self, timeout: float) -> Optional[Event]:
+        """
+        :return: the next event, or None if there was none within timeout
+        """
+        with self._lock:
+            if self._overflowed:
+                with self._queue.mutex:
+                    self._queue.queue.clear()
+                self._overflowed = False
+                return RESET_EVENT
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    Fans the notifications from one LISTEN connection out to the
+    subscriptions and listeners of this process. The listening thread is
+    started the first time someone subscribes or calls start, so it always
+    runs in the worker process rather than in a parent that forks the
+    workers.
+    """
+
+    def __init__(self, db_url: str, queue_size: int, reconnect_delay: float = 1.0):
+        self.db_url = db_url
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        # whether the LISTEN connection is up, events sent while it isn't
+        # are lost
+        self.listening = False
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._listeners: List[Callable[[Event], None]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def _start(self) -> None:
+        # called with the lock held
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._listen,
+                name="tag-list-events",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def start(self) -> None:
+        """
+        Start listening, if that isn't already the case.
+        """
+        with self._lock:
+            self._start()
+
+    def subscribe(self, tag_list_id: int) -> Subscription:
+        subscription = Subscription(tag_list_id, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(tag_list_id, set()).add(subscription)
+            self._start()
+        return subscription
+
+    def add_listener(self, listener: Callable[[Event], None]) -> None:
+        """
+        Call listener with every event, of every tag list, from the
+        listening thread. A RESET_EVENT means that events may have been
+        lost. This doesn't start listening.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.tag_list_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.tag_list_id]
+
+    def publish(self, event: Event) -> None:
+        """
+        Hand an event to the subscribers of its tag list, or to every
+        subscriber if it doesn't belong to a tag list (e.g. a new video).
+        """
+        with self._lock:
+            tag_list_id = event.get("tag_list_id")
+            if tag_list_id is None:
+                targets = [s for subs in self._subscriptions.values() for s in subs]
+            else:
+                targets = list(self._subscriptions.get(tag_list_id, ()))
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(event)
+        for subscription in targets:
+            subscription.put(event)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                with connect(self.db_url, autocommit=True) as connection:
+                    connection.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    self.listening = True
+                    # anything sent while we weren't listening is lost
+                    self.publish(RESET_EVENT)
+                    for notify in connection.notifies():
+                        try:
+                            event = json.loads(notify.payload)
+                        except json.JSONDecodeError:
+                            logger.warning("Invalid event %r", notify.payload)
+                            continue
+                        self.publish(event)
+            except OperationalError:
+                logger.exception("Lost the tag list events connection")
+            self.listening = False
+            time.sleep(self.reconnect_delay)
+
+
+def format_event(event: Event) -> str:
+    """
+    Serialize an event in the text/event-stream format.
+    """
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_events(
+    broker: EventBroker, subscription: Subscription, heartbeat: float
+) -> Iterator[str]:
+    """
+    Generate the body of a text/event-stream response until the client
+    disconnects.
+    """
+    try:
+        # how long the browser waits before reconnecting, in milliseconds
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is None:
+                # a comment, keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+            else:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def get_event_broker() -> EventBroker:
+    broker: EventBroker = current_app.extensions["event_broker"]
+    return broker
+
+
+def init_app_events(app: Flask) -> None:
+    """
+    Create the event broker for the Flask app. This is called by the
+    application factory. No connection is made until the first client
+    subscribes.
+    """
+    app.extensions["event_broker"] = EventBroker(
+        app.config["DB_URL"],
+        queue_size=app.config["EVENTS_QUEUE_SIZE"],
+    )
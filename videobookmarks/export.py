@@ -0,0 +1,72 @@
+"""
+Streaming exports of every tag in a tag list, as csv or json lines.
+
+The tags are read from a server side cursor and written out in chunks of
+EXPORT_BATCH_SIZE rows while the response is sent, so an export of any size
+uses the same memory and the client starts receiving it right away.
+"""
+
+import csv
+import dataclasses
+import datetime
+import io
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from videobookmarks.datamodel.datamodel import ExportedTag
+
+COLUMNS = [field.name for field in dataclasses.fields(ExportedTag)]
+
+
+def _values(tag: ExportedTag) -> List[object]:
+    values: List[object] = []
+    for column in COLUMNS:
+        value = getattr(tag, column)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        values.append(value)
+    return values
+
+
+def csv_chunks(tags: Iterable[ExportedTag], chunk_rows: int) -> Iterator[str]:
+    """
+    :return: the header, then chunk_rows csv rows at a time
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    # the header goes out before the first row is read
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    rows = 0
+    for tag in tags:
+        writer.writerow(_values(tag))
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(tags: Iterable[ExportedTag], chunk_rows: int) -> Iterator[str]:
+    """
+    :return: chunk_rows lines of json objects at a time
+    """
+    lines = []
+    for tag in tags:
+        lines.append(json.dumps(dict(zip(COLUMNS, _values(tag)))) + "\n")
+        if len(lines) == chunk_rows:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+
+# format: (mimetype, file extension, chunk encoder)
+FORMATS: Dict[
+    str, Tuple[str, str, Callable[[Iterable[ExportedTag], int], Iterator[str]]]
+] = {
+    "csv": ("text/csv", "csv", csv_chunks),
+    "jsonl": ("application/x-ndjson", "jsonl", jsonl_chunks),
+}
@@ -0,0 +1,177 @@
+"""
+A cache of rendered pages for anonymous users.
+
+The index and the tag list view pages are the same for every anonymous user
+until the data they show changes, so their rendered html is kept in memory
+and reused. Rather than expiring entries, every entry is keyed on a data
+version: each tag list has its own version, bumped when it is created,
+deleted or tagged, and the global version is bumped by any change. A page
+rendered before a change is never served after it, since the change moved
+the version on, and the old entries are evicted in least recently used
+order once the entries hold more than FRAGMENT_CACHE_MAX_BYTES.
+
+The versions are bumped straight away by the routes of this process and,
+for changes made through other worker processes, by the tag list events
+(see videobookmarks.events). The cache is only used while the events
+connection is up, otherwise changes made elsewhere could be missed.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from flask import Flask
+from flask import current_app
+from flask import g
+from flask import session
+
+from videobookmarks.events import Event, EventBroker
+
+# (name, args, generation, version)
+FragmentKey = Tuple[str, Hashable, int, int]
+
+
+class FragmentCache:
+    """
+    Rendered fragments by name, arguments and the data version they were
+    rendered at, bounded by the total size of the fragments.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # the fragments with their size in bytes of utf-8
+        self._fragments: "OrderedDict[FragmentKey, Tuple[str, int]]" = OrderedDict()
+        self._size = 0
+        # bumped when events may have been lost, invalidates everything
+        self._generation = 0
+        self._global_version = 0
+        self._list_versions: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._fragments)
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the cached fragments, in bytes of utf-8
+        """
+        return self._size
+
+    def _key(
+        self, name: str, args: Hashable, tag_list_id: Optional[int]
+    ) -> FragmentKey:
+        # called with the lock held
+        if tag_list_id is None:
+            version = self._global_version
+        else:
+            version = self._list_versions.get(tag_list_id, 0)
+        return (name, args, self._generation, version)
+
+    def get_or_render(
+        self,
+        name: str,
+        args: Hashable,
+        tag_list_id: Optional[int],
+        render: Callable[[], str],
+    ) -> str:
+        """
+        :param name: of the fragment, e.g. the template
+        :param args: everything else the fragment depends on
+        :param tag_list_id: the tag list the fragment shows, None if it
+                depends on all the data
+        :param render: renders the fragment if it isn't cached
+        """
+        with self._lock:
+            # taken before rendering, so a change made while rendering
+            # leaves the fragment under a version that is already stale
+            key = self._key(name, args, tag_list_id)
+            entry = self._fragments.get(key)
+            if entry is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        fragment = render()
+        size = len(fragment.encode())
+        if size > self.max_bytes:
+            return fragment
+        with self._lock:
+            previous = self._fragments.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._fragments[key] = (fragment, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._fragments.popitem(last=False)
+                self._size -= evicted_size
+        return fragment
+
+    def bump(self, tag_list_id: Optional[int] = None) -> None:
+        """
+        Record a change to a tag list, or to data that isn't part of one
+        (e.g. a video) if tag_list_id is None.
+        """
+        with self._lock:
+            self._global_version += 1
+            if tag_list_id is not None:
+                self._list_versions[tag_list_id] = (
+                    self._list_versions.get(tag_list_id, 0) + 1
+                )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._fragments.clear()
+            self._size = 0
+
+    def handle_event(self, event: Event) -> None:
+        """
+        EventBroker listener, bumps the versions for changes made by any
+        worker process.
+        """
+        tag_list_id = event.get("tag_list_id")
+        if tag_list_id is None and event["type"] == "reset":
+            self.clear()
+        else:
+            self.bump(tag_list_id)
+
+
+def get_fragment_cache() -> FragmentCache:
+    cache: FragmentCache = current_app.extensions["fragment_cache"]
+    return cache
+
+
+def cached_page(
+    name: str,
+    args: Hashable,
+    tag_list_id: Optional[int],
+    render: Callable[[], str],
+) -> str:
+    """
+    Serve a page from the fragment cache to anonymous users, see
+    FragmentCache.get_or_render. Logged in users, and pages with flashed
+    messages, are always rendered.
+    """
+    if current_app.config["FRAGMENT_CACHE_MAX_BYTES"] <= 0:
+        return render()
+    if g.user is not None or session.get("_flashes"):
+        return render()
+    broker: EventBroker = current_app.extensions["event_broker"]
+    broker.start()
+    if not broker.listening:
+        return render()
+    return get_fragment_cache().get_or_render(name, args, tag_list_id, render)
+
+
+def init_app_fragments(app: Flask) -> None:
+    """
+    Create the fragment cache for the Flask app and have it follow the tag
+    list events. This is called by the application factory, after
+    init_app_events.
+    """
+    cache = FragmentCache(app.config["FRAGMENT_CACHE_MAX_BYTES"])
+    app.extensions["fragment_cache"] = cache
+    app.extensions["event_broker"].add_listener(cache.handle_event)
@@ -0,0 +1,422 @@
+"""
+Counters, gauges and latency histograms for the app, served in the
+Prometheus text format at /metrics.
+
+When METRICS_ENABLED is set, every request is timed by endpoint, every
+DataModel method is timed by wrapping PostgresDataModel in an instrumented
+subclass, and calls to external services can be timed with
+`external_call`. When it isn't, none of the hooks are installed and
+`external_call` only checks that there is no registry, so the cost is a
+dictionary lookup per call.
+"""
+
+import bisect
+import contextlib
+import functools
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from flask import Blueprint, Flask, Response
+from flask import current_app
+from flask import g
+from flask import request
+
+from videobookmarks.datamodel.datamodel import DataModel, PostgresDataModel
+
+# in seconds, from a fast index lookup to a slow external call
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+bp = Blueprint("metrics", __name__)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """
+        :return: (name suffix, formatted labels, value) of every sample
+        """
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the number of errors.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            yield "", _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. the number of open connections.
+    A gauge can also read its value from a function when it is rendered.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: LabelValues = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, labels: LabelValues = ()) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self._function is not None:
+            yield "", "", self._function()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            yield "", _format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    """
+    Counts observations, usually durations in seconds, in buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: the count of each bucket (not cumulative, the
+        # last one is +Inf), the sum and the count of all observations
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    def count(self, labels: LabelValues = ()) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            snapshot = [
+                (labels, list(counts), self._sums[labels])
+                for labels, counts in self._counts.items()
+            ]
+        labelnames = self.labelnames + ("le",)
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(labelnames, labels + (le,))
+                yield "_bucket", bucket_labels, cumulative
+            formatted = _format_labels(self.labelnames, labels)
+            yield "_sum", formatted, total
+            yield "_count", formatted, cumulative
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """
+    All the metrics of one app, and the ones that the app itself records.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self.request_duration = self.add(
+            Histogram(
+                "videobookmarks_request_duration_seconds",
+                "Time spent handling requests, by endpoint.",
+                ("method", "endpoint", "status"),
+            )
+        )
+        self.requests_in_progress = self.add(
+            Gauge(
+                "videobookmarks_requests_in_progress",
+                "Requests that are being handled.",
+            )
+        )
+        self.datamodel_duration = self.add(
+            Histogram(
+                "videobookmarks_datamodel_duration_seconds",
+                "Time spent in DataModel methods.",
+                ("method",),
+            )
+        )
+        self.datamodel_errors = self.add(
+            Counter(
+                "videobookmarks_datamodel_errors_total",
+                "DataModel method calls that raised an exception.",
+                ("method",),
+            )
+        )
+        self.db_connections_open = self.add(
+            Gauge(
+                "videobookmarks_db_connections_open",
+                "Database connections held by DataModel instances.",
+            )
+        )
+        self.db_connections_opened = self.add(
+            Counter(
+                "videobookmarks_db_connections_opened_total",
+                "Database connections opened by DataModel instances.",
+            )
+        )
+        self.external_duration = self.add(
+            Histogram(
+                "videobookmarks_external_call_duration_seconds",
+                "Time spent waiting for external services.",
+                ("service", "outcome"),
+            )
+        )
+
+    def add(self, metric: M) -> M:
+        """
+        Register a metric so that it is rendered at /metrics.
+        :return: the metric
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named {metric.name} already exists")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    """
+    :return: the registry of the current app, None if metrics are disabled
+    """
+    registry: Optional[MetricsRegistry] = current_app.extensions.get("metrics")
+    return registry
+
+
+@contextlib.contextmanager
+def external_call(service: str) -> Iterator[None]:
+    """
+    Time a call to an external service, e.g. the youtube api.
+    """
+    registry = get_metrics()
+    if registry is None:
+        yield
+        return
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        registry.external_duration.observe(
+            time.perf_counter() - start, (service, outcome)
+        )
+
+
+def _instrument_method(
+    registry: MetricsRegistry, name: str, method: Callable[..., Any]
+) -> Callable[..., Any]:
+    labels = (name,)
+
+    @functools.wraps(method)
+    def wrapped(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            registry.datamodel_errors.inc(labels)
+            raise
+        finally:
+            registry.datamodel_duration.observe(time.perf_counter() - start, labels)
+
+    return wrapped
+
+
+def instrument_datamodel(
+    datamodel_class: Type[PostgresDataModel], registry: MetricsRegistry
+) -> Type[PostgresDataModel]:
+    """
+    Create a subclass of datamodel_class that times every method of the
+    DataModel interface and counts the connections it opens and closes.
+    """
+    namespace: Dict[str, Any] = {}
+    for name in sorted(DataModel.__abstractmethods__ - {"close"}):
+        namespace[name] = _instrument_method(
+            registry, name, getattr(datamodel_class, name)
+        )
+
+    def __init__(self: PostgresDataModel, *args: Any, **kwargs: Any) -> None:
+        datamodel_class.__init__(self, *args, **kwargs)
+        registry.db_connections_opened.inc()
+        registry.db_connections_open.inc()
+
+    def close(self: PostgresDataModel) -> None:
+        try:
+            datamodel_class.close(self)
+        finally:
+            registry.db_connections_open.dec()
+
+    namespace["__init__"] = __init__
+    namespace["close"] = close
+    return type(
+        f"Instrumented{datamodel_class.__name__}", (datamodel_class,), namespace
+    )
+
+
+def _start_timer() -> None:
+    g.metrics_start = time.perf_counter()
+    registry: MetricsRegistry = current_app.extensions["metrics"]
+    registry.requests_in_progress.inc()
+
+
+def _record_request(response: Response) -> Response:
+    start = g.pop("metrics_start", None)
+    if start is None:
+        # an earlier before_request handler returned a response
+        return response
+    registry: MetricsRegistry = current_app.extensions["metrics"]
+    registry.requests_in_progress.dec()
+    # the endpoint rather than the path, so that ids in urls don't create
+    # a new series each
+    endpoint = request.endpoint or "unknown"
+    registry.request_duration.observe(
+        time.perf_counter() - start,
+        (request.method, endpoint, str(response.status_code)),
+    )
+    return response
+
+
+@bp.route("/metrics", methods=("GET",))  # type: ignore
+def metrics() -> Response:
+    """
+    All metrics in the Prometheus text format
+    """
+    registry: MetricsRegistry = current_app.extensions["metrics"]
+    return Response(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def init_app_metrics(app: Flask) -> None:
+    """
+    Install the metrics hooks and the /metrics route if METRICS_ENABLED is
+    set. This is called by the application factory before the datamodel
+    is used.
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return
+    registry = MetricsRegistry()
+    app.extensions["metrics"] = registry
+    app.extensions["datamodel_class"] = instrument_datamodel(
+        PostgresDataModel, registry
+    )
+    # the app factory installs these hooks first, so that the time spent
+    # in the other hooks (e.g. compression) is included
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.register_blueprint(bp)
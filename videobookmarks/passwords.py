@@ -0,0 +1,181 @@
+"""
+Password hashing and verification in a pool of worker processes.
+
+Hashing a password is deliberately slow (werkzeug uses scrypt, about 100ms of
+CPU each). Done on the request thread, a burst of logins or registrations
+keeps every worker busy and the other routes wait behind them. Instead the
+hashes are computed by PASSWORD_HASH_WORKERS processes, which run at a lower
+priority than the app, and at most PASSWORD_HASH_MAX_PENDING hashes can be
+queued or running at once. A request that can't get a slot within
+PASSWORD_HASH_QUEUE_TIMEOUT seconds fails with PasswordHasherBusy, which the
+routes turn into a 503, rather than piling up.
+
+With PASSWORD_HASH_WORKERS set to 0 the hashes are computed on the request
+thread, still limited to PASSWORD_HASH_MAX_PENDING at once.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from flask import Flask, Response
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from videobookmarks.metrics import Counter, Histogram, MetricsRegistry
+
+T = TypeVar("T")
+
+# how much lower the priority of the worker processes is than the app's
+WORKER_NICENESS = 10
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Too many passwords are being hashed, the request should be retried later.
+    """
+
+
+def _lower_priority() -> None:
+    os.nice(WORKER_NICENESS)
+
+
+def _timed(function: Callable[..., T], *args: Any) -> Tuple[float, T]:
+    """
+    Runs in a worker process.
+    :return: when the work started, as time.time() since the clocks of
+            different processes are compared, and the result
+    """
+    return time.time(), function(*args)
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        queue_timeout: float,
+        registry: Optional[MetricsRegistry] = None,
+    ):
+        """
+        :param workers: the number of worker processes, 0 to hash on the
+                calling thread
+        :param max_pending: the most hashes that can be queued or running
+        :param queue_timeout: in seconds, how long to wait for one of the
+                max_pending slots before giving up
+        :param registry: where to record the queue and hashing times
+        """
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._queue_time: Optional[Histogram] = None
+        self._duration: Optional[Histogram] = None
+        self._rejected: Optional[Counter] = None
+        if registry is not None:
+            self._queue_time = registry.add(
+                Histogram(
+                    "videobookmarks_password_hash_queue_seconds",
+                    "Time password hashes waited for a worker.",
+                    ("operation",),
+                )
+            )
+            self._duration = registry.add(
+                Histogram(
+                    "videobookmarks_password_hash_duration_seconds",
+                    "Time spent hashing passwords.",
+                    ("operation",),
+                )
+            )
+            self._rejected = registry.add(
+                Counter(
+                    "videobookmarks_password_hash_rejected_total",
+                    "Password hashes refused because too many were pending.",
+                    ("operation",),
+                )
+            )
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked, the app has other threads
+                # (e.g. the events listener) that a fork would copy mid-way
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_lower_priority,
+                )
+            return self._executor
+
+    def _run(self, operation: str, function: Callable[..., T], *args: Any) -> T:
+        labels = (operation,)
+        submitted = time.time()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            if self._rejected is not None:
+                self._rejected.inc(labels)
+            raise PasswordHasherBusy()
+        try:
+            if self.workers == 0:
+                started, result = _timed(function, *args)
+            else:
+                future = self._get_executor().submit(_timed, function, *args)
+                started, result = future.result()
+        finally:
+            self._slots.release()
+        if self._queue_time is not None and self._duration is not None:
+            finished = time.time()
+            self._queue_time.observe(max(0.0, started - submitted), labels)
+            self._duration.observe(max(0.0, finished - started), labels)
+        return result
+
+    def hash(self, password: str) -> str:
+        """
+        :return: the hash to store for a password
+        """
+        return self._run("hash", generate_password_hash, password)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        """
+        :return: whether password matches a stored hash
+        """
+        return self._run("check", check_password_hash, password_hash, password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def get_password_hasher() -> PasswordHasher:
+    hasher: PasswordHasher = current_app.extensions["password_hasher"]
+    return hasher
+
+
+def init_app_passwords(app: Flask) -> None:
+    """
+    Create the password hasher of the app, its worker processes are only
+    started when the first password is hashed. This is called by the
+    application factory, after init_app_metrics.
+    """
+    workers = app.config["PASSWORD_HASH_WORKERS"]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    app.extensions["password_hasher"] = PasswordHasher(
+        workers,
+        app.config["PASSWORD_HASH_MAX_PENDING"],
+        app.config["PASSWORD_HASH_QUEUE_TIMEOUT"],
+        app.extensions.get("metrics"),
+    )
+
+    @app.errorhandler(PasswordHasherBusy)  # type: ignore
+    def password_hasher_busy(error: PasswordHasherBusy) -> Response:
+        response = Response("Too many logins right now, try again shortly.", 503)
+        response.headers["Retry-After"] = str(
+            max(1, round(app.config["PASSWORD_HASH_QUEUE_TIMEOUT"]))
+        )
+        return response
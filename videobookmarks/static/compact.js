@@ -0,0 +1,48 @@
+// Decoding for the compact encoding described in videobookmarks/compact.py.
+// Columns refer to a shared dictionary of strings by index, and columns
+// where every row has the same value are only sent once.
+const COMPACT_JSON = 'application/vnd.videobookmarks.compact+json';
+
+function decodeCompact(payload) {
+    const strings = payload.strings;
+    const columns = Object.entries(payload.columns).map(([name, column]) => {
+        let values;
+        if ('constant' in column) {
+            values = new Array(payload.length).fill(column.constant);
+        } else if ('strings' in column) {
+            values = column.strings.map(i => strings[i]);
+        } else if ('string_lists' in column) {
+            values = column.string_lists.map(indexes => indexes.map(i => strings[i]));
+        } else {
+            values = column.values;
+        }
+        return [name, values];
+    });
+    const rows = [];
+    for (let i = 0; i < payload.length; i++) {
+        const row = {};
+        columns.forEach(([name, values]) => {
+            row[name] = values[i];
+        });
+        rows.push(row);
+    }
+    return rows;
+}
+
+// fetch json, asking for the compact encoding and falling back to plain
+// json if the server doesn't use it. decode turns the compact payload into
+// the plain one, e.g. decodeCompact for the routes that return a list of rows.
+async function fetchCompact(url, decode) {
+    const response = await fetch(url, {
+        method: 'GET',
+        headers: {
+            'Accept': `${COMPACT_JSON}, application/json;q=0.5`
+        }
+    });
+    const data = await response.json();
+    const contentType = response.headers.get('Content-Type') || '';
+    if (contentType.startsWith(COMPACT_JSON)) {
+        return decode(data);
+    }
+    return data;
+}
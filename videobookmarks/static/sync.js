@@ -0,0 +1,120 @@
+// A local copy of a tag list, kept up to date with the /changes route.
+// The first sync downloads a snapshot of the whole tag list, after that only
+// the tags added since the last known version are requested. The changes
+// are asked for in the compact encoding, see compact.js, which sends the
+// link, title and thumbnail of a video once rather than with each tag.
+// Pass a videoId to only keep the tags on that video, so that a page about
+// one video doesn't download the whole tag list.
+class TagListState {
+    constructor(tagListId, videoId = null) {
+        this.tagListId = tagListId;
+        this.videoId = videoId;
+        this.version = null;
+        this.deleted = false;
+        this.tags = [];
+        this.syncing = null;
+        // the details from the "video" events, by video id
+        this.videoDetails = new Map();
+    }
+
+    // bring the local copy up to date, concurrent calls share one request
+    sync() {
+        if (this.syncing === null) {
+            this.syncing = this.fetchChanges().finally(() => {
+                this.syncing = null;
+            });
+        }
+        return this.syncing;
+    }
+
+    async fetchChanges() {
+        const params = new URLSearchParams();
+        if (this.version !== null) {
+            params.set('since', this.version);
+        }
+        if (this.videoId !== null) {
+            params.set('video_id', this.videoId);
+        }
+        const query = params.toString();
+        const url = `/changes/${this.tagListId}${query ? '?' + query : ''}`;
+        const data = await fetchCompact(url, compact => ({
+            ...compact,
+            changes: decodeCompact(compact.changes),
+        }));
+        // a change read before a "video" event still has the old details
+        data.changes.forEach(tag => this.applyVideoDetails(tag));
+        if (data.snapshot) {
+            this.tags = data.changes;
+        } else {
+            this.tags.push(...data.changes);
+        }
+        this.version = data.version;
+        this.deleted = data.deleted;
+    }
+
+    // apply a "video" event, e.g. the title and thumbnail of a new video
+    // once they were fetched in the background, returns whether the tag
+    // list has tags on that video
+    updateVideo(video) {
+        this.videoDetails.set(video.video_id, {
+            title: video.title,
+            thumbnail: video.thumbnail,
+        });
+        const tags = this.tags.filter(tag => tag.video_id === video.video_id);
+        tags.forEach(tag => this.applyVideoDetails(tag));
+        return tags.length > 0;
+    }
+
+    applyVideoDetails(tag) {
+        const details = this.videoDetails.get(tag.video_id);
+        if (details !== undefined) {
+            tag.title = details.title;
+            tag.thumbnail = details.thumbnail;
+        }
+    }
+
+    // the same rows as /get_tags: tags by name, with the videos they are on
+    groupedTags() {
+        const byTag = new Map();
+        this.tags.forEach(tag => {
+            if (!byTag.has(tag.tag)) {
+                byTag.set(tag.tag, { tag: tag.tag, count: 0, links: new Set() });
+            }
+            const grouped = byTag.get(tag.tag);
+            grouped.count += 1;
+            grouped.links.add(tag.link);
+        });
+        return Array.from(byTag.values())
+            .map(grouped => ({ ...grouped, links: Array.from(grouped.links).sort() }))
+            .sort((a, b) => (a.tag < b.tag ? -1 : a.tag > b.tag ? 1 : 0));
+    }
+
+    // the same rows as /get_videos: videos with the most tags first
+    groupedVideos() {
+        const byLink = new Map();
+        this.tags.forEach(tag => {
+            if (!byLink.has(tag.link)) {
+                byLink.set(tag.link, {
+                    link: tag.link,
+                    thumbnail: tag.thumbnail,
+                    title: tag.title,
+                    num_tags: 0,
+                    tags: new Set(),
+                });
+            }
+            const grouped = byLink.get(tag.link);
+            grouped.num_tags += 1;
+            grouped.tags.add(tag.tag);
+        });
+        return Array.from(byLink.values())
+            .map(grouped => ({ ...grouped, tags: Array.from(grouped.tags).sort() }))
+            .sort((a, b) => b.num_tags - a.num_tags);
+    }
+
+    // the same rows as /video_tags: the tags on one video, by timestamp
+    videoTags(videoId) {
+        return this.tags
+            .filter(tag => tag.video_id === videoId)
+            .sort((a, b) => a.youtube_timestamp - b.youtube_timestamp);
+    }
+}
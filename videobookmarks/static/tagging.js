@@ -1,6 +1,7 @@
 const youtubeVideoID = document.getElementById("yt-video-id").value
 const videoID = parseInt(document.getElementById("video-id").value)
 const tagListID = parseInt(document.getElementById("tag-list-id").value)
+const tagListState = new TagListState(tagListID, videoID);
 // This code loads the IFrame Player API code asynchronously.
 var tag = document.createElement('script');
 tag.src = "https://www.youtube.com/iframe_api";
@@ -39,7 +40,15 @@ async function fetchData(endpoint) {
     return data;
 }
 async function refreshSuggestions(tagListId) {
-    const url = `/get_tags/${tagListId}`;
+    const input = document.getElementById('tag-input');
+    const params = new URLSearchParams({
+        prefix: input ? input.value : '',
+        video_id: videoID,
+    });
+    if (player && player.getCurrentTime) {
+        params.set('timestamp', player.getCurrentTime());
+    }
+    const url = `/suggest_tags/${tagListId}?${params}`;
     const [tagData] = await Promise.all([fetchData(url)]);
     // Clear the existing tag suggestions
     const tagSuggestions = document.getElementById('tagSuggestions');
@@ -53,9 +62,19 @@ async function refreshSuggestions(tagListId) {
         tagSuggestions.appendChild(tagSuggestion)
     });
 }
+// refresh the suggestions as the user types, waiting for a short pause
+// in typing so that we don't send a request on every keystroke
+var suggestionTimeout;
+function scheduleSuggestions() {
+    clearTimeout(suggestionTimeout);
+    suggestionTimeout = setTimeout(() => refreshSuggestions(tagListID), 100);
+}
 // handle buttons and form for adding tag
 const tagInput = document.getElementById('tag-input');
 const addTagButton = document.getElementById('add-tag-button');
+if (tagInput) {
+    tagInput.addEventListener('input', scheduleSuggestions);
+}
 if (addTagButton) {
     addTagButton.addEventListener('click', (event) => {
         event.preventDefault()
@@ -120,21 +139,40 @@ function addTag(tagName, time) {
     cell2.appendChild(timestampButton);
 }
 
-// create request to dynamically update tag list when users updates tags
-function refreshTagList(videoId, tagListId) {
-    const url = `/video_tags/${videoId}/${tagListId}`;
+// draw a strip under the player with a cell per bucket of the video,
+// darker where there are more tags, that seeks to the bucket when clicked
+function refreshDensity(videoId, tagListId) {
+    return fetchData(`/tag_density/${videoId}/${tagListId}`)
+    .then(density => {
+        const strip = document.getElementById('tag-density');
+        strip.innerHTML = '';
+        const peak = Math.max(0, ...density.counts);
+        density.counts.forEach((count, bucket) => {
+            const start = bucket * density.bucket_width;
+            const cell = document.createElement('span');
+            cell.style.opacity = peak ? 0.1 + 0.9 * count / peak : 0.1;
+            cell.title = `${formatTime(start)}: ${count} tags`;
+            cell.addEventListener('click', () => {
+                player.seekTo(start, true);
+            });
+            strip.appendChild(cell);
+        });
+    });
+}
 
-    fetch(url)
-    .then(response => response.json())
-    .then(data => {
+// sync the local copy of the tag list and show the tags of this video
+function refreshTagList(videoId, tagListId) {
+    tagListState.sync()
+    .then(() => {
         // Clear the existing tag list (tbody)
         const tagList = document.getElementById('tag-list').getElementsByTagName('tbody')[0];
         tagList.innerHTML = '';
 
         // Process the retrieved data and add tags to the tag list
-        data.forEach(tag => {
+        tagListState.videoTags(videoId).forEach(tag => {
             addTag(tag.tag, tag.youtube_timestamp);
         });
+        return refreshDensity(videoId, tagListId);
     })
     .catch(error => {
       console.error('Error fetching tags:', error);
@@ -142,6 +180,22 @@ function refreshTagList(videoId, tagListId) {
 }
 refreshSuggestions(tagListID);
 
+// show the tags other people add to this video while it is open
+let eventTimeout = null;
+function scheduleRefresh() {
+    clearTimeout(eventTimeout);
+    eventTimeout = setTimeout(() => refreshTagList(videoID, tagListID), 250);
+}
+
+const tagListEvents = new EventSource(`/events/${tagListID}`);
+tagListEvents.addEventListener("tag", (event) => {
+    const data = JSON.parse(event.data);
+    if (data.video_id === videoID && data.version > tagListState.version) {
+        scheduleRefresh();
+    }
+});
+tagListEvents.addEventListener("reset", scheduleRefresh);
+
 // add event listener for timestamp tags
 const tagList = document.getElementById('tag-list');
 tagList.addEventListener('click', (event) => {
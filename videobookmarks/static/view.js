@@ -2,30 +2,17 @@
 const selectedTags = [];
 const selectedVideos = [];
 const tagListId = document.getElementById("tag-list-id").value;
+const tagListState = new TagListState(tagListId);
 
 function hasIntersection(arr1, arr2) {
   return arr1.some(element => arr2.includes(element));
 }
 
-// Function to fetch data from an endpoint with JSON body
-async function fetchData(endpoint, body) {
-    const response = await fetch(endpoint, {
-        method: 'GET'
-    });
-    const data = await response.json();
-    return data;
-}
-
-// Function to update the lists based on selected filters
-async function updateLists() {
-    const tagParams = { videoLinks: selectedVideos };
-    const videoParams = { tags: selectedTags };
-
-    // Fetch filtered data for tags and videos
-    const [tagsData, videosData] = await Promise.all([
-        fetchData(`/get_tags/${tagListId}`),
-        fetchData(`/get_videos/${tagListId}`)
-    ]);
+// Function to update the lists based on selected filters, using the local
+// copy of the tag list
+function updateLists() {
+    const tagsData = tagListState.groupedTags();
+    const videosData = tagListState.groupedVideos();
 
     const list1Content = document.getElementById("list1-content");
     list1Content.innerHTML = ""; // Clear existing content
@@ -166,5 +153,41 @@ tagVideoForm.addEventListener("submit", () => {
     videoIdInput.value = youtube_parser(newVideoLink);
 });
 
+// fetch what changed since the last sync and redraw the lists
+async function syncLists() {
+    await tagListState.sync();
+    if (tagListState.deleted) {
+        tagListEvents.close();
+        window.location.href = "/";
+        return;
+    }
+    updateLists();
+}
+
+// sync when someone else changes this tag list, waiting for a short pause
+// so that a burst of new tags only causes one request
+let eventTimeout = null;
+function scheduleSync() {
+    clearTimeout(eventTimeout);
+    eventTimeout = setTimeout(syncLists, 250);
+}
+
+const tagListEvents = new EventSource(`/events/${tagListId}`);
+tagListEvents.addEventListener("tag", (event) => {
+    // skip the changes that an earlier sync already picked up
+    if (JSON.parse(event.data).version > tagListState.version) {
+        scheduleSync();
+    }
+});
+tagListEvents.addEventListener("reset", scheduleSync);
+// the details of a video are fetched in the background after it is added
+tagListEvents.addEventListener("video", (event) => {
+    if (tagListState.updateVideo(JSON.parse(event.data))) {
+        updateLists();
+    }
+});
+tagListEvents.addEventListener("tag_list_deleted", scheduleSync);
+tagListEvents.addEventListener("tag_list_restored", scheduleSync);
+
 // Initial load with no filters
-updateLists();
\ No newline at end of file
+syncLists();
\ No newline at end of file
@@ -0,0 +1,215 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask
+from flask import current_app
+
+from videobookmarks.datamodel.datamodel import DataModel, TagSuggestion
+
+# past this many candidate names it is cheaper to walk the names in
+# order of popularity than to rank every name that matches the prefix
+RANK_BY_PREFIX_MAX_CANDIDATES = 512
+
+
+class TagSuggestionIndex:
+    """
+    An in memory index of the tag names in a single tag list.
+
+    Names are kept sorted by their lower case form so that every name that
+    starts with a prefix is a contiguous slice that can be found with a
+    binary search, and a second ordering by count lets short prefixes
+    (which match most of the list) stop as soon as `limit` names are found.
+    """
+
+    def __init__(self, tag_counts: Iterable[TagSuggestion]):
+        self._counts: Dict[str, int] = {}
+        for tag_count in tag_counts:
+            self._counts[tag_count.tag] = tag_count.count
+        self._keys: List[Tuple[str, str]] = sorted(
+            (tag.lower(), tag) for tag in self._counts
+        )
+        self._by_count: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, tag: str) -> None:
+        """
+        Record one more use of a tag.
+        """
+        if tag not in self._counts:
+            self._counts[tag] = 0
+            bisect.insort(self._keys, (tag.lower(), tag))
+        self._counts[tag] += 1
+        self._by_count = None
+
+    def suggest(self, prefix: str, limit: int) -> List[TagSuggestion]:
+        """
+        :param prefix: the start of the tag name, case insensitive
+        :param limit: the maximum number of suggestions to return
+        :return: the most used tags that start with the prefix, most
+                used first
+        """
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",))
+        if end - start <= RANK_BY_PREFIX_MAX_CANDIDATES:
+            candidates = (tag for _, tag in self._keys[start:end])
+            best = heapq.nsmallest(
+                limit,
+                candidates,
+                key=lambda tag: (-self._counts[tag], tag),
+            )
+        else:
+            best = []
+            for tag in self._tags_by_count():
+                if tag.lower().startswith(prefix):
+                    best.append(tag)
+                    if len(best) == limit:
+                        break
+        return [TagSuggestion(tag=tag, count=self._counts[tag]) for tag in best]
+
+    def _tags_by_count(self) -> List[str]:
+        if self._by_count is None:
+            self._by_count = sorted(
+                self._counts,
+                key=lambda tag: (-self._counts[tag], tag),
+            )
+        return self._by_count
+
+
+class TagSuggestionCache:
+    """
+    Keeps a TagSuggestionIndex for the most recently used tag lists.
+
+    Tags added through this worker are applied to the cached index straight
+    away, tags added through other workers show up once the entry is older
+    than `ttl` seconds and gets rebuilt from the database.
+    """
+
+    def __init__(self, max_lists: int, ttl: float):
+        self.max_lists = max_lists
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[int, Tuple[float, TagSuggestionIndex]]" = (
+            OrderedDict()
+        )
+        # the tags recorded for the tag lists whose index is being built,
+        # applied to it once it is, None if it was invalidated. A tag that
+        # the build already read is counted twice until the TTL, which only
+        # nudges its rank, rather than missing until then.
+        self._building: Dict[int, List[Optional[str]]] = {}
+        self._builders: Dict[int, int] = {}
+
+    def get(self, datamodel: DataModel, tag_list_id: int) -> TagSuggestionIndex:
+        with self._lock:
+            entry = self._indexes.get(tag_list_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._indexes.move_to_end(tag_list_id)
+                return entry[1]
+            started = time.monotonic()
+            self._building.setdefault(tag_list_id, [])
+            self._builders[tag_list_id] = self._builders.get(tag_list_id, 0) + 1
+        index = None
+        try:
+            # build outside of the lock so one slow list doesn't block the
+            # others
+            index = TagSuggestionIndex(datamodel.get_tag_counts(tag_list_id))
+        finally:
+            with self._lock:
+                added = self._building[tag_list_id]
+                self._builders[tag_list_id] -= 1
+                if self._builders[tag_list_id] == 0:
+                    del self._builders[tag_list_id]
+                    del self._building[tag_list_id]
+                if index is not None:
+                    index = self._keep(tag_list_id, index, added, started)
+        return index
+
+    def _keep(
+        self,
+        tag_list_id: int,
+        index: TagSuggestionIndex,
+        added: List[Optional[str]],
+        started: float,
+    ) -> TagSuggestionIndex:
+        """
+        Apply the tags recorded while the index was being built and keep
+        it, called with the lock held.
+        :return: the index to use
+        """
+        entry = self._indexes.get(tag_list_id)
+        if entry is not None and entry[0] >= started:
+            # built by another request in the meantime, and kept up to date
+            return entry[1]
+        if None in added:
+            return index
+        for tag in added:
+            assert tag is not None
+            index.add(tag)
+        self._indexes[tag_list_id] = (started, index)
+        self._indexes.move_to_end(tag_list_id)
+        while len(self._indexes) > self.max_lists:
+            self._indexes.popitem(last=False)
+        return index
+
+    def suggest(
+        self,
+        datamodel: DataModel,
+        tag_list_id: int,
+        prefix: str,
+        limit: int,
+    ) -> List[TagSuggestion]:
+        index = self.get(datamodel, tag_list_id)
+        # record_tag can modify the index from another request thread
+        with self._lock:
+            return index.suggest(prefix, limit)
+
+    def record_tag(self, tag_list_id: int, tag: str) -> None:
+        """
+        Update the cached index, if there is one, after a tag was added.
+        """
+        with self._lock:
+            building = self._building.get(tag_list_id)
+            if building is not None:
+                building.append(tag)
+            entry = self._indexes.get(tag_list_id)
+            if entry is not None:
+                entry[1].add(tag)
+
+    def invalidate(self, tag_list_id: int) -> None:
+        """
+        Drop the cached index of a tag list, e.g. after many tags were
+        imported, so that it is rebuilt from the database.
+        """
+        with self._lock:
+            building = self._building.get(tag_list_id)
+            if building is not None:
+                building.append(None)
+            self._indexes.pop(tag_list_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for building in self._building.values():
+                building.append(None)
+            self._indexes.clear()
+
+
+def get_suggestion_cache() -> TagSuggestionCache:
+    cache: TagSuggestionCache = current_app.extensions["tag_suggestions"]
+    return cache
+
+
+def init_app_suggestions(app: Flask) -> None:
+    """
+    Create the tag suggestion cache for the Flask app. This is called by
+    the application factory.
+    """
+    app.extensions["tag_suggestions"] = TagSuggestionCache(
+        max_lists=app.config["SUGGESTION_CACHE_MAX_LISTS"],
+        ttl=app.config["SUGGESTION_CACHE_TTL"],
+    )
@@ -1,104 +1,414 @@
-import os
-from typing import Sequence, Union
+import io
+import math
+from typing import Optional, Sequence, Union
 
 from flask import Blueprint, Response
+from flask import current_app
 from flask import flash
 from flask import g
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import stream_with_context
 from flask import url_for
 from werkzeug.exceptions import abort
 
+from videobookmarks import bulk_import
+from videobookmarks import compact
+from videobookmarks import events
+from videobookmarks import export
+from videobookmarks import metrics
 from videobookmarks.authenticate import login_required
-from videobookmarks.datamodel.datamodel import GroupedTag, GroupedVideo, Tag
+from videobookmarks.datamodel.datamodel import (
+    TAG_LIST_SORTS,
+    GroupedTag,
+    GroupedVideo,
+    Tag,
+    TagChange,
+    TagList,
+    TagSuggestion,
+    VideoSearchResult,
+)
 from videobookmarks.db import get_datamodel
-
-import requests  # type: ignore
+from videobookmarks.density import get_tag_density_cache
+from videobookmarks.fragments import cached_page, get_fragment_cache
+from videobookmarks.suggestions import get_suggestion_cache
+from videobookmarks.tag_index import MATCHES, get_tag_index, get_tag_index_cache
+from videobookmarks.video_details import (
+    create_or_load_video_id,
+    get_video_details_resolver,
+)
 
 bp = Blueprint("tag", __name__)
 
-YT_API_KEY = os.getenv("YT_API_KEY")
-if not YT_API_KEY:
-    raise ValueError("YT_API_KEY not set")
-
 TEST_NEW_VIDEO_LINK = "test_new_video_link"
 
+# longer tags would not fit in a tag list event, see videobookmarks.events
+MAX_TAG_LENGTH = 1000
+# the most video ids the youtube api accepts in one call
+YT_MAX_VIDEOS_PER_CALL = 50
+# in seconds, for connecting to the youtube api and for each read
+YT_API_TIMEOUT = 10
+MAX_SUGGESTIONS = 50
+MAX_SEARCH_RESULTS = 50
+MAX_OCCURRENCES = 1000
+# how many seconds either side of the current timestamp count as "near"
+SUGGESTION_WINDOW = 30.0
+
 
-def get_video_details(video_id: str) -> dict[str, str]:
+def get_videos_details(video_ids: Sequence[str]) -> dict[str, dict[str, str]]:
     """
-    Get the title and thumbnail of a youtube video
-    :param video_id: youtube video id
-    :return: dictionary with title and thumbnail_url
+    Get the titles and thumbnails of many youtube videos, with one call to
+    the youtube api for every YT_MAX_VIDEOS_PER_CALL videos
+    :param video_ids: youtube video ids
+    :return: dictionaries with title and thumbnail_url by video id, videos
+            that youtube doesn't know or that are missing either are left out
+    Raises an exception if a call fails, e.g. once the quota is used up, so
+    that the videos aren't taken for unknown ones.
     """
-    if video_id == TEST_NEW_VIDEO_LINK:
-        return {"title": "test_title", "thumbnail_url": "test_thumbnail.url"}
-    base_url = "https://www.googleapis.com/youtube/v3/videos"
-    params = {
-        "part": "snippet",
-        "id": video_id,
-        "key": YT_API_KEY,
-    }
+    details = {}
+    to_fetch = []
+    for video_id in video_ids:
+        if video_id == TEST_NEW_VIDEO_LINK:
+            details[video_id] = {
+                "title": "test_title",
+                "thumbnail_url": "test_thumbnail.url",
+            }
+        else:
+            to_fetch.append(video_id)
+    if not to_fetch:
+        return details
+    # imported when first needed, it takes a while and most requests don't
+    import requests  # type: ignore
 
-    response = requests.get(base_url, params=params)
-    data = response.json()
-    if "items" in data and len(data["items"]) > 0:
-        video = data["items"][0]
-        snippet = video["snippet"]
-        title = snippet.get("title", "")
-        thumbnails = snippet.get("thumbnails", {})
-        thumbnail_url = thumbnails.get("default", {}).get("url", "")
-        if not title:
-            raise ValueError("Missing title")
-        if not thumbnail_url:
-            raise ValueError("Missing thumbnail")
-        return {"title": title, "thumbnail_url": thumbnail_url}
-    else:
-        raise ValueError('data["items"] is empty or missing')
+    base_url = "https://www.googleapis.com/youtube/v3/videos"
+    for start in range(0, len(to_fetch), YT_MAX_VIDEOS_PER_CALL):
+        params = {
+            "part": "snippet",
+            "id": ",".join(to_fetch[start : start + YT_MAX_VIDEOS_PER_CALL]),
+            "key": current_app.config["YT_API_KEY"],
+        }
+        with metrics.external_call("youtube"):
+            response = requests.get(base_url, params=params, timeout=YT_API_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+        if "error" in data:
+            raise ValueError(f"The youtube api returned an error: {data['error']}")
+        for video in data.get("items", []):
+            snippet = video["snippet"]
+            title = snippet.get("title", "")
+            thumbnail_url = snippet.get("thumbnails", {}).get("default", {}).get("url")
+            if title and thumbnail_url:
+                details[video["id"]] = {"title": title, "thumbnail_url": thumbnail_url}
+    return details
 
 
 @bp.route("/")  # type: ignore
 def index() -> str:
     """
     Ask the user to select or create a tag list
+    Query parameters:
+        q: only show the tag lists and videos matching this search
+        sort: the order of the tag lists, see TAG_LIST_SORTS
+        cursor: where the page starts, taken from the "next" link
     """
+    query = request.args.get("q", "").strip()
+    sort = request.args.get("sort", "created")
+    cursor = request.args.get("cursor")
+
+    def render() -> str:
+        datamodel = get_datamodel()
+        next_cursor = None
+        if query:
+            tag_lists = datamodel.search_tag_lists(query, MAX_SEARCH_RESULTS)
+            videos = datamodel.search_videos(query, MAX_SEARCH_RESULTS)
+        else:
+            try:
+                page = datamodel.get_tag_list_page(
+                    sort,
+                    current_app.config["TAG_LIST_PAGE_SIZE"],
+                    cursor,
+                )
+            except ValueError as e:
+                abort(400, str(e))
+            tag_lists = list(page.tag_lists)
+            next_cursor = page.next_cursor
+            videos = []
+        template: str = render_template(
+            "tag_list/index.html",
+            tag_lists=tag_lists,
+            videos=videos,
+            query=query,
+            sort=sort,
+            sorts=TAG_LIST_SORTS,
+            next_cursor=next_cursor,
+        )
+        return template
+
+    # the index shows every tag list, so it depends on all the data
+    return cached_page("tag_list/index.html", (query, sort, cursor), None, render)
+
+
+@bp.route("/search", methods=("GET",))  # type: ignore
+def search() -> dict[str, Sequence[Union[TagList, VideoSearchResult]]]:
+    """
+    Search tag list names and descriptions and video titles
+    Query parameters:
+        q: the search terms
+        limit: the maximum number of tag lists and of videos to return
+    :return: the matching tag lists and videos, best match first
+    """
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", 20, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    if not query:
+        return {"tag_lists": [], "videos": []}
     datamodel = get_datamodel()
-    template: str = render_template(
-        "tag_list/index.html",
-        tag_lists=datamodel.get_tag_lists(),
-    )
-    return template
+    return {
+        "tag_lists": datamodel.search_tag_lists(query, limit),
+        "videos": datamodel.search_videos(query, limit),
+    }
+
+
+@bp.route("/tag_occurrences", methods=("GET",))  # type: ignore
+def find_tag_occurrences() -> Response:
+    """
+    Find where a tag is used, in every tag list that isn't deleted
+    Query parameters:
+        tag: the name of the tag, case sensitive
+        limit: the maximum number of uses on a page
+        cursor: where the page starts, the next_cursor of the previous page
+    :return: a TagOccurrencePage, the uses grouped by tag list and video
+    """
+    tag = request.args.get("tag", "")
+    if not tag:
+        abort(400, "A tag is required.")
+    limit = request.args.get("limit", 100, type=int)
+    limit = max(1, min(limit, MAX_OCCURRENCES))
+    try:
+        page = get_datamodel().find_tag_occurrences(
+            tag, limit, request.args.get("cursor")
+        )
+    except ValueError as e:
+        abort(400, str(e))
+    response: Response = current_app.json.response(page)
+    return response
 
 
 @bp.route("/get_tags/<int:tag_list_id>", methods=("GET",))  # type: ignore
-def get_tag_list_tags(tag_list_id: int) -> Sequence[GroupedTag]:
+def get_tag_list_tags(tag_list_id: int) -> Response:
     """
     :param tag_list_id: id of tag_list to get
-    :return: all the tags in that list
+    :return: all the tags in that list, as json or in the compact encoding
+            of videobookmarks.compact
     """
     datamodel = get_datamodel()
-    return datamodel.get_tag_list_tags(tag_list_id)
+    return compact.respond(GroupedTag, datamodel.get_tag_list_tags(tag_list_id))
 
 
 @bp.route("/get_videos/<int:tag_list_id>", methods=("GET",))  # type: ignore
-def get_tag_list_videos(tag_list_id: int) -> Sequence[GroupedVideo]:
+def get_tag_list_videos(tag_list_id: int) -> Response:
     """
     :param tag_list_id: id of tag_list to get
-    :return: all the videos in that list
+    :return: all the videos in that list, as json or in the compact encoding
+            of videobookmarks.compact
     """
     datamodel = get_datamodel()
-    return datamodel.get_tag_list_videos(tag_list_id)
+    return compact.respond(GroupedVideo, datamodel.get_tag_list_videos(tag_list_id))
 
 
 @bp.route("/video_tags/<int:video_id>/<int:tag_list_id>", methods=("GET",))  # type: ignore
-def get_video_tags(video_id: int, tag_list_id: int) -> Sequence[Tag]:
+def get_video_tags(video_id: int, tag_list_id: int) -> Response:
     """
     :param video_id: id of video to get
     :param tag_list_id: id of tag_list to get
-    :return: all the tags in that list that correspond to that video
+    :return: all the tags in that list that correspond to that video, as json
+            or in the compact encoding of videobookmarks.compact
     """
     datamodel = get_datamodel()
-    return datamodel.get_video_tags(video_id, tag_list_id)
+    return compact.respond(Tag, datamodel.get_video_tags(video_id, tag_list_id))
+
+
+@bp.route("/tag_density/<int:video_id>/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def get_tag_density(video_id: int, tag_list_id: int) -> Response:
+    """
+    The number of tags in each stretch of a video, for the heatmap of the
+    tagging timeline
+    :param video_id: id of video to get
+    :param tag_list_id: id of tag_list to get
+    Query parameters:
+        width: the length of the buckets in seconds, they are made wider
+                for long videos
+        by_tag: 1 to also get the counts of the most used tag names
+    :return: a TagDensity
+    """
+    width = request.args.get(
+        "width", current_app.config["TAG_DENSITY_BUCKET_WIDTH"], type=float
+    )
+    if not math.isfinite(width) or width <= 0:
+        abort(400, "The bucket width must be positive.")
+    max_tags = 0
+    if request.args.get("by_tag", "0") == "1":
+        max_tags = current_app.config["TAG_DENSITY_MAX_TAGS"]
+    density = get_tag_density_cache().get(
+        get_datamodel(), video_id, tag_list_id, width, max_tags
+    )
+    if density is None:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    response: Response = current_app.json.response(density)
+    return response
+
+
+@bp.route("/filter/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def filter_tag_list(tag_list_id: int) -> Response:
+    """
+    Filter the videos of a tag list by their tags, and the tags by their
+    videos, from an in memory index, see videobookmarks.tag_index
+    :param tag_list_id: id of tag_list to filter
+    Query parameters:
+        tag: a selected tag name, repeated for each of them
+        video: the Youtube ID of a selected video, repeated for each of them
+        match: "any" (the default) for the videos with any of the tags and
+                the tags of any of the videos, "all" for the ones with all
+                of them
+        limit: the maximum number of videos and of tags to list, 0 to only
+                count them
+    :return: a TagFilterResult
+    """
+    match = request.args.get("match", "any")
+    if match not in MATCHES:
+        abort(400, f"Unknown match {match!r}.")
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 0:
+        abort(400, "The limit can't be negative.")
+    index = get_tag_index(tag_list_id)
+    if index is None:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    result = index.filter(
+        request.args.getlist("tag"), request.args.getlist("video"), match, limit
+    )
+    response: Response = current_app.json.response(result)
+    return response
+
+
+@bp.route("/suggest_tags/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def suggest_tags(tag_list_id: int) -> Sequence[TagSuggestion]:
+    """
+    Suggest tag names while a user is typing a new tag
+    :param tag_list_id: id of tag_list to get suggestions from
+    Query parameters:
+        prefix: what the user has typed so far, case insensitive
+        limit: the maximum number of suggestions
+        video_id, timestamp: optional, tags used on this video close to
+                this timestamp are suggested first
+    :return: tag names and their counts, most used first
+    """
+    prefix = request.args.get("prefix", "")
+    limit = request.args.get("limit", 10, type=int)
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+    video_id = request.args.get("video_id", type=int)
+    timestamp = request.args.get("timestamp", type=float)
+    datamodel = get_datamodel()
+    suggestions: list[TagSuggestion] = []
+    if video_id is not None and timestamp is not None:
+        suggestions.extend(
+            datamodel.get_tag_suggestions_near(
+                tag_list_id,
+                video_id,
+                timestamp,
+                SUGGESTION_WINDOW,
+                prefix,
+                limit,
+            )
+        )
+    if len(suggestions) < limit:
+        seen = {suggestion.tag for suggestion in suggestions}
+        # ask for extra in case some of them were already suggested
+        for suggestion in get_suggestion_cache().suggest(
+            datamodel, tag_list_id, prefix, limit + len(seen)
+        ):
+            if suggestion.tag not in seen:
+                suggestions.append(suggestion)
+    return suggestions[:limit]
+
+
+@bp.route("/changes/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def tag_list_changes(tag_list_id: int) -> Response:
+    """
+    Get the tags added to a tag list since a version the client already has,
+    so that it can keep its own copy of the tag list up to date
+    :param tag_list_id: id of tag_list to sync
+    Query parameters:
+        since: the version returned by the previous call, leave it out
+                to get a snapshot of the whole tag list
+        video_id: only the tags on this video, the tagging page of a video
+                doesn't need the rest of the tag list
+    :return: a TagListChanges, with its changes as json or in the compact
+            encoding of videobookmarks.compact
+    """
+    since = request.args.get("since", type=int)
+    video_id = request.args.get("video_id", type=int)
+    changes = get_datamodel().get_tag_list_changes(
+        tag_list_id, since, current_app.config["TAG_LIST_MAX_CHANGES"], video_id
+    )
+    if changes is None:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    return compact.respond_with_rows(changes, "changes", TagChange)
+
+
+@bp.route("/events/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def tag_list_events(tag_list_id: int) -> Response:
+    """
+    A Server-Sent Events stream of the changes to a tag list, see
+    videobookmarks.events for the events that are sent
+    :param tag_list_id: id of tag_list to follow
+    """
+    broker = events.get_event_broker()
+    subscription = broker.subscribe(tag_list_id)
+    # the stream doesn't use the request context, so it is torn down (and
+    # the database connection of this request closed) as soon as we return
+    return Response(
+        events.stream_events(
+            broker,
+            subscription,
+            current_app.config["EVENTS_HEARTBEAT_SECONDS"],
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/export/<int:tag_list_id>", methods=("GET",))  # type: ignore
+def export_tag_list(tag_list_id: int) -> Response:
+    """
+    Download every tag in a tag list, streamed while it is read from the
+    database
+    :param tag_list_id: id of tag_list to export
+    Query parameters:
+        format: csv (the default) or jsonl
+    :return: the tags in the order they were added, with their videos
+    """
+    format = request.args.get("format", "csv")
+    if format not in export.FORMATS:
+        abort(400, f"Unknown export format {format!r}.")
+    mimetype, extension, encode = export.FORMATS[format]
+    datamodel = get_datamodel()
+    tag_list = datamodel.get_tag_list(tag_list_id)
+    if tag_list is None or tag_list.deleted:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    batch_size = current_app.config["EXPORT_BATCH_SIZE"]
+    tags = datamodel.export_tag_list(tag_list_id, batch_size)
+    # keeps the request context, and with it the database connection,
+    # until the whole export has been sent
+    return Response(
+        stream_with_context(encode(tags, batch_size)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=tag_list_{tag_list_id}.{extension}"
+            )
+        },
+    )
 
 
 @bp.route("/create", methods=("GET", "POST"))  # type: ignore
@@ -116,35 +426,16 @@ def create() -> Union[str, Response]:
             flash(error)
         else:
             datamodel = get_datamodel()
-            datamodel.create_tag_list(name, description, user_id)
+            tag_list_id = datamodel.create_tag_list(name, description, user_id)
+            get_fragment_cache().bump(tag_list_id)
             return redirect(url_for("tag.index"))
 
     return render_template("tag_list/create.html")
 
 
-def create_or_load_yt_video_id(yt_link: str) -> int:
-    """
-    :param yt_link: youtube link
-    :return: video_id as it is stored in our database
-    Check if the youtube video is already in our database, if not, add it
-    """
-    datamodel = get_datamodel()
-    video_id = datamodel.load_video_id(yt_link)
-    if not video_id:
-        video_details = get_video_details(yt_link)
-        video_id = datamodel.create_video_id(
-            yt_link,
-            video_details["thumbnail_url"],
-            video_details["title"],
-        )
-    if video_id is None:
-        raise ValueError("video_id is None")
-    return video_id
-
-
 @bp.route("/add_tag", methods=("POST",))  # type: ignore
 @login_required  # type: ignore
-def add_tag() -> Union[Response, dict[str, int]]:
+def add_tag() -> Union[Response, dict[str, Optional[int]]]:
     """
     Add a new tag to a video
     """
@@ -156,22 +447,71 @@ def add_tag() -> Union[Response, dict[str, int]]:
     error = None
     if not tag:
         error = "Tag is required."
+    elif len(tag) > MAX_TAG_LENGTH:
+        error = f"Tags can't be longer than {MAX_TAG_LENGTH} characters."
     if error is not None:
         return Response(422)
     else:
-        video_id = create_or_load_yt_video_id(yt_video_id)
-        datamodel = get_datamodel()
-        tag_id = datamodel.add_tag(
-            tag,
-            timestamp,
-            tag_list_id,
-            video_id,
-            user_id,
-        )
+        video_id = create_or_load_video_id(yt_video_id)
+        try:
+            tag_id = get_datamodel().add_tag(
+                tag,
+                timestamp,
+                tag_list_id,
+                video_id,
+                user_id,
+            )
+        except KeyError:
+            abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+        get_suggestion_cache().record_tag(tag_list_id, tag)
+        get_tag_index_cache().record_tag(tag_list_id, tag, yt_video_id)
+        get_fragment_cache().bump(tag_list_id)
         # TODO: why does this need to return a json? js keeps throwing an error otherwise
         return {"id": tag_id}
 
 
+@bp.route("/import/<int:tag_list_id>", methods=("POST",))  # type: ignore
+@login_required  # type: ignore
+def import_tags(tag_list_id: int) -> Response:
+    """
+    Import many tags from a csv file, see videobookmarks.bulk_import
+    :param tag_list_id: id of tag list to add the tags to
+    The file is either the body of the request, with the text/csv content
+    type, or the "file" field of a multipart form.
+    :return: how many tags were imported and which rows were rejected
+    """
+    datamodel = get_datamodel()
+    tag_list = datamodel.get_tag_list(tag_list_id)
+    if tag_list is None or tag_list.deleted:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    if g.user.id != tag_list.user_id:
+        abort(403, "You are not authorized to add tags to this tag list")
+    if request.mimetype == "text/csv":
+        # read while it is received rather than loaded into memory first
+        stream = request.stream
+    elif "file" in request.files:
+        stream = request.files["file"].stream
+    else:
+        abort(400, "Send a text/csv body or a multipart form with a file.")
+    lines = io.TextIOWrapper(stream, encoding="utf-8", newline="")  # type: ignore
+    try:
+        report = bulk_import.import_csv(
+            datamodel,
+            tag_list_id,
+            g.user.id,
+            lines,
+            get_video_details_resolver().provider,
+            MAX_TAG_LENGTH,
+        )
+    except UnicodeDecodeError:
+        abort(400, "The file is not utf-8 encoded.")
+    get_suggestion_cache().invalidate(tag_list_id)
+    get_tag_index_cache().invalidate(tag_list_id)
+    get_fragment_cache().bump(tag_list_id)
+    response: Response = current_app.json.response(report)
+    return response
+
+
 @bp.route("/delete_tag_list/<int:tag_list_id>", methods=("DELETE",))  # type: ignore
 @login_required  # type: ignore
 def delete_tag_list(tag_list_id: int) -> Union[Response, str]:
@@ -198,6 +538,7 @@ def delete_tag_list(tag_list_id: int) -> Union[Response, str]:
         abort(Response(response=[error], status=403))
     try:
         deleted_tag_list_id = datamodel.delete_tag_list(tag_list_id)
+        get_fragment_cache().bump(tag_list_id)
         return Response(
             response=[f"deleted tag_list id: {deleted_tag_list_id}"],
             status=200,
@@ -217,8 +558,8 @@ def tagging(tag_list_id: int, yt_video_id: str) -> str:
     datamodel = get_datamodel()
     tag_list = datamodel.get_tag_list(tag_list_id)
     if tag_list is None:
-        abort(404, f"Tag list id {id} doesn't exist.")
-    video_id = create_or_load_yt_video_id(yt_video_id)
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    video_id = create_or_load_video_id(yt_video_id)
     template: str = render_template(
         "tag_list/tagging.html",
         tag_list=tag_list,
@@ -236,10 +577,17 @@ def view_tag_list(tag_list_id: int) -> Union[Response, str]:
     :param tag_list_id: id of tag list to view
     :return: the view page or the tagging page if the user submits a new video
     """
+    if request.method == "GET":
+        return cached_page(
+            "tag_list/view.html",
+            (),
+            tag_list_id,
+            lambda: render_view_tag_list(tag_list_id),
+        )
     datamodel = get_datamodel()
     tag_list = datamodel.get_tag_list(tag_list_id)
     if tag_list is None:
-        abort(404, f"Tag list id {id} doesn't exist.")
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
     if request.method == "POST":
         yt_video_id = request.form["new_video_id"]
         error = None
@@ -251,7 +599,15 @@ def view_tag_list(tag_list_id: int) -> Union[Response, str]:
             flash(error)
         else:
             return redirect(f"/tagging/{tag_list.id}/{yt_video_id}")  # type: ignore
-    return render_template(
+    return render_view_tag_list(tag_list_id)
+
+
+def render_view_tag_list(tag_list_id: int) -> str:
+    tag_list = get_datamodel().get_tag_list(tag_list_id)
+    if tag_list is None:
+        abort(404, f"Tag list id {tag_list_id} doesn't exist.")
+    template: str = render_template(
         "tag_list/view.html",
         tag_list=tag_list,
     )
+    return template
@@ -0,0 +1,405 @@
+"""
+An in memory index of which tags are used on which videos of a tag list,
+for filtering the videos of a tag list by their tags, and the tags by their
+videos, on the server.
+
+Each tag list's index hands out its own positions to its tag names and
+videos, in the order they are first seen. Every tag name has a bitmap of
+the videos it is used on and every video a bitmap of its tag names. The
+bitmaps are python ints, so the AND/OR of a filter and its counts are done
+a machine word at a time, in C, and since the positions are dense they stay
+small: a tag name of a list of 10000 videos takes at most 1.25kB.
+
+An index is built from the database the first time its tag list is
+filtered, then kept up to date from the tags added through this worker and
+the tag list events (see videobookmarks.events), which carry the tags added
+through every worker. Like the page cache, the indexes are only kept while
+the events connection is up. The least recently used tag lists are dropped
+once the indexes take more than TAG_INDEX_MAX_BYTES.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from flask import Flask
+from flask import current_app
+
+from videobookmarks.datamodel.datamodel import TagVideoPair
+from videobookmarks.db import get_datamodel
+from videobookmarks.events import Event, get_event_broker
+
+# how the selected tags (or videos) of a filter are combined
+MATCH_ANY = "any"
+MATCH_ALL = "all"
+MATCHES = (MATCH_ANY, MATCH_ALL)
+
+
+@dataclass(frozen=True)
+class TagFilterResult:
+    """
+    The result of filtering a tag list, see TagVideoIndex.filter.
+        videos: the Youtube IDs of the videos that have the selected tags,
+                sorted, up to the limit
+        tags: the tags used on the selected videos, sorted, up to the limit
+        num_videos: how many videos there are without the limit
+        num_tags: how many tags there are without the limit
+    """
+
+    videos: Sequence[str]
+    tags: Sequence[str]
+    num_videos: int
+    num_tags: int
+
+
+def _bitmap(positions: Iterable[int]) -> int:
+    bits = bytearray()
+    for position in positions:
+        index = position >> 3
+        if index >= len(bits):
+            bits.extend(bytes(index + 1 - len(bits)))
+        bits[index] |= 1 << (position & 7)
+    return int.from_bytes(bits, "little")
+
+
+# the set bits of each byte
+_BYTE_POSITIONS = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)]
+
+
+def _positions(bitmap: int) -> Iterator[int]:
+    # a byte at a time, rather than a big int operation per bit
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        if byte:
+            for bit in _BYTE_POSITIONS[byte]:
+                yield (index << 3) + bit
+
+
+def _count(bitmap: int) -> int:
+    # int.bit_count needs python 3.10
+    return bin(bitmap).count("1")
+
+
+class TagVideoIndex:
+    """
+    The tag names and videos of a single tag list, and which of them are
+    used together.
+    """
+
+    def __init__(self, pairs: Iterable[TagVideoPair]):
+        # add is called by the request and event threads while others filter
+        self._lock = threading.Lock()
+        self._tags: List[str] = []
+        self._tag_positions: Dict[str, int] = {}
+        self._videos: List[str] = []
+        self._video_positions: Dict[str, int] = {}
+        videos_of: List[List[int]] = []
+        tags_of: List[List[int]] = []
+        for pair in pairs:
+            tag = self._tag_positions.get(pair.tag)
+            if tag is None:
+                tag = self._tag_positions[pair.tag] = len(self._tags)
+                self._tags.append(pair.tag)
+                videos_of.append([])
+            video = self._video_positions.get(pair.link)
+            if video is None:
+                video = self._video_positions[pair.link] = len(self._videos)
+                self._videos.append(pair.link)
+                tags_of.append([])
+            videos_of[tag].append(video)
+            tags_of[video].append(tag)
+        # by the position of each tag name, the videos it is used on
+        self._videos_of = [_bitmap(videos) for videos in videos_of]
+        # by the position of each video, the tag names used on it
+        self._tags_of = [_bitmap(tags) for tags in tags_of]
+        self.nbytes = (
+            sum(sys.getsizeof(tag) for tag in self._tags)
+            + sum(sys.getsizeof(video) for video in self._videos)
+            + sum(sys.getsizeof(bitmap) for bitmap in self._videos_of)
+            + sum(sys.getsizeof(bitmap) for bitmap in self._tags_of)
+        )
+
+    @property
+    def num_tags(self) -> int:
+        return len(self._tags)
+
+    @property
+    def num_videos(self) -> int:
+        return len(self._videos)
+
+    def add(self, tag: str, link: str) -> None:
+        """
+        Record that a tag name was used on a video.
+        """
+        with self._lock:
+            self._add(tag, link)
+
+    def _add(self, tag: str, link: str) -> None:
+        position = self._tag_positions.get(tag)
+        if position is None:
+            position = self._tag_positions[tag] = len(self._tags)
+            self._tags.append(tag)
+            self._videos_of.append(0)
+            self.nbytes += sys.getsizeof(tag) + sys.getsizeof(0)
+        video = self._video_positions.get(link)
+        if video is None:
+            video = self._video_positions[link] = len(self._videos)
+            self._videos.append(link)
+            self._tags_of.append(0)
+            self.nbytes += sys.getsizeof(link) + sys.getsizeof(0)
+        videos = self._videos_of[position] | (1 << video)
+        tags = self._tags_of[video] | (1 << position)
+        self.nbytes += (
+            sys.getsizeof(videos)
+            - sys.getsizeof(self._videos_of[position])
+            + sys.getsizeof(tags)
+            - sys.getsizeof(self._tags_of[video])
+        )
+        self._videos_of[position] = videos
+        self._tags_of[video] = tags
+
+    def filter(
+        self,
+        tags: Sequence[str],
+        videos: Sequence[str],
+        match: str = MATCH_ANY,
+        limit: Optional[int] = None,
+    ) -> TagFilterResult:
+        """
+        :param tags: the selected tag names, no tags selects every video
+        :param videos: the Youtube IDs of the selected videos, no videos
+                selects every tag name
+        :param match: MATCH_ANY for the videos with any of the tags and the
+                tags of any of the videos, MATCH_ALL for the videos with all
+                of the tags and the tags on all of the videos
+        :param limit: the maximum number of videos and of tags to return,
+                0 to only count them
+        """
+        if match not in MATCHES:
+            raise ValueError(f"Unknown match {match!r}")
+        with self._lock:
+            video_bitmap = self._match(
+                tags, self._tag_positions, self._videos_of, len(self._videos), match
+            )
+            tag_bitmap = self._match(
+                videos, self._video_positions, self._tags_of, len(self._tags), match
+            )
+        # the names are only ever appended, so the positions of the bitmaps
+        # still have theirs
+        return TagFilterResult(
+            videos=self._names(self._videos, video_bitmap, limit),
+            tags=self._names(self._tags, tag_bitmap, limit),
+            num_videos=_count(video_bitmap),
+            num_tags=_count(tag_bitmap),
+        )
+
+    @staticmethod
+    def _names(names: List[str], bitmap: int, limit: Optional[int]) -> List[str]:
+        if limit == 0:
+            return []
+        return sorted(names[position] for position in _positions(bitmap))[:limit]
+
+    @staticmethod
+    def _match(
+        names: Sequence[str],
+        positions: Dict[str, int],
+        bitmaps: List[int],
+        size: int,
+        match: str,
+    ) -> int:
+        """
+        :param size: how many bits the bitmaps have
+        :return: the OR (MATCH_ANY) or AND (MATCH_ALL) of the bitmaps of the
+                names, all bits set without names
+        """
+        if not names:
+            return (1 << size) - 1
+        selected = [
+            bitmaps[positions[name]] if name in positions else 0 for name in names
+        ]
+        result = selected[0]
+        for bitmap in selected[1:]:
+            if match == MATCH_ALL:
+                result &= bitmap
+            else:
+                result |= bitmap
+        return result
+
+
+class TagIndexCache:
+    """
+    Keeps the TagVideoIndex of the most recently used tag lists, bounded by
+    the total of their TagVideoIndex.nbytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[int, TagVideoIndex]" = OrderedDict()
+        self._size = 0
+        # the tags added to the tag lists whose index is being built, applied
+        # to it once it is, None if it was reset
+        self._building: Dict[int, List[Optional[TagVideoPair]]] = {}
+        self._builders: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(
+        self,
+        tag_list_id: int,
+        load: Callable[[], Optional[Iterable[TagVideoPair]]],
+        keep: bool = True,
+    ) -> Optional[TagVideoIndex]:
+        """
+        :param load: reads the pairs of the tag list from the database,
+                returns None if the tag list doesn't exist
+        :param keep: whether to keep the index if it has to be built
+        :return: None if the tag list doesn't exist
+        """
+        with self._lock:
+            index = self._indexes.get(tag_list_id)
+            if index is not None:
+                self._indexes.move_to_end(tag_list_id)
+                return index
+            if keep:
+                self._building.setdefault(tag_list_id, [])
+                self._builders[tag_list_id] = self._builders.get(tag_list_id, 0) + 1
+        index = None
+        try:
+            pairs = load()
+            index = None if pairs is None else TagVideoIndex(pairs)
+        finally:
+            if keep:
+                # in one go, so that no tag is recorded after the ones added
+                # during the build are applied and before the index is kept
+                with self._lock:
+                    added = self._building[tag_list_id]
+                    self._builders[tag_list_id] -= 1
+                    if self._builders[tag_list_id] == 0:
+                        del self._builders[tag_list_id]
+                        del self._building[tag_list_id]
+                    if index is not None:
+                        index = self._keep(tag_list_id, index, added)
+        return index
+
+    def _keep(
+        self,
+        tag_list_id: int,
+        index: TagVideoIndex,
+        added: List[Optional[TagVideoPair]],
+    ) -> TagVideoIndex:
+        """
+        Apply the tags added while the index was being built and keep it,
+        called with the lock held.
+        :return: the index to use
+        """
+        existing = self._indexes.get(tag_list_id)
+        if existing is not None:
+            # built by another request in the meantime, and kept up to date
+            return existing
+        if None in added:
+            return index
+        for pair in added:
+            assert pair is not None
+            index.add(pair.tag, pair.link)
+        if index.nbytes > self.max_bytes:
+            return index
+        self._indexes[tag_list_id] = index
+        self._size += index.nbytes
+        while self._size > self.max_bytes:
+            _, evicted = self._indexes.popitem(last=False)
+            self._size -= evicted.nbytes
+        return index
+
+    def record_tag(self, tag_list_id: int, tag: str, link: str) -> None:
+        """
+        Update the index of a tag list, if there is one, after a tag was
+        added to it.
+        """
+        with self._lock:
+            building = self._building.get(tag_list_id)
+            if building is not None:
+                building.append(TagVideoPair(tag=tag, link=link))
+            index = self._indexes.get(tag_list_id)
+            if index is not None:
+                self._size -= index.nbytes
+                index.add(tag, link)
+                self._size += index.nbytes
+
+    def invalidate(self, tag_list_id: int) -> None:
+        """
+        Drop the index of a tag list, e.g. after many tags were imported, so
+        that it is rebuilt from the database.
+        """
+        with self._lock:
+            building = self._building.get(tag_list_id)
+            if building is not None:
+                building.append(None)
+            index = self._indexes.pop(tag_list_id, None)
+            if index is not None:
+                self._size -= index.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            for building in self._building.values():
+                building.append(None)
+            self._indexes.clear()
+            self._size = 0
+
+    def handle_event(self, event: Event) -> None:
+        """
+        EventBroker listener, applies the tags added by any worker process.
+        """
+        tag_list_id = event.get("tag_list_id")
+        if tag_list_id is None:
+            if event["type"] == "reset":
+                self.clear()
+        elif event["type"] == "tag":
+            self.record_tag(tag_list_id, event["tag"], event["link"])
+        elif event["type"] != "tag_list_created":
+            # reset, tag_list_deleted and tag_list_restored
+            self.invalidate(tag_list_id)
+
+
+def get_tag_index_cache() -> TagIndexCache:
+    cache: TagIndexCache = current_app.extensions["tag_index"]
+    return cache
+
+
+def get_tag_index(tag_list_id: int) -> Optional[TagVideoIndex]:
+    """
+    The index of a tag list, from the cache while the tag list events are
+    followed.
+    :return: None if the tag list doesn't exist or is deleted
+    """
+
+    def load() -> Optional[Sequence[TagVideoPair]]:
+        datamodel = get_datamodel()
+        tag_list = datamodel.get_tag_list(tag_list_id)
+        if tag_list is None or tag_list.deleted:
+            return None
+        return datamodel.get_tag_video_pairs(tag_list_id)
+
+    cache = get_tag_index_cache()
+    broker = get_event_broker()
+    broker.start()
+    keep = cache.max_bytes > 0 and broker.listening
+    return cache.get(tag_list_id, load, keep)
+
+
+def init_app_tag_index(app: Flask) -> None:
+    """
+    Create the tag index cache for the Flask app and have it follow the tag
+    list events. This is called by the application factory, after
+    init_app_events.
+    """
+    cache = TagIndexCache(app.config["TAG_INDEX_MAX_BYTES"])
+    app.extensions["tag_index"] = cache
+    app.extensions["event_broker"].add_listener(cache.handle_event)
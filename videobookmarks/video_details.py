@@ -0,0 +1,382 @@
+"""
+Fetching the title and thumbnail of new videos in the background.
+
+The first visit to a video that isn't in the database used to wait for the
+youtube api before the video could be inserted. Instead, it is now inserted
+right away with placeholder details, and details_pending set. The
+placeholder title is its Youtube ID, and the placeholder thumbnail is the
+default url that youtube uses for nearly every video. A VideoDetailsResolver
+then fetches the real details in VIDEO_DETAILS_WORKERS background threads:
+
+- the videos queued while a call is in flight are fetched together, up to
+  the YT_MAX_VIDEOS_PER_CALL that one call of the youtube api accepts
+- the workers make at most VIDEO_DETAILS_MAX_CALLS_PER_SECOND calls
+  between them
+- a call that fails is retried up to VIDEO_DETAILS_MAX_ATTEMPTS times, after
+  VIDEO_DETAILS_RETRY_DELAY seconds, doubled after every attempt
+- the first time the threads start, they also queue the videos that a
+  worker process left pending when it stopped
+
+Storing the details sends a "video" event, which updates the cached pages.
+VIDEO_DETAILS_PROVIDER says where the details come from: "youtube", "fake"
+(fake_video_details, for working without a youtube api key), or any
+VideoResolver function. With VIDEO_DETAILS_WORKERS = 0 the details are
+fetched on the request thread, in a single attempt.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from flask import Flask
+from flask import current_app
+
+from videobookmarks.datamodel.datamodel import VideoResolver
+from videobookmarks.metrics import Counter, Gauge, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# the most pending videos queued when the threads start
+MAX_RECOVERED_VIDEOS = 1000
+
+
+def placeholder_details(link: str) -> Dict[str, str]:
+    """
+    :return: the title and thumbnail_url a video has until its details are
+            fetched
+    """
+    return {
+        "title": link,
+        "thumbnail_url": f"https://i.ytimg.com/vi/{link}/default.jpg",
+    }
+
+
+def fake_video_details(links: Sequence[str]) -> Dict[str, Dict[str, str]]:
+    """
+    A VideoResolver that makes up the details of every video without any
+    external calls, for local development.
+    """
+    return {
+        link: {
+            "title": f"Video {link}",
+            "thumbnail_url": placeholder_details(link)["thumbnail_url"],
+        }
+        for link in links
+    }
+
+
+def youtube_video_details(links: Sequence[str]) -> Dict[str, Dict[str, str]]:
+    from videobookmarks.tag import get_videos_details
+
+    return get_videos_details(links)
+
+
+PROVIDERS: Dict[str, VideoResolver] = {
+    "youtube": youtube_video_details,
+    "fake": fake_video_details,
+}
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most calls_per_second are started, across
+    all the threads that share it.
+    """
+
+    def __init__(self, calls_per_second: Optional[float]):
+        """
+        :param calls_per_second: None for no limit
+        """
+        self.interval = 1 / calls_per_second if calls_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class VideoDetailsResolver:
+    """
+    Queues the videos created with placeholder details, and fills in their
+    details from background threads, which are started with the first video
+    so that they run in the worker process.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        provider: VideoResolver,
+        workers: int,
+        max_calls_per_second: Optional[float],
+        max_attempts: int,
+        retry_delay: float,
+        batch_size: int,
+        registry: Optional[MetricsRegistry] = None,
+    ):
+        """
+        :param app: whose database the details are stored in
+        :param provider: fetches the details of many videos at once
+        :param workers: how many threads fetch details, 0 to fetch them on
+                the thread that queues the video instead
+        :param max_attempts: how many times a video is fetched before it is
+                left pending
+        :param retry_delay: seconds before the first retry, doubled after
+                every attempt
+        :param batch_size: the most videos fetched with one call
+        :param registry: where to count the fetched and failed videos
+        """
+        self.app = app
+        self.provider = provider
+        self.workers = workers
+        self.rate_limiter = RateLimiter(max_calls_per_second)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self._condition = threading.Condition()
+        # (due time, attempt, video_id, link)
+        self._queue: List[Tuple[float, int, int, str]] = []
+        # the ids in _queue or being fetched, so that a video is queued once
+        self._queued: Set[int] = set()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self._recovering = False
+        self._videos: Optional[Counter] = None
+        self._calls: Optional[Counter] = None
+        if registry is not None:
+            self._videos = registry.add(
+                Counter(
+                    "videobookmarks_video_details_total",
+                    "Videos whose details were fetched, by result.",
+                    ["result"],
+                )
+            )
+            self._calls = registry.add(
+                Counter(
+                    "videobookmarks_video_details_calls_total",
+                    "Calls to the video details provider, by outcome.",
+                    ["outcome"],
+                )
+            )
+            registry.add(
+                Gauge(
+                    "videobookmarks_video_details_queued",
+                    "Videos waiting for their details to be fetched.",
+                    function=lambda: len(self._queued),
+                )
+            )
+
+    def submit(self, video_id: int, link: str) -> None:
+        """
+        Fetch the details of a video created with placeholder details.
+        """
+        if self.workers == 0:
+            self._resolve([(0.0, 1, video_id, link)])
+            return
+        with self._condition:
+            if not self._threads:
+                self._start()
+            self._push(time.monotonic(), 1, video_id, link)
+
+    def _push(self, due: float, attempt: int, video_id: int, link: str) -> None:
+        if video_id in self._queued or self._closed:
+            return
+        self._queued.add(video_id)
+        heapq.heappush(self._queue, (due, attempt, video_id, link))
+        self._condition.notify()
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"video-details-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        self._recovering = True
+        threading.Thread(
+            target=self._recover, name="video-details-recover", daemon=True
+        ).start()
+
+    def _recover(self) -> None:
+        from videobookmarks.db import get_datamodel
+
+        pending = []
+        try:
+            with self.app.app_context():
+                pending = get_datamodel().get_pending_videos(MAX_RECOVERED_VIDEOS)
+        except Exception:
+            logger.exception("Could not load the videos with pending details")
+        with self._condition:
+            now = time.monotonic()
+            for video in pending:
+                self._push(now, 1, video.id, video.link)
+            self._recovering = False
+
+    def _next_batch(self) -> List[Tuple[float, int, int, str]]:
+        """
+        Wait for videos that are due.
+        :return: up to batch_size of them, empty once closed
+        """
+        with self._condition:
+            while not self._closed:
+                if self._queue:
+                    wait = self._queue[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            if self._closed:
+                return []
+            batch = []
+            now = time.monotonic()
+            while self._queue and self._queue[0][0] <= now:
+                batch.append(heapq.heappop(self._queue))
+                if len(batch) == self.batch_size:
+                    break
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self.rate_limiter.wait()
+            self._resolve(batch)
+
+    def _resolve(self, batch: List[Tuple[float, int, int, str]]) -> None:
+        from videobookmarks.db import get_datamodel
+
+        links = [link for _, _, _, link in batch]
+        with self.app.app_context():
+            try:
+                details = self.provider(links)
+            except Exception:
+                logger.exception("Could not fetch the details of %d videos", len(links))
+                self._count(self._calls, "error")
+                self._retry(batch)
+                return
+            self._count(self._calls, "ok")
+            datamodel = get_datamodel()
+            for _, _, video_id, link in batch:
+                video = details.get(link)
+                try:
+                    if video is None:
+                        # youtube doesn't know it, keep the placeholders
+                        datamodel.set_video_details(video_id, None, None)
+                        self._count(self._videos, "unknown")
+                    else:
+                        datamodel.set_video_details(
+                            video_id, video["thumbnail_url"], video["title"]
+                        )
+                        self._count(self._videos, "resolved")
+                except Exception:
+                    logger.exception(
+                        "Could not store the details of video %d", video_id
+                    )
+                    self._count(self._videos, "failed")
+                with self._condition:
+                    self._queued.discard(video_id)
+
+    def _retry(self, batch: List[Tuple[float, int, int, str]]) -> None:
+        with self._condition:
+            for _, attempt, video_id, link in batch:
+                self._queued.discard(video_id)
+                if attempt >= self.max_attempts or self.workers == 0:
+                    logger.warning(
+                        "Gave up fetching the details of video %d after %d attempts",
+                        video_id,
+                        attempt,
+                    )
+                    self._count(self._videos, "failed")
+                    continue
+                self._count(self._videos, "retried")
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                self._push(time.monotonic() + delay, attempt + 1, video_id, link)
+
+    @staticmethod
+    def _count(counter: Optional[Counter], label: str) -> None:
+        if counter is not None:
+            counter.inc((label,))
+
+    def wait_until_idle(self, timeout: float) -> bool:
+        """
+        Wait until every queued video has been fetched, or given up on.
+        :return: False if the timeout expired first
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if not self._queued and not self._recovering:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        """
+        Stop the threads, the videos still queued stay pending in the
+        database and are queued again by the next worker process.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+def get_video_details_resolver() -> VideoDetailsResolver:
+    resolver: VideoDetailsResolver = current_app.extensions["video_details"]
+    return resolver
+
+
+def create_or_load_video_id(link: str) -> int:
+    """
+    :param link: Youtube ID of the video
+    :return: the id of the video in the database, which is created with
+            placeholder details if it isn't there yet
+    """
+    from videobookmarks.db import get_datamodel
+
+    datamodel = get_datamodel()
+    video_id = datamodel.load_video_id(link)
+    if video_id is not None:
+        return video_id
+    placeholder = placeholder_details(link)
+    video_id, created = datamodel.create_pending_video_id(
+        link, placeholder["thumbnail_url"], placeholder["title"]
+    )
+    if created:
+        get_video_details_resolver().submit(video_id, link)
+    return video_id
+
+
+def init_app_video_details(app: Flask) -> None:
+    """
+    Create the video details resolver of the app. This is called by the
+    application factory, after init_app_metrics.
+    """
+    from videobookmarks.tag import YT_MAX_VIDEOS_PER_CALL
+
+    provider: Union[str, VideoResolver] = app.config["VIDEO_DETAILS_PROVIDER"]
+    if isinstance(provider, str):
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown VIDEO_DETAILS_PROVIDER {provider!r}")
+        provider = PROVIDERS[provider]
+
+    app.extensions["video_details"] = VideoDetailsResolver(
+        app,
+        provider,
+        workers=app.config["VIDEO_DETAILS_WORKERS"],
+        max_calls_per_second=app.config["VIDEO_DETAILS_MAX_CALLS_PER_SECOND"],
+        max_attempts=app.config["VIDEO_DETAILS_MAX_ATTEMPTS"],
+        retry_delay=app.config["VIDEO_DETAILS_RETRY_DELAY"],
+        batch_size=YT_MAX_VIDEOS_PER_CALL,
+        registry=app.extensions.get("metrics"),
+    )
@@ -0,0 +1,87 @@
+"""
+Work done in create_app so that the first requests of a new worker are as
+fast as the ones after them.
+
+Without it, the first request to each page compiles its templates, the
+first requests of a worker open their database connections one by one,
+and the first query of each kind reads its pages from disk. With WARM_UP,
+create_app instead:
+
+- compiles every template, loading them from the bytecode cache in the
+  instance folder when TEMPLATE_BYTECODE_CACHE is set, so that only the
+  first worker after a template changed compiles it
+- opens the connection pool and waits for DB_POOL_MIN_SIZE connections
+- runs the queries of the index page once
+- starts listening for tag list events, which the page cache needs
+
+create_app should be called in each worker (e.g. gunicorn without
+--preload): the pool and event threads don't survive a fork.
+"""
+
+import logging
+import os
+import time
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+from psycopg import OperationalError
+from psycopg_pool import PoolTimeout
+
+from videobookmarks.datamodel.datamodel import TAG_LIST_SORTS
+
+logger = logging.getLogger(__name__)
+
+
+def compile_templates(app: Flask) -> int:
+    """
+    :return: how many templates were compiled
+    """
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm_up_database(app: Flask) -> None:
+    """
+    Open the connection pool and run the queries of the index page.
+    """
+    from videobookmarks.db import get_datamodel, get_db_pool
+
+    with app.app_context():
+        pool = get_db_pool()
+        if pool is not None:
+            pool.wait(timeout=app.config["DB_POOL_TIMEOUT"])
+        datamodel = get_datamodel()
+        for sort in TAG_LIST_SORTS:
+            datamodel.get_tag_list_page(sort, app.config["TAG_LIST_PAGE_SIZE"], None)
+
+
+def warm_up(app: Flask) -> None:
+    start = time.perf_counter()
+    templates = compile_templates(app)
+    try:
+        warm_up_database(app)
+    except (OperationalError, PoolTimeout):
+        # the app can still start, requests will connect when they need to
+        logger.exception("Could not warm up the database connections")
+    if app.config["FRAGMENT_CACHE_MAX_BYTES"] > 0:
+        app.extensions["event_broker"].start()
+    logger.info(
+        "Warmed up %d templates and the database in %.3fs",
+        templates,
+        time.perf_counter() - start,
+    )
+
+
+def init_app_warm_up(app: Flask) -> None:
+    """
+    Set up the template bytecode cache and warm up the app if WARM_UP is set.
+    This is called last by the application factory.
+    """
+    if app.config["TEMPLATE_BYTECODE_CACHE"]:
+        directory = os.path.join(app.instance_path, "jinja_cache")
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if app.config["WARM_UP"]:
+        warm_up(app)